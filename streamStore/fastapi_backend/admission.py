@@ -0,0 +1,209 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from confluent_kafka import ConsumerGroupTopicPartitions, TopicPartition
+from kafka_clients import make_admin, make_consumer
+from metrics import counter, gauge
+
+# Per-client token bucket: sustained checkouts per second and burst size (0 disables)
+CHECKOUT_RATE_PER_CLIENT = float(os.getenv("CHECKOUT_RATE_PER_CLIENT", "20"))
+CHECKOUT_BURST_PER_CLIENT = int(os.getenv("CHECKOUT_BURST_PER_CLIENT", "40"))
+# Buckets kept for at most this many clients (least recently seen are dropped)
+CHECKOUT_TRACKED_CLIENTS = int(os.getenv("CHECKOUT_TRACKED_CLIENTS", "10000"))
+
+# Checkouts running at once, and how many more may wait for a slot (and for how long)
+CHECKOUT_CONCURRENCY = int(os.getenv("CHECKOUT_CONCURRENCY", "32"))
+CHECKOUT_QUEUE_SIZE = int(os.getenv("CHECKOUT_QUEUE_SIZE", "256"))
+CHECKOUT_QUEUE_TIMEOUT_SECONDS = float(os.getenv("CHECKOUT_QUEUE_TIMEOUT_SECONDS", "2"))
+
+# Checkouts are refused while the pipeline behind them is further behind than this
+ADMISSION_MAX_OUTBOX = int(os.getenv("ADMISSION_MAX_OUTBOX", "20000"))
+ADMISSION_MAX_PRODUCER_QUEUE = int(os.getenv("ADMISSION_MAX_PRODUCER_QUEUE", "50000"))
+ADMISSION_MAX_CONSUMER_LAG = int(os.getenv("ADMISSION_MAX_CONSUMER_LAG", "50000"))
+ADMISSION_SAMPLE_SECONDS = float(os.getenv("ADMISSION_SAMPLE_SECONDS", "2"))
+
+checkouts_rejected = counter("checkout_rejected_total", "Checkouts refused by admission control", ["reason"])
+checkouts_waiting = gauge("checkout_queue_waiting", "Checkouts waiting for a free slot")
+backlog_seen = gauge("admission_backlog", "Pipeline backlog as last sampled by admission control", ["source"])
+
+class Overloaded(Exception):
+    """A checkout was refused; the client should retry after `retry_after` seconds."""
+
+    def __init__(self, reason, retry_after):
+        super().__init__(f"Checkout refused ({reason}), retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def take(self, now):
+        """Take one token. Returns 0 on success, else the seconds until one is available."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+class BacklogMonitor:
+    """
+    Samples, in a background thread, how far behind the pipeline is: rows
+    waiting in the outbox and the lag of `group` on `topic` (committed
+    offset to high watermark, per partition). The drain rate is the
+    committed offsets' progress between samples, which turns a backlog
+    into a Retry-After estimate.
+
+    The group's offsets are read through the admin API; the monitor's own
+    consumer only fetches metadata and watermarks under a group id of its
+    own, so it never joins or commits for the group it watches.
+    """
+
+    def __init__(self, storage, topic, group, interval=ADMISSION_SAMPLE_SECONDS):
+        self.storage = storage
+        self.topic = topic
+        self.group = group
+        self.interval = interval
+        self.consumer = make_consumer({"group.id": f"{group}-lag-monitor", "enable.auto.commit": False})
+        self.admin = make_admin()
+        self.outbox = 0
+        self.consumer_lag = 0
+        self.drain_rate = 0.0  # order messages committed per second
+        self._committed = None  # (sampled at, sum of committed offsets)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="backlog-monitor", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+            self._thread = None
+        self.consumer.close()
+
+    def sample(self):
+        self.outbox = self.storage.outbox_size()
+        backlog_seen.set(self.outbox, source="outbox")
+
+        metadata = self.consumer.list_topics(self.topic, timeout=5).topics.get(self.topic)
+        if metadata is None or metadata.error is not None:
+            return
+        partitions = [TopicPartition(self.topic, p) for p in metadata.partitions]
+        lag = 0
+        committed_sum = 0
+        request = ConsumerGroupTopicPartitions(self.group, partitions)
+        offsets = self.admin.list_consumer_group_offsets([request], request_timeout=5)[self.group].result()
+        for tp in offsets.topic_partitions:
+            low, high = self.consumer.get_watermark_offsets(tp, timeout=5, cached=False)
+            committed = tp.offset if tp.offset >= 0 else low
+            lag += max(high - committed, 0)
+            committed_sum += committed
+
+        now = time.monotonic()
+        if self._committed is not None and now > self._committed[0]:
+            self.drain_rate = max(committed_sum - self._committed[1], 0) / (now - self._committed[0])
+        self._committed = (now, committed_sum)
+        self.consumer_lag = lag
+        backlog_seen.set(lag, source="consumer_lag")
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"⚠️ Backlog monitor could not sample: {e}")
+            self._stop.wait(self.interval)
+
+class AdmissionController:
+    """
+    Decides whether a checkout may run, so overload turns into fast 429s
+    instead of timeouts:
+
+      - each client has a token bucket (CHECKOUT_RATE_PER_CLIENT/s, bursts
+        of CHECKOUT_BURST_PER_CLIENT)
+      - checkouts are refused while the outbox, the producer queue or the
+        consumer lag (as sampled by `monitor`) is over its limit
+      - at most CHECKOUT_CONCURRENCY checkouts run at once; up to
+        CHECKOUT_QUEUE_SIZE more wait for a slot, anything beyond is refused
+
+    Use as `async with admission.admit(client): ...`; refusals raise Overloaded.
+    """
+
+    def __init__(self, producer=None, monitor=None):
+        self.producer = producer
+        self.monitor = monitor
+        self._buckets = OrderedDict()  # client -> TokenBucket, least recently seen first
+        self._slots = None
+        self._waiting = 0
+        checkouts_waiting.set_function(lambda: self._waiting)
+
+    def check_rate(self, client):
+        if CHECKOUT_RATE_PER_CLIENT <= 0:
+            return
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(CHECKOUT_RATE_PER_CLIENT, CHECKOUT_BURST_PER_CLIENT)
+            if len(self._buckets) > CHECKOUT_TRACKED_CLIENTS:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+        wait = bucket.take(time.monotonic())
+        if wait:
+            raise Overloaded("rate_limited", math.ceil(wait))
+
+    def check_backlog(self):
+        if self.producer is not None and len(self.producer) > ADMISSION_MAX_PRODUCER_QUEUE:
+            raise Overloaded("producer_queue", 1)
+        monitor = self.monitor
+        if monitor is None:
+            return
+        if monitor.outbox > ADMISSION_MAX_OUTBOX:
+            raise Overloaded("outbox_backlog", math.ceil(monitor.interval))
+        if monitor.consumer_lag > ADMISSION_MAX_CONSUMER_LAG:
+            excess = monitor.consumer_lag - ADMISSION_MAX_CONSUMER_LAG
+            # Until the consumer has worked the lag back under the limit
+            retry_after = excess / monitor.drain_rate if monitor.drain_rate else monitor.interval
+            raise Overloaded("consumer_lag", min(math.ceil(retry_after), 60))
+
+    @asynccontextmanager
+    async def admit(self, client):
+        """Check the client's rate and the backlog, then hold a checkout slot for the block."""
+        try:
+            self.check_rate(client)
+            self.check_backlog()
+            await self._acquire()
+        except Overloaded as e:
+            checkouts_rejected.inc(reason=e.reason)
+            raise
+        try:
+            yield
+        finally:
+            self._slots.release()
+
+    async def _acquire(self):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(CHECKOUT_CONCURRENCY)
+        if not self._slots.locked():
+            await self._slots.acquire()  # a slot is free: returns without suspending
+            return
+        if self._waiting >= CHECKOUT_QUEUE_SIZE:
+            raise Overloaded("queue_full", 1)
+        self._waiting += 1
+        try:
+            await asyncio.wait_for(self._slots.acquire(), CHECKOUT_QUEUE_TIMEOUT_SECONDS)
+        except asyncio.TimeoutError:
+            raise Overloaded("queue_timeout", 1) from None
+        finally:
+            self._waiting -= 1
@@ -0,0 +1,449 @@
+"""
+Real-time sales analytics over the sales change topic (SALES_CDC_TOPIC,
+published by cdc.py), so only order lines the consumer actually sold are
+counted: lines it rejected or dead-lettered never reach the sales table.
+
+Keeps revenue and units per product and per category in event-time windows:
+
+  - tumbling windows of ANALYTICS_BUCKET_SECONDS, emitted once they close
+  - a sliding window over the last ANALYTICS_SLIDING_BUCKETS buckets,
+    re-emitted whenever it changes
+
+Event time is the sale's sale_date. The change topic is delivered at least
+once, and sale_ids only grow within a storage shard, so a sale at or below
+the highest sale_id already counted for its shard is a republish and is
+skipped.
+
+Aggregation is incremental: every sale updates its bucket and the
+running sliding totals, and buckets are forgotten once they are closed and
+have slid out of the window, so memory is bounded by the number of buckets
+times the number of products and categories.
+
+Results go to the compacted ANALYTICS_TOPIC (latest value per window kind
+and key) and are served at http://0.0.0.0:ANALYTICS_PORT/windows/... State
+and input offsets are checkpointed to ANALYTICS_STATE_DIR, so a restart
+resumes where the checkpoint left off instead of recounting.
+
+    python analytics.py
+"""
+import json
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+from confluent_kafka import KafkaError, KafkaException, TopicPartition
+from confluent_kafka.admin import NewTopic
+from kafka_clients import make_admin, make_consumer, make_producer
+from metrics import counter, histogram, render, CONTENT_TYPE
+from storage import get_storage
+from settings import SALES_CDC_TOPIC, ANALYTICS_TOPIC
+
+BUCKET_SECONDS = int(os.getenv("ANALYTICS_BUCKET_SECONDS", "60"))
+SLIDING_BUCKETS = int(os.getenv("ANALYTICS_SLIDING_BUCKETS", "5"))
+# Events may arrive this late (in event time) and still be counted
+LATENESS_SECONDS = int(os.getenv("ANALYTICS_LATENESS_SECONDS", "30"))
+CHECKPOINT_SECONDS = float(os.getenv("ANALYTICS_CHECKPOINT_SECONDS", "10"))
+PUBLISH_SECONDS = float(os.getenv("ANALYTICS_PUBLISH_SECONDS", "1"))
+STATE_DIR = os.getenv("ANALYTICS_STATE_DIR", "analytics-state")
+PORT = int(os.getenv("ANALYTICS_PORT", "8100"))
+
+DIMENSIONS = ("product", "category")
+
+analytics_lines = counter("analytics_order_lines_total", "Order lines aggregated into windows")
+analytics_late_lines = counter("analytics_late_order_lines_total", "Order lines dropped because their window had closed")
+analytics_skipped_lines = counter(
+    "analytics_skipped_order_lines_total", "Sales not aggregated because they were invalid or already counted", ["reason"]
+)
+checkpoint_seconds = histogram("analytics_checkpoint_duration_seconds", "Time to write one analytics checkpoint")
+
+class WindowAggregator:
+    """
+    Tumbling and sliding windows of [revenue, units] per (dimension, key),
+    where dimension is "product" or "category".
+    """
+
+    def __init__(self, bucket_seconds=BUCKET_SECONDS, sliding_buckets=SLIDING_BUCKETS, lateness=LATENESS_SECONDS):
+        self.bucket_seconds = bucket_seconds
+        self.span = bucket_seconds * sliding_buckets
+        self.lateness = lateness
+        self.buckets = {}           # bucket start -> {(dimension, key): [revenue, units]}
+        self.in_window = set()      # bucket starts counted in self.sliding
+        self.sliding = {}           # (dimension, key) -> [revenue, units] over the sliding window
+        self.dirty = set()          # sliding keys changed since the last publish
+        self.tumbling = {}          # (dimension, key) -> latest closed tumbling window
+        self.closed = []            # tumbling windows closed since the last publish
+        self.head = None            # start of the newest bucket
+        self.closed_through = None  # start of the newest closed bucket
+        self.max_event = 0.0        # newest event time seen (seconds)
+
+    def bucket_of(self, event_s):
+        return int(event_s // self.bucket_seconds) * self.bucket_seconds
+
+    def add(self, event_s, product_id, category, units, revenue):
+        """Count one order line. Returns False if its window has already closed."""
+        start = self.bucket_of(event_s)
+        if self.closed_through is not None and start <= self.closed_through:
+            return False
+        self.max_event = max(self.max_event, event_s)
+        if self.head is None or start > self.head:
+            self._advance(start)
+
+        bucket = self.buckets.setdefault(start, {})
+        counted = start > self.head - self.span
+        if counted:
+            self.in_window.add(start)
+        for key in (("product", product_id), ("category", category)):
+            totals = bucket.setdefault(key, [0.0, 0])
+            totals[0] += revenue
+            totals[1] += units
+            if counted:
+                totals = self.sliding.setdefault(key, [0.0, 0])
+                totals[0] += revenue
+                totals[1] += units
+                self.dirty.add(key)
+        return True
+
+    def tick(self, now_s, idle):
+        """
+        Close tumbling windows that the watermark (newest event time minus the
+        allowed lateness) has passed. When no events have arrived for a while,
+        wall-clock time moves the watermark instead, so windows still close
+        and the sliding window drains.
+        """
+        if idle and now_s > self.max_event:
+            self.max_event = now_s
+            if self.head is None or self.bucket_of(now_s) > self.head:
+                self._advance(self.bucket_of(now_s))
+
+        watermark = self.max_event - self.lateness
+        for start in sorted(self.buckets):
+            if start + self.bucket_seconds > watermark:
+                break
+            if self.closed_through is not None and start <= self.closed_through:
+                continue
+            self.closed_through = start
+            for key, (revenue, units) in self.buckets[start].items():
+                window = self._result("tumbling", key, start, start + self.bucket_seconds, revenue, units)
+                self.tumbling[key] = window
+                self.closed.append(window)
+        if self.closed_through is not None:
+            self.closed_through = max(self.closed_through, self.bucket_of(watermark) - self.bucket_seconds)
+        self._forget()
+
+    def _advance(self, head):
+        """Move the newest bucket to `head`, sliding old buckets out of the window."""
+        self.head = head
+        floor = head - self.span
+        for start in [s for s in self.in_window if s <= floor]:
+            self.in_window.discard(start)
+            for key, (revenue, units) in self.buckets.get(start, {}).items():
+                totals = self.sliding.get(key)
+                if totals is None:
+                    continue  # already emptied and published as zero
+                totals[0] -= revenue
+                totals[1] -= units
+                self.dirty.add(key)
+        self._forget()
+
+    def _forget(self):
+        # Closed buckets outside the sliding window are no longer needed
+        if self.closed_through is None:
+            return
+        for start in [s for s in self.buckets if s <= self.closed_through and s not in self.in_window]:
+            del self.buckets[start]
+
+    def _result(self, kind, key, start, end, revenue, units):
+        return {
+            "window": kind, "dimension": key[0], "key": key[1],
+            "start": start, "end": end, "revenue": round(revenue, 2), "units": units,
+        }
+
+    def sliding_window(self, key):
+        revenue, units = self.sliding.get(key, (0.0, 0))
+        end = (self.head or 0) + self.bucket_seconds
+        return self._result("sliding", key, end - self.span, end, revenue, units)
+
+    def take_updates(self):
+        """Windows to publish since the last call: closed tumbling windows, then changed sliding totals."""
+        updates = self.closed
+        self.closed = []
+        for key in self.dirty:
+            updates.append(self.sliding_window(key))
+            if self.sliding.get(key, (0, 0))[1] == 0:
+                # Nothing left in the window; the published zero is its last value
+                self.sliding.pop(key, None)
+        self.dirty = set()
+        return updates
+
+    def snapshot(self):
+        return {
+            "bucket_seconds": self.bucket_seconds,
+            "span": self.span,
+            "head": self.head,
+            "closed_through": self.closed_through,
+            "max_event": self.max_event,
+            "buckets": {str(start): [[*key, *totals] for key, totals in bucket.items()]
+                        for start, bucket in self.buckets.items()},
+            "tumbling": list(self.tumbling.values()),
+        }
+
+    def restore(self, state):
+        if state["bucket_seconds"] != self.bucket_seconds or state["span"] != self.span:
+            print("⚠️ Window sizes changed since the last checkpoint; starting analytics state afresh")
+            return False
+        self.head = state["head"]
+        self.closed_through = state["closed_through"]
+        self.max_event = state["max_event"]
+        self.buckets = {
+            int(start): {(dimension, key): [revenue, units] for dimension, key, revenue, units in entries}
+            for start, entries in state["buckets"].items()
+        }
+        self.tumbling = {(w["dimension"], w["key"]): w for w in state["tumbling"]}
+        # The sliding totals are the sum of the buckets still in the window
+        floor = self.head - self.span if self.head is not None else None
+        self.in_window = {start for start in self.buckets if floor is not None and start > floor}
+        self.sliding = {}
+        for start in self.in_window:
+            for key, (revenue, units) in self.buckets[start].items():
+                totals = self.sliding.setdefault(key, [0.0, 0])
+                totals[0] += revenue
+                totals[1] += units
+        return True
+
+def sale_time(sale_date, default):
+    """Epoch seconds of a SQLite CURRENT_TIMESTAMP (UTC), or `default` if it does not parse."""
+    try:
+        return datetime.strptime(sale_date, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc).timestamp()
+    except (TypeError, ValueError):
+        return default
+
+class SalesAnalytics:
+    """Consumes sales, feeds the WindowAggregator, publishes results and checkpoints."""
+
+    def __init__(self, stop_event):
+        self.stop_event = stop_event
+        self.consumer = make_consumer({
+            "group.id": "sales-analytics",
+            "auto.offset.reset": "earliest",
+            "enable.auto.commit": False,
+            "partition.assignment.strategy": "cooperative-sticky",
+        })
+        self.producer = make_producer({"linger.ms": 50, "compression.type": "lz4"})
+        self.storage = get_storage()
+        self.aggregator = WindowAggregator()
+        self.lock = threading.Lock()  # guards the aggregator against the query server
+        self.offsets = {}             # (topic, partition) -> next offset reflected in the state
+        self.sales_seen = {}          # shard -> highest sale_id reflected in the state
+        self.categories = {}          # product_id -> category
+        self.checkpoint_path = os.path.join(STATE_DIR, "analytics-checkpoint.json")
+
+    def category_of(self, product_id):
+        category = self.categories.get(product_id)
+        if category is None:
+            product = self.storage.get_product(product_id)
+            category = self.categories[product_id] = (product or {}).get("category") or "unknown"
+        return category
+
+    def restore(self):
+        if not os.path.exists(self.checkpoint_path):
+            return
+        with open(self.checkpoint_path) as f:
+            state = json.load(f)
+        if self.aggregator.restore(state["windows"]):
+            self.offsets = {(topic, int(partition)): offset
+                            for topic, partition, offset in state["offsets"]}
+            self.sales_seen = {int(shard): sale_id for shard, sale_id in state.get("sales_seen", {}).items()}
+            print(f"🟢 Restored analytics checkpoint from {time.ctime(state['written_at'])}")
+
+    def checkpoint(self):
+        """Write state and offsets atomically, then commit the offsets to Kafka for lag monitoring."""
+        with checkpoint_seconds.time():
+            with self.lock:
+                state = {
+                    "written_at": time.time(),
+                    "offsets": [[topic, partition, offset] for (topic, partition), offset in self.offsets.items()],
+                    "sales_seen": self.sales_seen,
+                    "windows": self.aggregator.snapshot(),
+                }
+            os.makedirs(STATE_DIR, exist_ok=True)
+            tmp = self.checkpoint_path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump(state, f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.checkpoint_path)
+        if self.offsets:
+            try:
+                self.consumer.commit(offsets=[TopicPartition(t, p, o) for (t, p), o in self.offsets.items()],
+                                     asynchronous=True)
+            except KafkaException as e:
+                print(f"❌ Analytics offset commit failed: {e}")
+
+    def on_assign(self, consumer, partitions):
+        # The checkpoint, not the group's committed offsets, says what the state already counts
+        for p in partitions:
+            offset = self.offsets.get((p.topic, p.partition))
+            if offset is not None:
+                p.offset = offset
+        consumer.incremental_assign(partitions)
+        print(f"🟢 Analytics assigned partitions: {sorted(p.partition for p in partitions)}")
+
+    def ensure_topic(self):
+        """Create the compacted results topic if it does not exist yet."""
+        admin = make_admin()
+        topic = NewTopic(ANALYTICS_TOPIC, num_partitions=1, replication_factor=1,
+                         config={"cleanup.policy": "compact"})
+        for future in admin.create_topics([topic]).values():
+            try:
+                future.result(10)
+            except KafkaException as e:
+                if e.args[0].code() != KafkaError.TOPIC_ALREADY_EXISTS:
+                    print(f"⚠️ Could not create {ANALYTICS_TOPIC}: {e}")
+
+    def apply(self, msg):
+        """Count one sale from the sales change topic, unless it is invalid or already counted."""
+        try:
+            sale = json.loads(msg.value())
+            shard, sale_id = int(sale.get("shard", 0)), sale["sale_id"]
+            product_id, units, price = sale["product_id"], sale["quantity"], float(sale["unit_price"])
+        except (KeyError, TypeError, ValueError):
+            analytics_skipped_lines.inc(reason="invalid")
+            return
+        # The same checks consumer.parse_orders applies before selling a line
+        if not isinstance(product_id, int) or not isinstance(units, int) or units <= 0:
+            analytics_skipped_lines.inc(reason="invalid")
+            return
+        if sale_id <= self.sales_seen.get(shard, 0):
+            analytics_skipped_lines.inc(reason="duplicate")
+            return
+        self.sales_seen[shard] = sale_id
+
+        event_s = sale_time(sale.get("sale_date"), msg.timestamp()[1] / 1000.0)
+        if self.aggregator.add(event_s, product_id, self.category_of(product_id), units, units * price):
+            analytics_lines.inc()
+        else:
+            analytics_late_lines.inc()
+
+    def publish(self, updates):
+        for window in updates:
+            self.producer.produce(
+                ANALYTICS_TOPIC,
+                key=f"{window['window']}:{window['dimension']}:{window['key']}",
+                value=json.dumps(window).encode("utf-8"),
+            )
+        self.producer.poll(0)
+
+    def run(self):
+        self.restore()
+        self.ensure_topic()
+        self.consumer.subscribe([SALES_CDC_TOPIC], on_assign=self.on_assign)
+        last_event = time.monotonic()
+        next_publish = time.monotonic() + PUBLISH_SECONDS
+        next_checkpoint = time.monotonic() + CHECKPOINT_SECONDS
+        try:
+            while not self.stop_event.is_set():
+                batch = self.consumer.consume(num_messages=500, timeout=0.5)
+                with self.lock:
+                    for msg in batch:
+                        if msg.error():
+                            if msg.error().code() != KafkaError._PARTITION_EOF:
+                                print(f"❌ Analytics Kafka Error: {msg.error()}")
+                            continue
+                        self.apply(msg)
+                        self.offsets[(msg.topic(), msg.partition())] = msg.offset() + 1
+                        last_event = time.monotonic()
+                    idle = time.monotonic() - last_event > LATENESS_SECONDS
+                    self.aggregator.tick(time.time(), idle)
+
+                now = time.monotonic()
+                if now >= next_publish:
+                    with self.lock:
+                        updates = self.aggregator.take_updates()
+                    self.publish(updates)
+                    next_publish = now + PUBLISH_SECONDS
+                if now >= next_checkpoint:
+                    # Results are published before the state that produced them is checkpointed
+                    self.producer.flush(10)
+                    self.checkpoint()
+                    next_checkpoint = now + CHECKPOINT_SECONDS
+        finally:
+            with self.lock:
+                updates = self.aggregator.take_updates()
+            self.publish(updates)
+            self.producer.flush(10)
+            self.checkpoint()
+            self.consumer.close()
+            print("🔴 Analytics stopped")
+
+    def query(self, kind, dimension, limit):
+        """Current windows of `kind` ("sliding" or "tumbling") for one dimension, by revenue."""
+        with self.lock:
+            if kind == "sliding":
+                windows = [self.aggregator.sliding_window(key)
+                           for key in self.aggregator.sliding if key[0] == dimension]
+            else:
+                windows = [w for key, w in self.aggregator.tumbling.items() if key[0] == dimension]
+        windows.sort(key=lambda w: w["revenue"], reverse=True)
+        return windows[:limit]
+
+def start_query_server(analytics, port=PORT):
+    """
+    Serve GET /windows/{sliding,tumbling}?by=product|category&limit=N and
+    /metrics from a daemon thread.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            if url.path == "/metrics":
+                self._send(200, render().encode("utf-8"), CONTENT_TYPE)
+                return
+            parts = url.path.strip("/").split("/")
+            params = parse_qs(url.query)
+            dimension = params.get("by", ["product"])[0]
+            if len(parts) != 2 or parts[0] != "windows" or parts[1] not in ("sliding", "tumbling") \
+                    or dimension not in DIMENSIONS:
+                self.send_error(404)
+                return
+            try:
+                limit = int(params.get("limit", ["100"])[0])
+            except ValueError:
+                self.send_error(400, "limit must be an integer")
+                return
+            body = json.dumps(analytics.query(parts[1], dimension, limit)).encode("utf-8")
+            self._send(200, body, "application/json")
+
+        def _send(self, status, body, content_type):
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name=f"analytics-{port}", daemon=True).start()
+    return server
+
+def run():
+    stop_event = threading.Event()
+
+    def stop(signum, frame):
+        print("\n🔴 Stopping analytics gracefully...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    analytics = SalesAnalytics(stop_event)
+    start_query_server(analytics)
+    print(f"📊 Analytics at http://0.0.0.0:{PORT}/windows/sliding?by=category")
+    analytics.run()
+
+if __name__ == "__main__":
+    run()
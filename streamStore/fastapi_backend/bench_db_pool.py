@@ -0,0 +1,71 @@
+"""
+Microbenchmark: per-call sqlite3.connect vs the shared connection pool.
+
+Runs the checkout-path price lookup against a scratch copy of the schema,
+first opening a fresh connection for every call (the old db_config
+behaviour) and then borrowing from db_pool.
+
+    python bench_db_pool.py --calls 20000 --threads 1 4 8
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+from db_config import create_database, add_sample_data, query_individual_item_price
+from db_pool import close_all_pools
+
+def price_per_call_connect(db_name, product_id):
+    """The pre-pool implementation of query_individual_item_price."""
+    conn = sqlite3.connect(db_name)
+    conn.row_factory = sqlite3.Row
+    cursor = conn.cursor()
+    cursor.execute("SELECT * FROM inventory WHERE product_id = ?", (product_id,))
+    result = cursor.fetchone()
+    conn.close()
+    return result["price"] if result else None
+
+def price_pooled(db_name, product_id):
+    return query_individual_item_price(db_name, product_id)
+
+def run(lookup, db_name, calls, threads):
+    """Run `calls` lookups split across `threads` threads; return calls per second."""
+    per_thread = calls // threads
+
+    def worker():
+        for i in range(per_thread):
+            lookup(db_name, i % 10 + 1)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 4, 8])
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_name = os.path.join(tmp, "bench.db")
+        create_database(db_name)
+        add_sample_data(db_name)
+
+        print(f"\n{'threads':>8} | {'connect/call':>14} | {'pooled':>14} | {'speedup':>8}")
+        print("-" * 54)
+        for threads in args.threads:
+            baseline = run(price_per_call_connect, db_name, args.calls, threads)
+            pooled = run(price_pooled, db_name, args.calls, threads)
+            print(f"{threads:>8} | {baseline:>10,.0f} /s | {pooled:>10,.0f} /s | {pooled / baseline:>7.1f}x")
+
+        close_all_pools()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Benchmark: consumer batch throughput when a few products take most orders
+(flash sale) versus orders spread over the whole catalog.
+
+Order messages are applied with consumer.process_batch against a scratch
+SQLite database, without a broker. Reports order lines per second.
+
+    python bench_hot_products.py --batches 40 --batch-size 500 --hot 3
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import uuid
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--batches", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--hot", type=int, default=3, help="products taking every order in the hot run")
+    parser.add_argument("--shards", type=int, default=1)
+    args = parser.parse_args()
+
+    os.environ["DB_NAME"] = os.path.join(tempfile.mkdtemp(prefix="streamstore-bench-"), "bench.db")
+    os.environ["STORAGE_SHARDS"] = str(args.shards)
+
+    # Imported only now so they pick up the scratch database
+    import consumer
+    from fake_kafka import FakeMessage
+    from order_codec import encode_order
+    from storage import get_storage
+
+    storage = get_storage()
+    storage.create()
+    product_ids = storage.add_products(
+        [(f"Product {i}", "Bench", 1.0, 10 ** 9, "Bench") for i in range(args.products)]
+    )
+
+    offset = 0
+    for label, choices in (("uniform", product_ids), ("hot", product_ids[:args.hot])):
+        messages = []
+        for _ in range(args.batches * args.batch_size):
+            product_id = random.choice(choices)
+            value = encode_order(str(uuid.uuid4()), [(product_id, 1, 1.0)])
+            messages.append(FakeMessage("orders", 0, offset, None, value, None))
+            offset += 1
+
+        start = time.perf_counter()
+        for i in range(args.batches):
+            consumer.process_batch(storage, messages[i * args.batch_size:(i + 1) * args.batch_size], {}, [])
+        elapsed = time.perf_counter() - start
+        print(f"{label:>8}: {len(messages) / elapsed:>10,.0f} lines/s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Benchmark: legacy JSON-per-line order messages vs the binary cart envelope.
+
+For each cart size it reports the bytes sent on the wire per order and the
+encode/decode throughput in orders per second.
+
+    python bench_order_codec.py --orders 50000 --cart-sizes 1 3 10
+"""
+import argparse
+import json
+import time
+import uuid
+
+from order_codec import encode_order, decode_order
+
+def make_cart(size):
+    return [(product_id, product_id % 5 + 1, 9.99 + product_id) for product_id in range(1, size + 1)]
+
+def encode_json(order_id, items):
+    """The legacy format: one JSON message per cart line."""
+    return [
+        json.dumps({"order_id": order_id, "product_id": p, "quantity": q, "unit_price": u}).encode("utf-8")
+        for p, q, u in items
+    ]
+
+def decode_json(messages):
+    return [json.loads(m.decode("utf-8")) for m in messages]
+
+def rate(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return n / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--orders", type=int, default=50000)
+    parser.add_argument("--cart-sizes", type=int, nargs="+", default=[1, 3, 10])
+    args = parser.parse_args()
+
+    order_id = str(uuid.uuid4())
+
+    print(f"\n{'items':>6} | {'format':>7} | {'msgs':>5} | {'bytes':>6} | {'encode/s':>12} | {'decode/s':>12}")
+    print("-" * 66)
+    for size in args.cart_sizes:
+        items = make_cart(size)
+
+        json_msgs = encode_json(order_id, items)
+        binary = encode_order(order_id, items)
+
+        json_bytes = sum(len(m) for m in json_msgs)
+        json_enc = rate(lambda: encode_json(order_id, items), args.orders)
+        json_dec = rate(lambda: decode_json(json_msgs), args.orders)
+
+        bin_enc = rate(lambda: encode_order(order_id, items), args.orders)
+        bin_dec = rate(lambda: decode_order(binary), args.orders)
+
+        print(f"{size:>6} | {'json':>7} | {len(json_msgs):>5} | {json_bytes:>6} | {json_enc:>12,.0f} | {json_dec:>12,.0f}")
+        print(f"{size:>6} | {'binary':>7} | {1:>5} | {len(binary):>6} | {bin_enc:>12,.0f} | {bin_dec:>12,.0f}")
+
+if __name__ == "__main__":
+    main()
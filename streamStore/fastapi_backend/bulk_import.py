@@ -0,0 +1,125 @@
+"""
+Bulk import of inventory from CSV or Parquet, upserting by SKU.
+
+    python bulk_import.py catalog.parquet
+    python bulk_import.py catalog.csv --chunk-size 100000
+
+Columns: sku, product_name, price and quantity_in_stock (or quantity), plus
+optional category and supplier. A SKU that already exists has its row
+updated; a new SKU gets a new product_id.
+
+The file is read in chunks by pyarrow and validated column-wise; each chunk
+is written with executemany in one transaction, so memory stays bounded by
+the chunk size however large the file is. The category index is dropped
+for the duration of the import and rebuilt once at the end.
+"""
+import argparse
+import os
+import time
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+import pyarrow.parquet as pq
+from storage import get_storage
+
+CHUNK_SIZE = int(os.getenv("BULK_IMPORT_CHUNK_SIZE", "50000"))
+
+# Column -> type it is converted to (CSV) or cast to (Parquet)
+SCHEMA = {
+    "sku": pa.string(),
+    "product_name": pa.string(),
+    "category": pa.string(),
+    "price": pa.float64(),
+    "quantity_in_stock": pa.int64(),
+    "supplier": pa.string(),
+}
+REQUIRED = ("sku", "product_name", "price", "quantity_in_stock")
+ALIASES = {"quantity": "quantity_in_stock"}
+
+def read_chunks(path, file_format, chunk_size):
+    """Yield pyarrow RecordBatches of roughly `chunk_size` rows."""
+    if file_format == "parquet":
+        parquet = pq.ParquetFile(path)
+        columns = [name for name in parquet.schema_arrow.names if ALIASES.get(name, name) in SCHEMA]
+        yield from parquet.iter_batches(batch_size=chunk_size, columns=columns)
+        return
+
+    column_types = {**SCHEMA, **{alias: SCHEMA[name] for alias, name in ALIASES.items()}}
+    reader = pa_csv.open_csv(
+        path,
+        # ~100 bytes per catalog row
+        read_options=pa_csv.ReadOptions(block_size=max(chunk_size * 100, 1 << 20)),
+        convert_options=pa_csv.ConvertOptions(
+            column_types=column_types,
+            strings_can_be_null=True,
+        ),
+    )
+    yield from reader
+
+def prepare(batch):
+    """
+    Normalise a batch to SCHEMA and drop invalid rows (missing required
+    values, negative price or quantity). Returns (rows, rejected count).
+    """
+    columns = {}
+    for name, column in zip(batch.schema.names, batch.columns):
+        name = ALIASES.get(name, name)
+        if name in SCHEMA:
+            columns[name] = column.cast(SCHEMA[name])
+    missing = [name for name in REQUIRED if name not in columns]
+    if missing:
+        raise ValueError(f"Missing required column(s): {', '.join(missing)}")
+    for name in SCHEMA:
+        if name not in columns:
+            columns[name] = pa.nulls(batch.num_rows, SCHEMA[name])
+
+    valid = pc.and_(
+        pc.and_(pc.is_valid(columns["sku"]), pc.is_valid(columns["product_name"])),
+        pc.and_(pc.greater_equal(columns["price"], 0), pc.greater_equal(columns["quantity_in_stock"], 0)),
+    )
+    valid = pc.fill_null(valid, False)
+    table = pa.table(columns).filter(valid)
+    rows = list(zip(*(table.column(name).to_pylist() for name in
+                      ("sku", "product_name", "category", "price", "quantity_in_stock", "supplier"))))
+    return rows, batch.num_rows - table.num_rows
+
+def import_file(storage, path, file_format=None, chunk_size=CHUNK_SIZE):
+    """Import one file; returns {"rows", "inserted", "updated", "rejected", "seconds"}."""
+    file_format = file_format or ("parquet" if path.endswith((".parquet", ".pq")) else "csv")
+    totals = {"rows": 0, "inserted": 0, "updated": 0, "rejected": 0}
+    start = time.perf_counter()
+
+    storage.create()
+    with storage.bulk_load():
+        for batch in read_chunks(path, file_format, chunk_size):
+            rows, rejected = prepare(batch)
+            inserted, updated = storage.upsert_products(rows) if rows else (0, 0)
+            totals["rows"] += batch.num_rows
+            totals["inserted"] += inserted
+            totals["updated"] += updated
+            totals["rejected"] += rejected
+            elapsed = time.perf_counter() - start
+            print(f"📦 {totals['rows']} rows read, {totals['rows'] / elapsed:,.0f} rows/s")
+        print("🔧 Rebuilding indexes...")
+
+    totals["seconds"] = round(time.perf_counter() - start, 3)
+    return totals
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk import inventory from CSV or Parquet, upserting by SKU")
+    parser.add_argument("path")
+    parser.add_argument("--format", choices=("csv", "parquet"), help="default: from the file extension")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="rows per read and per transaction")
+    args = parser.parse_args()
+
+    storage = get_storage()
+    try:
+        totals = import_file(storage, args.path, args.format, args.chunk_size)
+    finally:
+        storage.close()
+    rate = totals["rows"] / totals["seconds"] if totals["seconds"] else 0
+    print(f"✅ Imported {args.path}: {totals['inserted']} inserted, {totals['updated']} updated, "
+          f"{totals['rejected']} rejected in {totals['seconds']}s ({rate:,.0f} rows/s)")
+
+if __name__ == "__main__":
+    main()
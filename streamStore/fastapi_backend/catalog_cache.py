@@ -0,0 +1,196 @@
+import bisect
+import json
+import threading
+import time
+import uuid
+from confluent_kafka import KafkaError
+from kafka_clients import make_consumer
+from settings import INVENTORY_CHANGES_TOPIC
+
+class ProductCatalogCache:
+    """
+    In-memory copy of the inventory, read through a storage backend.
+
+    The whole table is reloaded every `ttl` seconds by a background thread,
+    and single rows are updated in between from inventory-change events
+    published by the order consumer. Reads never touch storage unless a
+    product is missing from the cache.
+
+    Every change bumps `version`, which together with a per-process epoch
+    forms the ETag of the catalog; a reload that finds nothing new keeps it.
+    """
+
+    def __init__(self, storage, ttl=30.0):
+        self.storage = storage
+        self.ttl = ttl
+        self._products = {}       # product_id -> row dict (never mutated once stored)
+        self._view = None         # sorted rows and indexes served to readers, rebuilt lazily
+        self._dirty = True
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+        self._listeners = []      # called with every inventory-change event after it is applied
+        self.loaded_at = 0.0
+        self.version = 0
+        # Versions are only comparable within one process
+        self.epoch = uuid.uuid4().hex[:8]
+
+    def _changed(self):
+        # Caller holds self._lock
+        self._dirty = True
+        self.version += 1
+
+    def refresh(self):
+        """Reload every product from storage."""
+        rows = self.storage.list_products()
+        products = {row['product_id']: row for row in rows}
+        with self._lock:
+            if products != self._products:
+                self._products = products
+                self._changed()
+            self.loaded_at = time.monotonic()
+
+    def _current(self):
+        """
+        (etag, rows, ids, {category: (rows, ids)}) for the current contents.
+        Rows are sorted by product_id and `ids` are their product_ids, for keyset lookups.
+        """
+        if self._dirty:
+            with self._lock:
+                if self._dirty:
+                    rows = sorted(self._products.values(), key=lambda row: row['product_id'])
+                    by_category = {}
+                    for row in rows:
+                        by_category.setdefault(row['category'], []).append(row)
+                    self._view = (
+                        f'"{self.epoch}-{self.version}"',
+                        rows,
+                        [row['product_id'] for row in rows],
+                        {category: (rs, [row['product_id'] for row in rs]) for category, rs in by_category.items()},
+                    )
+                    self._dirty = False
+        return self._view
+
+    def etag(self):
+        return self._current()[0]
+
+    def all_products(self):
+        """Return every product as a list of dicts (shared, do not mutate)."""
+        return self._current()[1]
+
+    def page(self, category=None, after=None, limit=None):
+        """
+        Keyset page of products ordered by product_id: those with an id greater
+        than `after`, optionally only from `category`, at most `limit` of them.
+        Returns (etag, rows); the rows are shared, do not mutate.
+        """
+        etag, rows, ids, by_category = self._current()
+        if category is not None:
+            rows, ids = by_category.get(category, ([], []))
+        start = bisect.bisect_right(ids, after) if after is not None else 0
+        end = start + limit if limit is not None else len(rows)
+        return etag, rows[start:end]
+
+    def get_product(self, product_id):
+        """Return one product dict, loading it from storage on a cache miss."""
+        row = self._products.get(product_id)
+        if row is None:
+            row = self.invalidate(product_id)
+        return row
+
+    def get_price(self, product_id):
+        row = self.get_product(product_id)
+        return row['price'] if row else None
+
+    def get_stock(self, product_id):
+        row = self.get_product(product_id)
+        return row['quantity_in_stock'] if row else None
+
+    def get_prices(self, product_ids):
+        """Return {product_id: price or None} for several products at once."""
+        return {product_id: self.get_price(product_id) for product_id in product_ids}
+
+    def get_stocks(self, product_ids):
+        """Return {product_id: quantity_in_stock or None} for several products at once."""
+        return {product_id: self.get_stock(product_id) for product_id in product_ids}
+
+    def invalidate(self, product_id):
+        """Reload a single row from storage; returns the new row or None if it was deleted."""
+        row = self.storage.get_product(product_id)
+        with self._lock:
+            if row is None:
+                if self._products.pop(product_id, None) is not None:
+                    self._changed()
+            elif self._products.get(product_id) != row:
+                self._products[product_id] = row
+                self._changed()
+        return row
+
+    def apply_change(self, event):
+        """Apply an inventory-change event ({"product_id", "quantity_in_stock", "order_ids"})."""
+        product_id = event['product_id']
+        with self._lock:
+            row = self._products.get(product_id)
+            if row is not None:
+                if row['quantity_in_stock'] != event['quantity_in_stock']:
+                    # Replace rather than mutate so lists already handed out stay consistent
+                    self._products[product_id] = {**row, 'quantity_in_stock': event['quantity_in_stock']}
+                    self._changed()
+                return
+        # Not cached yet (e.g. a product added after the last refresh)
+        self.invalidate(product_id)
+
+    def add_listener(self, callback):
+        """Also pass every inventory-change event to `callback` (from the listener thread)."""
+        self._listeners.append(callback)
+
+    def start(self):
+        """Load the table and start the TTL refresh and change-listener threads."""
+        self.refresh()
+        self._stop.clear()
+        self._threads = [
+            threading.Thread(target=self._refresh_loop, name="catalog-refresh", daemon=True),
+            threading.Thread(target=self._listen_loop, name="catalog-listener", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout=5)
+        self._threads = []
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.ttl):
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"❌ Catalog refresh failed: {e}")
+
+    def _listen_loop(self):
+        # Every backend process needs every event, so each one gets its own group
+        consumer = make_consumer({
+            "group.id": f"catalog-cache-{uuid.uuid4()}",
+            "auto.offset.reset": "latest",
+            "enable.auto.commit": False,
+        })
+        consumer.subscribe([INVENTORY_CHANGES_TOPIC])
+        try:
+            while not self._stop.is_set():
+                msg = consumer.poll(1.0)
+                if msg is None:
+                    continue
+                if msg.error():
+                    if msg.error().code() != KafkaError._PARTITION_EOF:
+                        print(f"❌ Kafka Error: {msg.error()}")
+                    continue
+                try:
+                    event = json.loads(msg.value())
+                    self.apply_change(event)
+                    for callback in self._listeners:
+                        callback(event)
+                except Exception as e:
+                    print(f"❌ Failed to apply inventory change: {e}")
+        finally:
+            consumer.close()
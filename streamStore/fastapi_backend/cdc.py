@@ -0,0 +1,193 @@
+"""
+Change data capture: publishes the inventory and sales tables to compacted
+Kafka topics, so other services can follow the database as a stream of
+deltas instead of polling or snapshotting ecommerce.db.
+
+    python cdc.py
+
+Events are keyed upserts in the layout Flink's upsert-kafka connector reads
+with 'key.format' = 'json' and 'value.format' = 'json':
+
+    ecommerce.inventory  key {"product_id": 7}  value {"product_id": 7, ..., "quantity_in_stock": 41}
+    ecommerce.sales      key {"shard": 0, "sale_id": 12}
+                         value {"shard": 0, "sale_id": 12, "order_id": ..., "subtotal": 24.0}
+
+A deleted product is published as a tombstone (null value). sale_ids are
+only unique within a storage shard, so sales are keyed by both.
+
+Inventory changes are recorded by triggers in inventory_changelog, one row
+per changed product, so a product whose stock changed a hundred times
+between two polls is published once with its latest row. Sales are only
+ever inserted and are followed with a sale_id high-water mark per shard,
+kept in CDC_STATE_DIR. Delivery is at least once: changes are acknowledged
+and the high-water marks advanced only after the broker has the batch.
+"""
+import json
+import os
+import signal
+import sqlite3
+import threading
+import time
+from confluent_kafka import KafkaError, KafkaException
+from confluent_kafka.admin import NewTopic
+from kafka_clients import make_admin, make_producer
+from metrics import counter, histogram, start_http_server
+from storage import get_storage, StorageError
+from settings import INVENTORY_CDC_TOPIC, SALES_CDC_TOPIC
+
+CDC_BATCH_SIZE = int(os.getenv("CDC_BATCH_SIZE", "1000"))
+# How long the publisher sleeps once it has caught up
+CDC_POLL_SECONDS = float(os.getenv("CDC_POLL_SECONDS", "1.0"))
+CDC_FLUSH_TIMEOUT_SECONDS = float(os.getenv("CDC_FLUSH_TIMEOUT_SECONDS", "30"))
+STATE_DIR = os.getenv("CDC_STATE_DIR", "cdc-state")
+METRICS_PORT = int(os.getenv("CDC_METRICS_PORT", "9200"))
+
+SALES_COLUMNS = ("sale_id", "order_id", "product_id", "quantity", "unit_price", "subtotal", "sale_date")
+
+cdc_events = counter("cdc_events_published_total", "Change events acknowledged by the broker", ["topic"])
+cdc_delivery_errors = counter("cdc_delivery_errors_total", "Change events the broker did not acknowledge", ["topic"])
+cdc_batch_seconds = histogram("cdc_batch_duration_seconds", "Time to publish and acknowledge one batch of changes")
+
+class ChangePublisher:
+    def __init__(self, storage, producer, state_dir=STATE_DIR, batch_size=CDC_BATCH_SIZE):
+        self.storage = storage
+        self.producer = producer
+        self.batch_size = batch_size
+        self.state_path = os.path.join(state_dir, "cdc-state.json")
+        self.sales_high_water = self.load_state()
+
+    def load_state(self):
+        """{shard: last published sale_id}; empty for a new or replaced database."""
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            state = json.load(f)
+        if state.get("identity") != self.storage.identity():
+            print("⚠️ CDC state belongs to another database, publishing all sales again")
+            return {}
+        return {int(shard): sale_id for shard, sale_id in state["sales_high_water"].items()}
+
+    def save_state(self):
+        os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "identity": self.storage.identity(),
+                "sales_high_water": self.sales_high_water,
+                "updated_at": time.time(),
+            }, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.state_path)
+
+    def send(self, topic, events):
+        """Publish (key, value) events and wait for the broker. True if every one was acknowledged."""
+        failed = []
+
+        def on_delivery(err, msg):
+            if err:
+                failed.append(err)
+
+        for key, value in events:
+            while True:
+                try:
+                    self.producer.produce(topic, value, key=key, on_delivery=on_delivery)
+                    break
+                except BufferError:
+                    self.producer.poll(0.1)
+        remaining = self.producer.flush(CDC_FLUSH_TIMEOUT_SECONDS)
+        if failed or remaining:
+            cdc_delivery_errors.inc(len(failed) + remaining, topic=topic)
+            print(f"❌ CDC: {len(failed) + remaining} of {len(events)} {topic} events not delivered"
+                  + (f", first error: {failed[0]}" if failed else ""))
+            return False
+        cdc_events.inc(len(events), topic=topic)
+        return True
+
+    def publish_inventory(self):
+        published = 0
+        for shard, changes in self.storage.inventory_changes(self.batch_size):
+            with cdc_batch_seconds.time():
+                events = [
+                    (json.dumps({"product_id": product_id}),
+                     json.dumps(row, default=str) if row is not None else None)
+                    for product_id, _, row in changes
+                ]
+                if not self.send(INVENTORY_CDC_TOPIC, events):
+                    continue
+                self.storage.ack_inventory_changes(shard, [(product_id, seq) for product_id, seq, _ in changes])
+            published += len(changes)
+        return published
+
+    def publish_sales(self):
+        published = 0
+        for shard, rows in self.storage.iter_sales(self.sales_high_water, self.batch_size):
+            with cdc_batch_seconds.time():
+                events = [
+                    (json.dumps({"shard": shard, "sale_id": row[0]}),
+                     json.dumps({"shard": shard, **dict(zip(SALES_COLUMNS, row))}, default=str))
+                    for row in rows
+                ]
+                if not self.send(SALES_CDC_TOPIC, events):
+                    break
+                self.sales_high_water[shard] = rows[-1][0]
+                self.save_state()
+            published += len(rows)
+        return published
+
+    def publish_once(self):
+        """Publish what changed since the last call; returns the number of events."""
+        return self.publish_inventory() + self.publish_sales()
+
+    def run(self, stop_event):
+        while not stop_event.is_set():
+            try:
+                published = self.publish_once()
+            except (StorageError, sqlite3.Error) as e:
+                print(f"❌ CDC database error: {e}")
+                stop_event.wait(1.0)
+                continue
+            if published:
+                print(f"📤 CDC published {published} change events")
+            if published < self.batch_size:
+                stop_event.wait(CDC_POLL_SECONDS)
+
+def ensure_topics():
+    """Create the compacted change topics if they do not exist yet."""
+    admin = make_admin()
+    topics = [
+        NewTopic(topic, num_partitions=1, replication_factor=1, config={"cleanup.policy": "compact"})
+        for topic in (INVENTORY_CDC_TOPIC, SALES_CDC_TOPIC)
+    ]
+    for topic, future in admin.create_topics(topics).items():
+        try:
+            future.result(10)
+        except KafkaException as e:
+            if e.args[0].code() != KafkaError.TOPIC_ALREADY_EXISTS:
+                print(f"⚠️ Could not create {topic}: {e}")
+
+def run():
+    stop_event = threading.Event()
+
+    def stop(signum, frame):
+        print("\n🔴 Stopping CDC gracefully...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    storage = get_storage()
+    storage.create()
+    ensure_topics()
+    producer = make_producer({"enable.idempotence": True, "linger.ms": 20, "compression.type": "lz4"})
+    start_http_server(METRICS_PORT)
+    print(f"🟢 CDC publishing inventory to {INVENTORY_CDC_TOPIC} and sales to {SALES_CDC_TOPIC}")
+    try:
+        ChangePublisher(storage, producer).run(stop_event)
+    finally:
+        producer.flush(10)
+        storage.close()
+        print("🔴 CDC stopped")
+
+if __name__ == "__main__":
+    run()
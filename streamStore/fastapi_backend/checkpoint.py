@@ -0,0 +1,78 @@
+import hashlib
+import mmap
+import os
+import struct
+
+MAGIC = b"SSCK"
+VERSION = 1
+HEADER = struct.Struct("<4sHI16s")  # magic, version, slots, storage identity
+SLOT = struct.Struct("<q")          # next offset of one partition, 0 = unknown
+
+class OffsetCheckpoint:
+    """
+    Next offset to consume for every partition of one topic whose messages
+    are applied to storage, kept in a small memory-mapped file (8 bytes per
+    partition). Workers update it after each storage commit with a plain
+    memory write, which survives a process crash at once; flush() makes it
+    survive a machine crash too and is called on an interval.
+
+    On restart the checkpoint bounds how far a partition can be replayed,
+    even when Kafka lost the group's committed offsets and storage cannot
+    vouch for the partition on its own. The file records which database it
+    belongs to and starts empty when that changes.
+    """
+
+    def __init__(self, path, identity, slots=4096):
+        self.path = path
+        self.slots = slots
+        size = HEADER.size + slots * SLOT.size
+        identity = hashlib.sha1(identity.encode("utf-8")).digest()[:16]
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(fd).st_size < size:
+                os.ftruncate(fd, size)
+            self._map = mmap.mmap(fd, size)
+        finally:
+            os.close(fd)
+
+        if HEADER.unpack_from(self._map, 0) != (MAGIC, VERSION, slots, identity):
+            # New file, other layout, or the checkpoint of another database
+            self._map[:] = bytes(size)
+            HEADER.pack_into(self._map, 0, MAGIC, VERSION, slots, identity)
+            self._map.flush()
+
+    def get(self, partition):
+        if partition >= self.slots:
+            return None
+        offset = SLOT.unpack_from(self._map, HEADER.size + partition * SLOT.size)[0]
+        return offset or None
+
+    def offsets(self, partitions):
+        """{partition: next offset} for the partitions the checkpoint knows about."""
+        found = {}
+        for partition in partitions:
+            offset = self.get(partition)
+            if offset is not None:
+                found[partition] = offset
+        return found
+
+    def advance(self, partition, next_offset):
+        """Record that everything before `next_offset` is applied; never moves backwards."""
+        if partition >= self.slots:
+            return
+        position = HEADER.size + partition * SLOT.size
+        if next_offset > SLOT.unpack_from(self._map, position)[0]:
+            SLOT.pack_into(self._map, position, next_offset)
+
+    def store(self, partition, next_offset):
+        """Overwrite the offset of a partition, e.g. with a committed offset that was rewound."""
+        if partition < self.slots:
+            SLOT.pack_into(self._map, HEADER.size + partition * SLOT.size, next_offset)
+
+    def flush(self):
+        self._map.flush()
+
+    def close(self):
+        self._map.flush()
+        self._map.close()
@@ -1,151 +1,562 @@
 import json
-import sqlite3
-from confluent_kafka import Consumer, KafkaError
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+from confluent_kafka import KafkaError, KafkaException, TopicPartition
+from checkpoint import OffsetCheckpoint
+from dead_letter import FailureRouter, RetryScheduler, attempt_of, original_position
+from kafka_clients import make_consumer, make_producer
+from metrics import counter, gauge, histogram, start_http_server
+from order_status import status_event, SOLD, RETRYING, FAILED
+from order_codec import decode_order, OrderDecodeError
+from storage import get_storage, ProductNotFound, InsufficientStock, StorageError
+from partitioning import partition_count
+from settings import (
+    DB_NAME, ORDERS_TOPIC, ORDERS_CONSUMER_GROUP, ORDERS_PARTITIONS, ORDERS_RETRY_TOPIC, INVENTORY_CHANGES_TOPIC,
+    ORDER_STATUS_TOPIC, CONSUMER_METRICS_PORT,
+)
+
+# Batch tuning: up to CONSUMER_BATCH_SIZE messages are pulled per consume()
+# call, waiting at most CONSUMER_BATCH_LINGER_MS for the batch to fill.
+BATCH_SIZE = int(os.getenv("CONSUMER_BATCH_SIZE", "500"))
+BATCH_LINGER_SECONDS = int(os.getenv("CONSUMER_BATCH_LINGER_MS", "500")) / 1000.0
+# A batch that fails this many times in a row is applied one message at a time
+BATCH_RETRIES = int(os.getenv("CONSUMER_BATCH_RETRIES", "3"))
+
+# Applied offsets are also kept in a memory-mapped checkpoint next to the
+# database, flushed to disk every CONSUMER_CHECKPOINT_SECONDS
+CHECKPOINT_PATH = os.getenv("CONSUMER_CHECKPOINT_PATH", os.path.splitext(DB_NAME)[0] + ".consumer-checkpoint")
+CHECKPOINT_SECONDS = float(os.getenv("CONSUMER_CHECKPOINT_SECONDS", "5"))
+
+# Parallelism: CONSUMER_WORKERS consumers in the same group, each owning the
+# partitions the group assigns it. "process" workers scale across cores,
+# "thread" workers share one interpreter (cheaper, but bound by the GIL).
+WORKERS = int(os.getenv("CONSUMER_WORKERS", "1"))
+WORKER_MODE = os.getenv("CONSUMER_WORKER_MODE", "process")
 
 consumer_config = {
-    "bootstrap.servers": "kafka:9092",
-    "group.id": "order-tracker",
+    "group.id": ORDERS_CONSUMER_GROUP,
     "auto.offset.reset": "earliest",
-    "enable.auto.commit": False  # Manual commit for reliability
+    "enable.auto.commit": False,  # Manual commit for reliability
+    # Only move the partitions that have to move when workers join or leave
+    "partition.assignment.strategy": "cooperative-sticky",
+    # librdkafka statistics (consumer lag per partition) are delivered to stats_cb
+    "statistics.interval.ms": int(os.getenv("CONSUMER_STATS_INTERVAL_MS", "5000")),
 }
 
-consumer = Consumer(consumer_config)
-consumer.subscribe(["orders"])
+order_lines_processed = counter("order_lines_processed_total", "Order lines applied to inventory and sales")
+order_lines_rejected = counter("order_lines_rejected_total", "Order lines skipped (invalid or rejected)")
+order_lines_duplicate = counter("order_lines_duplicate_total", "Redelivered order lines skipped because they were already applied")
+batch_seconds = histogram("consumer_batch_duration_seconds", "Time to apply and commit one batch in SQLite")
+end_to_end_seconds = histogram(
+    "order_end_to_end_seconds", "Time from checkout until the sale row is committed",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0),
+)
+consumer_lag = gauge("kafka_consumer_lag", "Messages behind the partition high watermark", ["topic", "partition"])
+
+def parse_orders(msg):
+    """
+    Decode and validate an order message.
+    Binary envelopes carry a whole cart, legacy JSON messages a single line.
+    Returns (valid order-line dicts, invalid order-line dicts).
+    Raises OrderDecodeError if the message cannot be decoded at all.
+    """
+    orders = []
+    invalid = []
+    for order in decode_order(msg.value()):
+        # Validate required fields
+        required_fields = ['order_id', 'product_id', 'quantity', 'unit_price']
+        if not all(field in order for field in required_fields):
+            print(f"❌ Invalid message format, missing fields: {order}")
+            invalid.append(order)
+            continue
+
+        # Validate data types and values
+        if not isinstance(order['quantity'], int) or order['quantity'] <= 0:
+            print(f"❌ Invalid quantity: {order['quantity']}")
+            invalid.append(order)
+            continue
+
+        orders.append(order)
 
-print("🟢 Consumer is running and subscribed to orders topic")
+    return orders, invalid
 
-def process_order(order):
+def process_order(tx, order, stock_changes=None, failures=None):
     """
-    Process a single order item with transaction safety.
+    Process a single order item inside the current batch transaction.
+    An item that is rejected (unknown product, insufficient stock) is
+    rolled back on its own without affecting the rest of the batch.
+    The new stock level and the order are recorded in `stock_changes`
+    (product_id -> {"quantity_in_stock", "order_ids"}) and a rejected item is appended to `failures` as (order, reason).
     Returns True if successful, False otherwise.
     """
     order_id = order['order_id']
     product_id = order['product_id']
-    quantity = order['quantity']
-    unit_price = order['unit_price']
-    
-    print(f"📦 Processing order {order_id}: Product {product_id}, Quantity {quantity}")
-    
-    # Single database connection for transaction
-    conn = sqlite3.connect('ecommerce.db')
-    
+
     try:
-        conn.execute("BEGIN TRANSACTION")
-        cursor = conn.cursor()
-        
-        # Check if product exists and has sufficient inventory
-        cursor.execute(
-            "SELECT quantity_in_stock FROM inventory WHERE product_id = ?", 
-            (product_id,)
-        )
-        result = cursor.fetchone()
-        
-        if result is None:
-            print(f"❌ Product {product_id} not found in inventory")
-            conn.rollback()
-            return False
-            
-        current_stock = result[0]
-        if current_stock < quantity:
-            print(f"❌ Insufficient inventory for product {product_id}. Available: {current_stock}, Requested: {quantity}")
-            conn.rollback()
-            return False
-        
-        # Update inventory - reduce stock
-        new_stock = current_stock - quantity
-        cursor.execute(
-            "UPDATE inventory SET quantity_in_stock = ? WHERE product_id = ?",
-            (new_stock, product_id)
-        )
-        
-        # Add sale record
-        subtotal = quantity * unit_price
-        cursor.execute(
-            """INSERT INTO sales (order_id, product_id, quantity, unit_price, subtotal)
-               VALUES (?, ?, ?, ?, ?)""",
-            (order_id, product_id, quantity, unit_price, subtotal)
-        )
-        
-        # Commit both operations together
-        conn.commit()
-        print(f"✅ Order {order_id} processed successfully - Product {product_id}, New stock: {new_stock}")
-        return True
-        
-    except sqlite3.Error as e:
+        new_stock = tx.sell(order_id, product_id, order['quantity'], order['unit_price'])
+
+    except ProductNotFound:
+        print(f"❌ Product {product_id} not found in inventory (order {order_id})")
+        _record_failure(failures, order, "not_found")
+        return False
+
+    except InsufficientStock as e:
+        print(f"❌ Insufficient inventory for product {product_id} (order {order_id}). Available: {e.available}, Requested: {e.requested}")
+        _record_failure(failures, order, "insufficient_stock")
+        return False
+
+    except StorageError as e:
         print(f"❌ Database error processing order {order_id}: {str(e)}")
-        conn.rollback()
+        _record_failure(failures, order, "db_error")
         return False
-        
+
     except Exception as e:
         print(f"❌ Unexpected error processing order {order_id}: {str(e)}")
-        conn.rollback()
+        _record_failure(failures, order, "unexpected_error")
         return False
-        
-    finally:
-        conn.close()
-
-try:
-    while True:
-        msg = consumer.poll(1.0)
-        
-        if msg is None:
-            continue
-            
-        if msg.error():
-            if msg.error().code() == KafkaError._PARTITION_EOF:
-                # End of partition, not an error
-                continue
+
+    if stock_changes is not None:
+        change = stock_changes.setdefault(product_id, {"quantity_in_stock": new_stock, "order_ids": []})
+        change["quantity_in_stock"] = new_stock
+        change["order_ids"].append(order_id)
+    return True
+
+def _record_failure(failures, order, reason):
+    if failures is not None:
+        failures.append((order, reason))
+
+def process_batch(storage, messages, stock_changes=None, failures=None):
+    """
+    Apply a batch of order messages in a single storage transaction.
+    Invalid or rejected items are skipped; everything else is committed
+    together with one fsync per shard. Raises StorageError if the batch
+    itself could not be committed.
+    Skipped items are appended to `failures` as (msg, order lines, reason),
+    with order lines None when the message could not be decoded.
+    Each message's offset is claimed in the same transaction, so lines that
+    were already applied before a redelivery are skipped (exactly once).
+    A fresh order whose lines were already sold was published twice by the
+    outbox relay and is skipped as well, and so is a retried line already
+    sold by another copy of the same retry (the retry scheduler publishes
+    at least once), recognised by where the order was first consumed.
+    Returns (processed, rejected) counts of order lines.
+    """
+    processed = 0
+    rejected = 0
+    duplicates = 0
+    created = []  # checkout timestamps of applied lines, for end-to-end latency
+
+    start = time.perf_counter()
+    decoded = []
+    for msg in messages:
+        try:
+            decoded.append((msg, *parse_orders(msg)))
+        except OrderDecodeError as e:
+            print(f"❌ Invalid order message: {e}")
+            rejected += 1
+            if failures is not None:
+                failures.append((msg, None, "decode_error"))
+
+    product_ids = [order['product_id'] for _, orders, _ in decoded for order in orders]
+    with storage.transaction(product_ids) as tx:
+        for msg, orders, invalid in decoded:
+            line_failures = [(order, "invalid_line") for order in invalid]
+            # Fresh orders are checked against sales, retries against the retries already sold
+            origin = original_position(msg) if attempt_of(msg) > 1 else None
+            if origin is None:
+                resent = {order['product_id'] for order in orders if tx.has_sale(order['order_id'], order['product_id'])}
             else:
-                print(f"❌ Kafka Error: {msg.error()}")
-                continue
-        
+                resent = {order['product_id'] for order in orders if tx.has_retry(*origin, order['product_id'])}
+            for order in orders:
+                claimed = tx.claim(msg.topic(), msg.partition(), msg.offset(), order['product_id'])
+                if not claimed or order['product_id'] in resent:
+                    duplicates += 1
+                    continue
+                if process_order(tx, order, stock_changes, line_failures):
+                    processed += 1
+                    if origin is not None:
+                        tx.record_retry(*origin, order['product_id'])
+                    if 'created_us' in order:
+                        created.append(order['created_us'])
+            rejected += len(line_failures)
+
+            # One failure record per message and reason, carrying only the failed lines
+            if failures is not None:
+                by_reason = {}
+                for order, reason in line_failures:
+                    by_reason.setdefault(reason, []).append(order)
+                for reason, lines in by_reason.items():
+                    failures.append((msg, lines, reason))
+
+    committed_us = time.time_ns() // 1000
+    batch_seconds.observe(time.perf_counter() - start)
+    for created_us in created:
+        end_to_end_seconds.observe((committed_us - created_us) / 1e6)
+    order_lines_processed.inc(processed)
+    order_lines_rejected.inc(rejected)
+    if duplicates:
+        order_lines_duplicate.inc(duplicates)
+        print(f"♻️ Skipped {duplicates} order lines that were already applied")
+
+    return processed, rejected
+
+def next_offsets(messages):
+    """Offsets to commit (last offset + 1) for every partition in the batch."""
+    offsets = {}
+    for msg in messages:
+        key = (msg.topic(), msg.partition())
+        offsets[key] = max(offsets.get(key, -1), msg.offset() + 1)
+    return [TopicPartition(topic, partition, offset) for (topic, partition), offset in offsets.items()]
+
+class OrderWorker:
+    """
+    One consumer in the order-tracker group with its own producer, writing
+    through the configured storage backend. Orders are keyed by product_id, so the partitions this
+    worker owns cover a disjoint set of products and per-product ordering
+    is kept however many workers run.
+    """
+
+    def __init__(self, worker_id, stop_event, consumer=None, producer=None, storage=None):
+        self.name = f"worker-{worker_id}"
+        self.stop_event = stop_event
+        self.storage = storage or get_storage()
+        self.num_partitions = ORDERS_PARTITIONS
+        self.consumer = consumer or make_consumer({
+            **consumer_config,
+            "client.id": f"order-consumer-{self.name}",
+            "stats_cb": self.on_stats,
+        })
+        # Publishes inventory-change events so backend caches can update single rows,
+        # and failed orders to the retry/dead letter topics
+        self.producer = producer or make_producer()
+        self.router = FailureRouter(self.producer)
+        self.checkpoint = OffsetCheckpoint(CHECKPOINT_PATH, self.storage.identity())
+        # Processed but not yet committed: (topic, partition) -> next offset
+        self.pending = {}
+        self.failed_batches = 0
+
+    def on_assign(self, consumer, partitions):
+        print(f"🟢 [{self.name}] Assigned partitions: {sorted(p.partition for p in partitions)}")
+        self.resume_from_storage(consumer, partitions)
+
+    def resume_from_storage(self, consumer, partitions):
+        """
+        Start each newly assigned partition from the offset stored with the
+        sales (or in the local checkpoint) when that is ahead of the one
+        committed to Kafka, i.e. when a worker died between the storage
+        commit and the offset commit, or the group's offsets were lost.
+        """
+        ours = [p.partition for p in partitions if p.topic == ORDERS_TOPIC]
+        stored = self.storage.stored_offsets(ORDERS_TOPIC, ours, self.num_partitions)
+        for partition, offset in self.checkpoint.offsets(ours).items():
+            stored[partition] = max(stored.get(partition, 0), offset)
+        self.drop_stale_offsets(consumer, stored)
+        if not stored:
+            return
         try:
-            # Parse message
-            value = msg.value().decode("utf-8")
-            order = json.loads(value)
-            
-            # Validate required fields
-            required_fields = ['order_id', 'product_id', 'quantity', 'unit_price']
-            if not all(field in order for field in required_fields):
-                print(f"❌ Invalid message format, missing fields: {value}")
-                consumer.commit(msg)  # Skip invalid messages
+            committed = {(tp.topic, tp.partition): tp.offset for tp in consumer.committed(partitions, timeout=10)}
+        except KafkaException as e:
+            # Stored offsets are safe on their own; redelivered lines are skipped anyway
+            print(f"⚠️ [{self.name}] Could not fetch committed offsets: {e}")
+            committed = {}
+        for p in partitions:
+            offset = stored.get(p.partition) if p.topic == ORDERS_TOPIC else None
+            if offset is not None and offset > committed.get((p.topic, p.partition), -1):
+                print(f"⏩ [{self.name}] Resuming {p.topic}[{p.partition}] at stored offset {offset}")
+                p.offset = offset
+                # Bring the group's committed offset up to date as well
+                self.pending[(p.topic, p.partition)] = offset
+        consumer.incremental_assign(partitions)
+
+    def drop_stale_offsets(self, consumer, stored):
+        """
+        Remove from `stored` (and from storage and the checkpoint) the offsets
+        that are past the end of their partition. The topic was recreated and
+        starts at 0 again; resuming there would skip every new order as a
+        redelivery.
+        """
+        for partition, offset in list(stored.items()):
+            try:
+                _, high = consumer.get_watermark_offsets(TopicPartition(ORDERS_TOPIC, partition), timeout=10)
+            except KafkaException as e:
+                print(f"⚠️ [{self.name}] Could not fetch the end of {ORDERS_TOPIC}[{partition}]: {e}")
                 continue
-            
-            # Validate data types and values
-            if order['quantity'] <= 0:
-                print(f"❌ Invalid quantity: {order['quantity']}")
-                consumer.commit(msg)  # Skip invalid data
+            if offset > high:
+                print(f"⚠️ [{self.name}] Stored offset {offset} is past the end of {ORDERS_TOPIC}[{partition}] ({high}), "
+                      "the topic was recreated: starting the partition over")
+                self.storage.reset_offsets(ORDERS_TOPIC, [partition])
+                self.checkpoint.store(partition, 0)
+                del stored[partition]
+
+    def on_revoke(self, consumer, partitions):
+        # Hand partitions over with everything we applied committed
+        revoked = {(p.topic, p.partition) for p in partitions}
+        self.commit_pending(revoked)
+        for topic, partition in revoked:
+            self.pending.pop((topic, partition), None)
+            consumer_lag.remove(topic=topic, partition=partition)
+        print(f"🟡 [{self.name}] Revoked partitions: {sorted(p.partition for p in partitions)}")
+
+    def on_stats(self, stats_json):
+        """Export consumer lag for the partitions this worker owns (librdkafka stats callback)."""
+        stats = json.loads(stats_json)
+        for topic, topic_stats in stats.get("topics", {}).items():
+            for partition, partition_stats in topic_stats.get("partitions", {}).items():
+                lag = partition_stats.get("consumer_lag", -1)
+                if partition == "-1" or lag < 0:
+                    continue  # internal UA partition, or not assigned to us
+                consumer_lag.set(lag, topic=topic, partition=partition)
+
+    def on_lost(self, consumer, partitions):
+        # Another worker may already own these; our offsets are stale
+        for p in partitions:
+            self.pending.pop((p.topic, p.partition), None)
+            consumer_lag.remove(topic=p.topic, partition=p.partition)
+        print(f"🟠 [{self.name}] Lost partitions: {sorted(p.partition for p in partitions)}")
+
+    def commit_pending(self, only=None):
+        """Synchronously commit processed offsets, one entry per partition."""
+        keys = [key for key in self.pending if only is None or key in only]
+        if not keys:
+            return
+        offsets = [TopicPartition(topic, partition, self.pending[(topic, partition)]) for topic, partition in keys]
+        try:
+            self.consumer.commit(offsets=offsets, asynchronous=False)
+        except KafkaException as e:
+            # Offsets stay pending and are retried after the next batch
+            print(f"❌ [{self.name}] Offset commit failed: {e}")
+            return
+        for key in keys:
+            del self.pending[key]
+
+    def publish_stock_changes(self, stock_changes):
+        """
+        Publish one inventory-change event per product, keyed by product_id.
+        It carries the orders applied, so backends can release their stock holds.
+        """
+        for product_id, change in stock_changes.items():
+            event = {"product_id": product_id, **change}
+            self.producer.produce(
+                topic=INVENTORY_CHANGES_TOPIC,
+                key=str(product_id),
+                value=json.dumps(event).encode("utf-8")
+            )
+        self.producer.poll(0)  # serve delivery callbacks without blocking
+
+    def process_individually(self, messages, stock_changes, failures):
+        """
+        Apply each message in its own transaction so one poison message
+        cannot hold back the rest of the batch. Messages that still fail
+        are recorded in `failures` with reason "batch_error".
+        """
+        processed = 0
+        rejected = 0
+        for msg in messages:
+            msg_changes = {}
+            msg_failures = []
+            try:
+                p, r = process_batch(self.storage, [msg], msg_changes, msg_failures)
+            except Exception as e:
+                print(f"❌ [{self.name}] Failed to apply message {msg.topic()}[{msg.partition()}]@{msg.offset()}: {e}")
+                failures.append((msg, None, "batch_error"))
+                rejected += 1
                 continue
-            
-            # Process the order
-            success = process_order(order)
-            
-            if success:
-                # Commit offset only after successful processing
-                consumer.commit(msg)
-            else:
-                # Failed to process - commit anyway to avoid infinite retries
-                # In production, send to dead letter queue for manual review
-                print(f"⚠️ Committing failed message to prevent reprocessing loop")
-                consumer.commit(msg)
-                
-        except json.JSONDecodeError as e:
-            print(f"❌ Failed to parse JSON message: {e}")
-            consumer.commit(msg)  # Skip malformed messages
-            
-        except KeyError as e:
-            print(f"❌ Missing required field in message: {e}")
-            consumer.commit(msg)  # Skip incomplete messages
-            
-        except Exception as e:
-            print(f"❌ Unexpected error: {e}")
-            # Don't commit - allow retry on next poll
-            import traceback
-            traceback.print_exc()
-
-except KeyboardInterrupt:
-    print("\n🔴 Stopping consumer gracefully...")
-
-finally:
-    consumer.close()
-    print("🔴 Consumer closed")
\ No newline at end of file
+            for product_id, change in msg_changes.items():
+                merged = stock_changes.setdefault(product_id, {"quantity_in_stock": 0, "order_ids": []})
+                merged["quantity_in_stock"] = change["quantity_in_stock"]
+                merged["order_ids"].extend(change["order_ids"])
+            failures.extend(msg_failures)
+            processed += p
+            rejected += r
+        return processed, rejected
+
+    def route_failures(self, failures):
+        """
+        Hand failed orders to the retry/dead letter topics and wait until Kafka has them.
+        Returns (order lines, topic, reason) for each failure.
+        """
+        routed = [(orders, self.router.route(msg, orders, reason), reason) for msg, orders, reason in failures]
+        # Their offsets are about to be committed, so they must not be lost
+        while failures and self.producer.flush(5) > 0:
+            if self.stop_event.is_set():
+                # Shutting down with the broker unreachable: close() gets one last flush
+                print(f"❌ [{self.name}] Stopping with {len(self.producer)} messages not delivered, "
+                      "failed orders among them may be lost")
+                break
+            print(f"⚠️ [{self.name}] Waiting for failed orders to reach the retry/dead letter topics")
+        return routed
+
+    def publish_order_status(self, stock_changes, routed):
+        """
+        Publish, per order, which lines were sold and which went to the retry
+        or dead letter topic, keyed by order_id (see order_status.py).
+        """
+        sold = {}
+        for product_id, change in stock_changes.items():
+            for order_id in change["order_ids"]:
+                sold.setdefault(order_id, []).append(product_id)
+        events = [(order_id, SOLD, product_ids, None) for order_id, product_ids in sold.items()]
+
+        for orders, topic, reason in routed:
+            by_order = {}
+            for order in orders or ():  # undecodable messages name no order
+                if order.get("order_id") is not None:
+                    by_order.setdefault(order["order_id"], []).append(order.get("product_id"))
+            outcome = RETRYING if topic == ORDERS_RETRY_TOPIC else FAILED
+            events += [(order_id, outcome, product_ids, reason) for order_id, product_ids in by_order.items()]
+
+        for order_id, outcome, product_ids, reason in events:
+            self.producer.produce(
+                topic=ORDER_STATUS_TOPIC,
+                key=str(order_id),
+                value=status_event(str(order_id), outcome, product_ids, reason),
+            )
+        self.producer.poll(0)
+
+    def rewind(self, messages):
+        """Seek every partition in the batch back to its first message so it is redelivered."""
+        first = {}
+        for msg in messages:
+            key = (msg.topic(), msg.partition())
+            first[key] = min(first.get(key, msg.offset()), msg.offset())
+        for (topic, partition), offset in first.items():
+            self.consumer.seek(TopicPartition(topic, partition, offset))
+
+    def run(self):
+        self.num_partitions = partition_count(self.consumer, ORDERS_TOPIC, ORDERS_PARTITIONS)
+        next_flush = time.monotonic() + CHECKPOINT_SECONDS
+        self.consumer.subscribe(
+            [ORDERS_TOPIC], on_assign=self.on_assign, on_revoke=self.on_revoke, on_lost=self.on_lost
+        )
+        print(f"🟢 [{self.name}] Subscribed to {ORDERS_TOPIC} (batch size {BATCH_SIZE}, linger {BATCH_LINGER_SECONDS}s)")
+
+        try:
+            while not self.stop_event.is_set():
+                batch = self.consumer.consume(num_messages=BATCH_SIZE, timeout=BATCH_LINGER_SECONDS)
+                if time.monotonic() >= next_flush:
+                    self.checkpoint.flush()
+                    next_flush = time.monotonic() + CHECKPOINT_SECONDS
+                if not batch:
+                    self.commit_pending()  # e.g. offsets resumed from storage
+                    continue
+
+                messages = []
+                for msg in batch:
+                    if msg.error():
+                        if msg.error().code() != KafkaError._PARTITION_EOF:
+                            print(f"❌ [{self.name}] Kafka Error: {msg.error()}")
+                        continue
+                    messages.append(msg)
+
+                if not messages:
+                    continue
+
+                stock_changes = {}
+                failures = []
+                try:
+                    processed, rejected = process_batch(self.storage, messages, stock_changes, failures)
+                    self.failed_batches = 0
+                except Exception as e:
+                    # Nothing was written
+                    print(f"❌ [{self.name}] Failed to apply batch of {len(messages)} messages: {e}")
+                    traceback.print_exc()
+                    self.failed_batches += 1
+                    if self.failed_batches < BATCH_RETRIES:
+                        # Possibly transient (e.g. a locked database): redeliver the whole batch
+                        self.rewind(messages)
+                        continue
+                    # The same batch keeps failing: isolate the message that breaks it
+                    stock_changes, failures = {}, []
+                    processed, rejected = self.process_individually(messages, stock_changes, failures)
+                    self.failed_batches = 0
+
+                routed = self.route_failures(failures)
+
+                # Commit offsets once per batch, only after the storage commit.
+                # Rejected items are committed too; they now live on the retry/dead letter topics.
+                for tp in next_offsets(messages):
+                    self.pending[(tp.topic, tp.partition)] = tp.offset
+                    if tp.topic == ORDERS_TOPIC:
+                        self.checkpoint.advance(tp.partition, tp.offset)
+                self.commit_pending()
+                print(f"✅ [{self.name}] Batch committed: {processed} processed, {rejected} rejected")
+
+                # Only announce stock levels and outcomes that are durably committed
+                self.publish_stock_changes(stock_changes)
+                self.publish_order_status(stock_changes, routed)
+
+        finally:
+            self.commit_pending()
+            self.checkpoint.close()
+            self.consumer.close()
+            self.producer.flush(5)
+            print(f"🔴 [{self.name}] Consumer closed")
+
+def run_worker(worker_id, stop_event, child_process=False):
+    if child_process:
+        # Child processes stop via stop_event; Ctrl+C is handled by the parent
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        # Counters live per process, so every worker process gets its own scrape port
+        start_http_server(CONSUMER_METRICS_PORT + 1 + worker_id)
+    OrderWorker(worker_id, stop_event).run()
+
+def run_retry_scheduler(stop_event):
+    try:
+        RetryScheduler(stop_event).run()
+    except Exception as e:
+        print(f"❌ Retry scheduler crashed: {e}")
+
+def run():
+    in_processes = WORKER_MODE == "process" and WORKERS > 1
+    stop_event = multiprocessing.Event() if in_processes else threading.Event()
+
+    def stop(signum, frame):
+        print("\n🔴 Stopping consumer gracefully...")
+        stop_event.set()
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    # Create (or seed) the schema once, and fork with no connections open
+    storage = get_storage()
+    storage.create()
+    OffsetCheckpoint(CHECKPOINT_PATH, storage.identity()).close()
+    storage.close()
+
+    workers = []
+    if in_processes:
+        # Fork before this process starts any threads of its own
+        workers = [
+            multiprocessing.Process(target=run_worker, args=(i, stop_event, True), name=f"order-worker-{i}")
+            for i in range(WORKERS)
+        ]
+    elif WORKERS > 1:
+        workers = [
+            threading.Thread(target=run_worker, args=(i, stop_event), name=f"order-worker-{i}")
+            for i in range(WORKERS)
+        ]
+    if workers:
+        print(f"🟢 Starting {WORKERS} order workers ({'processes' if in_processes else 'threads'})")
+        for worker in workers:
+            worker.start()
+
+    start_http_server(CONSUMER_METRICS_PORT)
+    print(f"📈 Metrics at http://0.0.0.0:{CONSUMER_METRICS_PORT}/metrics")
+
+    # Retries wait out their backoff in a separate consumer group, off the main partitions
+    scheduler = threading.Thread(target=run_retry_scheduler, args=(stop_event,), name="retry-scheduler")
+    scheduler.start()
+
+    if not workers:
+        run_worker(0, stop_event)
+    for worker in workers:
+        worker.join()
+    scheduler.join()
+    print("🔴 All workers stopped")
+
+if __name__ == "__main__":
+    run()
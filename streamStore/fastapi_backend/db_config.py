@@ -1,12 +1,80 @@
+import os
 import sqlite3
 from datetime import datetime
 import random
 import json
+from functools import wraps
+from db_pool import get_pool
+from metrics import counter, histogram
+
+sqlite_query_seconds = histogram(
+    "sqlite_query_duration_seconds", "Time spent in each db_config SQLite helper", ["query"]
+)
+
+full_scans_total = counter(
+    "sqlite_full_scans_total", "Ad-hoc queries whose plan scans a whole table or index", ["query"]
+)
+
+# query_custom and query_table_internal warn about full scans in their plans
+QUERY_PLAN_CHECK = os.getenv("QUERY_PLAN_CHECK", "1") == "1"
+
+def timed_query(func):
+    """Record how long each call to a db_config helper takes, labelled by helper name."""
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        with sqlite_query_seconds.time(query=func.__name__):
+            return func(*args, **kwargs)
+    return wrapper
+
+# Table names cannot be bound as ? parameters, so helpers that take one
+# only accept the tables of this schema
+TABLES = ("inventory", "orders", "sales")
+
+def _table(name):
+    if name not in TABLES:
+        raise ValueError(f"Unknown table '{name}'")
+    return name
 
 def create_database(db_name='ecommerce.db'):
     """Create the database and tables"""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
+    with get_pool(db_name).connection() as conn:
+        _create_tables(conn)
+    print(f"Database '{db_name}' created successfully!")
+
+# Indexes for the access paths the services actually use. Each migration
+# creates the ones it introduces; bulk imports drop the DEFERRABLE_INDEXES
+# and rebuild them with _create_indexes once the data is in.
+INDEXES = {
+    # Catalog pages filtered by category, in product_id order
+    "idx_inventory_category": "CREATE INDEX IF NOT EXISTS idx_inventory_category ON inventory (category, product_id)",
+    # bulk_import upserts by SKU
+    "idx_inventory_sku": "CREATE UNIQUE INDEX IF NOT EXISTS idx_inventory_sku ON inventory (sku)",
+    # Checkout lookups (GET /orders) by the UUID handed to the client
+    "idx_orders_checkout_id": "CREATE UNIQUE INDEX IF NOT EXISTS idx_orders_checkout_id ON orders (checkout_id)",
+    # Sales of an order; covers the consumer's "already sold?" check on (order_id, product_id)
+    "idx_sales_order_product": "CREATE INDEX IF NOT EXISTS idx_sales_order_product ON sales (order_id, product_id)",
+    # Sales of a product over time
+    "idx_sales_product_date": "CREATE INDEX IF NOT EXISTS idx_sales_product_date ON sales (product_id, sale_date)",
+    # Recent sales first, and day ranges
+    "idx_sales_date": "CREATE INDEX IF NOT EXISTS idx_sales_date ON sales (sale_date)",
+    # cdc.py publishes changed products oldest change first
+    "idx_inventory_changelog_seq": "CREATE INDEX IF NOT EXISTS idx_inventory_changelog_seq ON inventory_changelog (seq)",
+}
+DEFERRABLE_INDEXES = ("idx_inventory_category",)
+
+def _create_indexes(cursor, names):
+    for name in names:
+        cursor.execute(INDEXES[name])
+
+def _columns(cursor, table):
+    return {row[1]: row[2] for row in cursor.execute(f"PRAGMA table_info({table})")}
+
+def _migrate_base_tables(cursor):
+    # Older databases declared sales.order_id INTEGER although it holds checkout
+    # UUIDs; the table is recreated below with TEXT and the rows copied over
+    convert_sales = _columns(cursor, 'sales').get('order_id', 'TEXT').upper() != 'TEXT'
+    if convert_sales:
+        cursor.execute("ALTER TABLE sales RENAME TO sales_old")
     
     # Create Inventory table
     cursor.execute('''
@@ -38,7 +106,7 @@ def create_database(db_name='ecommerce.db'):
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS sales (
             sale_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            order_id INTEGER NOT NULL,
+            order_id TEXT NOT NULL,  -- checkout UUID (integer ids in the sample data)
             product_id INTEGER NOT NULL,
             quantity INTEGER NOT NULL,
             unit_price REAL NOT NULL,
@@ -49,13 +117,152 @@ def create_database(db_name='ecommerce.db'):
         )
     ''')
     
+    if convert_sales:
+        cursor.execute('''
+            INSERT INTO sales (sale_id, order_id, product_id, quantity, unit_price, subtotal, sale_date)
+            SELECT sale_id, CAST(order_id AS TEXT), product_id, quantity, unit_price, subtotal, sale_date FROM sales_old
+        ''')
+        cursor.execute("DROP TABLE sales_old")
+    
+    _create_indexes(cursor, ["idx_inventory_category"])
+
+def _migrate_processed_offsets(cursor):
+    # Last Kafka offset + 1 applied per partition, written in the same
+    # transaction as the sales it covers (exactly-once order processing)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS processed_offsets (
+            topic TEXT NOT NULL,
+            partition INTEGER NOT NULL,
+            next_offset INTEGER NOT NULL,
+            PRIMARY KEY (topic, partition)
+        ) WITHOUT ROWID
+    ''')
+
+def _migrate_outbox(cursor):
+    # Transactional outbox: checkout writes the messages announcing an order in
+    # the same transaction as the order; outbox.OutboxRelay publishes and deletes them
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            topic TEXT NOT NULL,
+            message_key TEXT,
+            payload BLOB NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    if 'checkout_id' not in _columns(cursor, 'orders'):
+        cursor.execute("ALTER TABLE orders ADD COLUMN checkout_id TEXT")  # order UUID handed out by /checkout
+    _create_indexes(cursor, ["idx_orders_checkout_id"])
+
+def _migrate_sku(cursor):
+    if 'sku' not in _columns(cursor, 'inventory'):
+        cursor.execute("ALTER TABLE inventory ADD COLUMN sku TEXT")  # external product key, used by bulk_import upserts
+    _create_indexes(cursor, ["idx_inventory_sku"])
+
+def _migrate_sales_indexes(cursor):
+    # (order_id) alone is superseded by (order_id, product_id)
+    cursor.execute("DROP INDEX IF EXISTS idx_sales_order_id")
+    _create_indexes(cursor, ["idx_sales_order_product", "idx_sales_product_date", "idx_sales_date"])
+    # Give the planner statistics for the new indexes
+    cursor.execute("ANALYZE")
+
+def _migrate_inventory_changelog(cursor):
+    # Change data capture (cdc.py): triggers record which products changed, one
+    # row per product with the sequence number of its latest change, so the
+    # table never outgrows the catalog however often stock is updated
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS inventory_changelog (
+            product_id INTEGER PRIMARY KEY,
+            seq INTEGER NOT NULL
+        )
+    ''')
+    _create_indexes(cursor, ["idx_inventory_changelog_seq"])
+    for event, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS inventory_cdc_{event.lower()} AFTER {event} ON inventory
+            BEGIN
+                INSERT INTO inventory_changelog (product_id, seq)
+                VALUES ({row}.product_id, (SELECT IFNULL(MAX(seq), 0) + 1 FROM inventory_changelog))
+                ON CONFLICT (product_id) DO UPDATE SET seq = excluded.seq;
+            END
+        ''')
+    # Products that exist already are published once as well
+    cursor.execute('''
+        INSERT OR IGNORE INTO inventory_changelog (product_id, seq)
+        SELECT product_id, ROW_NUMBER() OVER (ORDER BY product_id) FROM inventory
+    ''')
+
+def _migrate_processed_retries(cursor):
+    # Retried order lines that were sold, by the position of the order they
+    # came from, so a retry the scheduler replayed twice is only sold once
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS processed_retries (
+            topic TEXT NOT NULL,
+            partition INTEGER NOT NULL,
+            offset INTEGER NOT NULL,
+            product_id INTEGER NOT NULL,
+            PRIMARY KEY (topic, partition, offset, product_id)
+        ) WITHOUT ROWID
+    ''')
+
+def _migrate_outbox_attempts(cursor):
+    # Failed deliveries per outbox message; after OUTBOX_MAX_ATTEMPTS the
+    # message moves to outbox_dead_letter instead of blocking the relay
+    columns = _columns(cursor, 'outbox')
+    if 'attempts' not in columns:
+        cursor.execute("ALTER TABLE outbox ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+    if 'last_error' not in columns:
+        cursor.execute("ALTER TABLE outbox ADD COLUMN last_error TEXT")
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbox_dead_letter (
+            seq INTEGER PRIMARY KEY,
+            topic TEXT NOT NULL,
+            message_key TEXT,
+            payload BLOB NOT NULL,
+            created_at TIMESTAMP,
+            attempts INTEGER NOT NULL,
+            last_error TEXT,
+            failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+# Schema versions. PRAGMA user_version records the last one applied to a
+# database file, so each runs once; every step also checks what exists
+# first, so re-running one (or all, on a database that predates user_version)
+# is safe. Append new steps, never edit applied ones.
+MIGRATIONS = [
+    (1, "inventory, orders and sales tables", _migrate_base_tables),
+    (2, "processed_offsets for exactly-once consumption", _migrate_processed_offsets),
+    (3, "checkout outbox and orders.checkout_id", _migrate_outbox),
+    (4, "inventory.sku", _migrate_sku),
+    (5, "indexes for sales by order, by product and date, and by date", _migrate_sales_indexes),
+    (6, "inventory_changelog and triggers for change data capture", _migrate_inventory_changelog),
+    (7, "processed_retries for exactly-once retries", _migrate_processed_retries),
+    (8, "outbox delivery attempts and outbox_dead_letter", _migrate_outbox_attempts),
+]
+
+def _create_tables(conn):
+    """Bring a database up to the latest schema version, in one transaction."""
+    cursor = conn.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    for number, description, migrate in MIGRATIONS:
+        if number > version:
+            migrate(cursor)
+            cursor.execute(f"PRAGMA user_version = {number}")
+            print(f"🔧 Schema migration {number}: {description}")
+    
+    # Rebuild any deferrable index a bulk import left dropped
+    _create_indexes(cursor, DEFERRABLE_INDEXES)
     conn.commit()
-    conn.close()
-    print(f"Database '{db_name}' created successfully!")
 
 def add_sample_data(db_name='ecommerce.db'):
     """Add sample test data to all tables"""
-    conn = sqlite3.connect(db_name)
+    with get_pool(db_name).connection() as conn:
+        _insert_sample_data(conn)
+    print("Sample data added successfully!")
+
+def _insert_sample_data(conn):
     cursor = conn.cursor()
     
     # Sample inventory data
@@ -114,58 +321,91 @@ def add_sample_data(db_name='ecommerce.db'):
     ''', sales_data)
     
     conn.commit()
-    conn.close()
-    print("Sample data added successfully!")
 
+@timed_query
 def add_inventory_item(db_name, product_name, category, price, quantity, supplier):
     """Add a new product to inventory"""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO inventory (product_name, category, price, quantity_in_stock, supplier)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (product_name, category, price, quantity, supplier))
-    
-    conn.commit()
-    product_id = cursor.lastrowid
-    conn.close()
+    with get_pool(db_name).connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO inventory (product_name, category, price, quantity_in_stock, supplier)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (product_name, category, price, quantity, supplier))
+        
+        conn.commit()
+        product_id = cursor.lastrowid
     print(f"Added product with ID: {product_id}")
     return product_id
 
+@timed_query
 def add_order(db_name, customer_name, customer_email, total_amount, status, shipping_address):
     """Add a new order"""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-        INSERT INTO orders (customer_name, customer_email, total_amount, status, shipping_address)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (customer_name, customer_email, total_amount, status, shipping_address))
-    
-    conn.commit()
-    order_id = cursor.lastrowid
-    conn.close()
+    with get_pool(db_name).connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute('''
+            INSERT INTO orders (customer_name, customer_email, total_amount, status, shipping_address)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (customer_name, customer_email, total_amount, status, shipping_address))
+        
+        conn.commit()
+        order_id = cursor.lastrowid
     print(f"Added order with ID: {order_id}")
     return order_id
 
+@timed_query
 def add_sale(db_name, order_id, product_id, quantity, unit_price):
     """Add a sale record"""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    subtotal = quantity * unit_price
-    cursor.execute('''
-        INSERT INTO sales (order_id, product_id, quantity, unit_price, subtotal)
-        VALUES (?, ?, ?, ?, ?)
-    ''', (order_id, product_id, quantity, unit_price, subtotal))
-    
-    conn.commit()
-    sale_id = cursor.lastrowid
-    conn.close()
+    with get_pool(db_name).connection() as conn:
+        cursor = conn.cursor()
+        
+        subtotal = quantity * unit_price
+        cursor.execute('''
+            INSERT INTO sales (order_id, product_id, quantity, unit_price, subtotal)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (order_id, product_id, quantity, unit_price, subtotal))
+        
+        conn.commit()
+        sale_id = cursor.lastrowid
     print(f"Added sale with ID: {sale_id}")
     return sale_id
 
+def explain(conn, sql, params=()):
+    """EXPLAIN QUERY PLAN of a statement as (id, parent, detail) rows."""
+    return [(row[0], row[1], row[3]) for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def full_scans(plan):
+    """
+    Plan steps that visit every row of a table ("SCAN inventory") or every
+    entry of an index ("SCAN s USING INDEX ..."), rather than SEARCHing one.
+    """
+    return [detail for _, _, detail in plan if detail.startswith("SCAN ")]
+
+def print_plan(plan):
+    depth = {0: -1}
+    for node, parent, detail in plan:
+        depth[node] = depth.get(parent, -1) + 1
+        print(f"{'  ' * depth[node]}{'⚠️ ' if detail.startswith('SCAN ') else ''}{detail}")
+
+_plans_checked = set()
+
+def check_plan(conn, sql, label):
+    """
+    Warn (once per statement) when a query's plan contains full scans, so it
+    is noticed on sample data rather than on a production-sized table.
+    """
+    if not QUERY_PLAN_CHECK or sql in _plans_checked:
+        return
+    _plans_checked.add(sql)
+    plan = explain(conn, sql)
+    scans = full_scans(plan)
+    if scans:
+        full_scans_total.inc(query=label)
+        print(f"⚠️ {label}: query plan has {len(scans)} full scan(s): {'; '.join(scans)}")
+        print_plan(plan)
+
+@timed_query
 def query_table_internal(db_name, table_name, conditions=None, limit=None):
     """
     Query a table with optional conditions
@@ -176,22 +416,21 @@ def query_table_internal(db_name, table_name, conditions=None, limit=None):
         conditions: Optional WHERE clause (e.g., "price > 100")
         limit: Optional limit on number of results
     """
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    query = f"SELECT * FROM {table_name}"
+    query = f"SELECT * FROM {_table(table_name)}"
     if conditions:
         query += f" WHERE {conditions}"
     if limit:
         query += f" LIMIT {limit}"
     
-    cursor.execute(query)
-    results = cursor.fetchall()
-    
-    # Get column names
-    column_names = [description[0] for description in cursor.description]
-    
-    conn.close()
+    with get_pool(db_name).connection() as conn:
+        if conditions:  # without conditions reading every row is the point
+            check_plan(conn, query, "query_table_internal")
+        cursor = conn.cursor()
+        cursor.execute(query)
+        results = cursor.fetchall()
+        
+        # Get column names
+        column_names = [description[0] for description in cursor.description]
     
     print(f"\nQuery Results from '{table_name}':")
     print("-" * 80)
@@ -204,33 +443,32 @@ def query_table_internal(db_name, table_name, conditions=None, limit=None):
     
     return results
 
+@timed_query
 def query_table(db_name, table_name):
     """
     Query all rows from a SQLite table and return as a list of dicts.
     """
-    conn = sqlite3.connect(db_name)
-    conn.row_factory = sqlite3.Row  # enables dict-like access
-    cursor = conn.cursor()
-    
-    cursor.execute(f"SELECT * FROM {table_name}")
-    rows = cursor.fetchall()
-    
-    conn.close()
+    with get_pool(db_name).connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row  # enables dict-like access
+        
+        cursor.execute(f"SELECT * FROM {_table(table_name)}")
+        rows = cursor.fetchall()
     
     return [dict(row) for row in rows]
 
+@timed_query
 def query_custom(db_name, sql_query):
     """Execute a custom SQL query"""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    cursor.execute(sql_query)
-    results = cursor.fetchall()
-    
-    # Get column names
-    column_names = [description[0] for description in cursor.description]
-    
-    conn.close()
+    with get_pool(db_name).connection() as conn:
+        check_plan(conn, sql_query, "query_custom")
+        cursor = conn.cursor()
+        
+        cursor.execute(sql_query)
+        results = cursor.fetchall()
+        
+        # Get column names
+        column_names = [description[0] for description in cursor.description]
     
     print("\nCustom Query Results:")
     print("-" * 80)
@@ -243,33 +481,43 @@ def query_custom(db_name, sql_query):
     
     return results
 
+@timed_query
+def query_product(db_name, product_id, table_name="inventory"):
+    """Return a single product row as a dict, or None if it does not exist."""
+    with get_pool(db_name).connection() as conn:
+        cursor = conn.cursor()
+        cursor.row_factory = sqlite3.Row
+        cursor.execute(f"SELECT * FROM {_table(table_name)} WHERE product_id = ?", (product_id,))
+        row = cursor.fetchone()
+    
+    return dict(row) if row else None
+
+@timed_query
 def query_individual_item_price(db_name, product_id, table_name="inventory"):
-    conn = sqlite3.connect(db_name)
-    conn.row_factory = sqlite3.Row  # enables dict-like access
-    cursor = conn.cursor()
-    
-    # Use parameterized query to prevent SQL injection
-    cursor.execute(f"SELECT * FROM {table_name} WHERE product_id = ?", (product_id,))
-    
-    result = cursor.fetchone()
-    conn.close()
+    with get_pool(db_name).connection() as conn:
+        cursor = conn.cursor()
+        
+        # Use parameterized query to prevent SQL injection
+        cursor.execute(f"SELECT price FROM {_table(table_name)} WHERE product_id = ?", (product_id,))
+        
+        result = cursor.fetchone()
     
     # Return just the price value, or None if not found
-    return result["price"] if result else None
+    return result[0] if result else None
 
+@timed_query
 def update_inventory_quantity(db_name, product_id, quantity_to_reduce, table_name="inventory"):
     """Reduces inventory quantity for a specific product."""
-    conn = sqlite3.connect(db_name)
-    cursor = conn.cursor()
-    
-    cursor.execute(f"""
-        UPDATE {table_name} 
-        SET quantity_in_stock = quantity_in_stock - ? 
-        WHERE product_id = ?
-    """, (quantity_to_reduce, product_id))
-    
-    conn.commit()
-    conn.close()
+    with get_pool(db_name).connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(f"""
+            UPDATE {_table(table_name)} 
+            SET quantity_in_stock = quantity_in_stock - ? 
+            WHERE product_id = ?
+        """, (quantity_to_reduce, product_id))
+        
+        conn.commit()
     
     return cursor.rowcount > 0 
 
@@ -311,6 +559,10 @@ if __name__ == "__main__":
     #     ORDER BY s.sale_date DESC
     # ''')
     
+    # Query plan of the join above; ⚠️ marks steps that read a whole table or index
+    # with get_pool(DB_NAME).connection() as conn:
+    #     print_plan(explain(conn, "SELECT * FROM sales s JOIN orders o ON s.order_id = o.order_id"))
+    
     # Add new items examples
     # print("\n=== ADDING NEW DATA ===")
     # add_inventory_item(DB_NAME, 'Wireless Headphones', 'Electronics', 129.99, 80, 'Audio Pro')
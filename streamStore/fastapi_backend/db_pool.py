@@ -0,0 +1,127 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Applied to every connection when it is opened.
+# WAL lets readers (the API) run concurrently with the consumer's writes,
+# and synchronous=NORMAL is durable under WAL while skipping the per-commit
+# fsync of the main database file.
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",  # ~16 MB page cache per connection
+)
+
+# Size of sqlite3's per-connection prepared statement cache. Statements are
+# keyed by their SQL text, so helpers should use fixed SQL with ? parameters.
+STATEMENT_CACHE_SIZE = 256
+
+def open_connection(db_name, isolation_level=""):
+    """
+    Open a SQLite connection with the standard pragmas applied.
+    The connection may be used from any thread, but only by one thread at a time.
+    """
+    conn = sqlite3.connect(
+        db_name,
+        isolation_level=isolation_level,
+        check_same_thread=False,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    for pragma in PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections to a single database file.
+
+    Connections are opened lazily up to `size`; when all of them are in use,
+    borrowers wait up to `timeout` seconds for one to be returned.
+    """
+
+    def __init__(self, db_name, size=8, timeout=30.0):
+        self.db_name = db_name
+        self.size = size
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                open_new = True
+            else:
+                open_new = False
+
+        if open_new:
+            try:
+                return open_connection(self.db_name)
+            except Exception:
+                with self._lock:
+                    self._opened -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No SQLite connection to '{self.db_name}' available after {self.timeout}s")
+
+    def _release(self, conn):
+        # Never hand out a connection with a half-finished transaction
+        if conn.in_transaction:
+            conn.rollback()
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a `with` block."""
+        conn = self._acquire()
+        try:
+            yield conn
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+        finally:
+            self._release(conn)
+
+    def close(self):
+        """Close all idle connections."""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._opened -= 1
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(db_name):
+    """Return the shared pool for `db_name`, creating it on first use."""
+    pool = _pools.get(db_name)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(db_name)
+            if pool is None:
+                pool = _pools[db_name] = ConnectionPool(db_name)
+    return pool
+
+def close_all_pools():
+    """Close every pool created by get_pool (e.g. on application shutdown)."""
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.close()
+        _pools.clear()
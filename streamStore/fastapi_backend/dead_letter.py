@@ -0,0 +1,178 @@
+import time
+from confluent_kafka import KafkaError, KafkaException, TopicPartition
+from kafka_clients import make_consumer, make_producer
+from metrics import counter
+from order_codec import encode_order
+from settings import (
+    ORDERS_TOPIC, ORDERS_RETRY_TOPIC, ORDERS_DLQ_TOPIC,
+    RETRY_MAX_ATTEMPTS, RETRY_BASE_DELAY_MS, RETRY_MAX_DELAY_MS,
+)
+
+# Headers carried by retried and dead-lettered orders
+HEADER_REASON = "x-failure-reason"
+HEADER_ATTEMPT = "x-attempt"
+HEADER_RETRY_AT = "x-retry-at"  # epoch milliseconds
+HEADER_ORIGINAL_TOPIC = "x-original-topic"
+HEADER_ORIGINAL_PARTITION = "x-original-partition"
+HEADER_ORIGINAL_OFFSET = "x-original-offset"
+
+# Failures that will never succeed on a retry go straight to the DLQ
+PERMANENT_FAILURES = {"decode_error", "invalid_line"}
+
+order_failures = counter("order_failures_total", "Order lines that failed processing", ["reason"])
+orders_retried = counter("order_retries_scheduled_total", "Failed orders sent to the retry topic", ["reason"])
+orders_dead_lettered = counter("order_dead_lettered_total", "Failed orders sent to the dead letter topic", ["reason"])
+orders_replayed = counter("order_retries_replayed_total", "Retried orders put back on the orders topic")
+
+def header(msg, name):
+    """Value of header `name` as a str, or None."""
+    for key, value in msg.headers() or ():
+        if key == name:
+            return value.decode("utf-8") if value is not None else None
+    return None
+
+def attempt_of(msg):
+    """How many times this order has already been tried (1 for a fresh order)."""
+    value = header(msg, HEADER_ATTEMPT)
+    return int(value) if value else 1
+
+def original_position(msg):
+    """(topic, partition, offset) where a retried order was first consumed, or None for a fresh one."""
+    topic = header(msg, HEADER_ORIGINAL_TOPIC)
+    partition = header(msg, HEADER_ORIGINAL_PARTITION)
+    offset = header(msg, HEADER_ORIGINAL_OFFSET)
+    if topic is None or partition is None or offset is None:
+        return None
+    return topic, int(partition), int(offset)
+
+def retry_delay_ms(attempt):
+    """Backoff before attempt number `attempt + 1`: base * 2^(attempt - 1), capped."""
+    return min(RETRY_BASE_DELAY_MS * 2 ** (attempt - 1), RETRY_MAX_DELAY_MS)
+
+class FailureRouter:
+    """
+    Sends failed orders to the retry topic with an exponentially growing
+    delay, or to the dead letter topic once they run out of attempts (or
+    can never succeed). Only the failed lines of a cart are forwarded.
+    """
+
+    def __init__(self, producer):
+        self.producer = producer
+
+    def route(self, msg, orders, reason):
+        """
+        Route a failure. `orders` are the failed order-line dicts from `msg`,
+        or None when the message itself could not be decoded. Returns the
+        topic it was sent to (retry or dead letter).
+        """
+        order_failures.inc(len(orders) if orders else 1, reason=reason)
+
+        attempt = attempt_of(msg)
+        headers = [
+            (HEADER_REASON, reason),
+            (HEADER_ORIGINAL_TOPIC, header(msg, HEADER_ORIGINAL_TOPIC) or msg.topic()),
+            (HEADER_ORIGINAL_PARTITION, header(msg, HEADER_ORIGINAL_PARTITION) or str(msg.partition())),
+            (HEADER_ORIGINAL_OFFSET, header(msg, HEADER_ORIGINAL_OFFSET) or str(msg.offset())),
+        ]
+
+        if reason in PERMANENT_FAILURES or attempt >= RETRY_MAX_ATTEMPTS:
+            # x-attempt on the DLQ is the number of attempts made
+            topic = ORDERS_DLQ_TOPIC
+            headers.append((HEADER_ATTEMPT, str(attempt)))
+            orders_dead_lettered.inc(reason=reason)
+            print(f"☠️ Dead-lettering order from {msg.topic()}[{msg.partition()}]@{msg.offset()} after {attempt} attempt(s): {reason}")
+        else:
+            # x-attempt on the retry topic is the number of the next attempt
+            topic = ORDERS_RETRY_TOPIC
+            retry_at = int(time.time() * 1000) + retry_delay_ms(attempt)
+            headers.append((HEADER_ATTEMPT, str(attempt + 1)))
+            headers.append((HEADER_RETRY_AT, str(retry_at)))
+            orders_retried.inc(reason=reason)
+
+        self.producer.produce(topic, self._payload(msg, orders), key=msg.key(), headers=headers)
+        self.producer.poll(0)
+        return topic
+
+    def _payload(self, msg, orders):
+        # Forward the original bytes unless only part of the cart failed
+        if orders is None:
+            return msg.value()
+        first = orders[0]
+        try:
+            return encode_order(
+                first["order_id"],
+                [(o["product_id"], o["quantity"], o["unit_price"]) for o in orders],
+                created_us=first.get("created_us"),
+            )
+        except (ValueError, TypeError):
+            return msg.value()
+
+class RetryScheduler:
+    """
+    Replays orders from the retry topic once their x-retry-at time has passed.
+
+    It runs in its own consumer group, so waiting for a delay never holds up
+    the order workers. Partitions whose next message is not yet due are
+    paused and rewound to that message instead of blocking the loop.
+    """
+
+    def __init__(self, stop_event, poll_timeout=0.5):
+        self.stop_event = stop_event
+        self.poll_timeout = poll_timeout
+        self.consumer = make_consumer({
+            "group.id": "order-retry-scheduler",
+            "auto.offset.reset": "earliest",
+            "enable.auto.commit": False,
+        })
+        self.producer = make_producer({"enable.idempotence": True})
+        self.paused = {}  # TopicPartition key (topic, partition) -> resume time (epoch ms)
+
+    def on_revoke(self, consumer, partitions):
+        for p in partitions:
+            self.paused.pop((p.topic, p.partition), None)
+
+    def resume_due(self, now_ms):
+        due = [key for key, resume_at in self.paused.items() if resume_at <= now_ms]
+        if due:
+            self.consumer.resume([TopicPartition(topic, partition) for topic, partition in due])
+            for key in due:
+                del self.paused[key]
+
+    def run(self):
+        self.consumer.subscribe([ORDERS_RETRY_TOPIC], on_revoke=self.on_revoke)
+        print(f"🟢 Retry scheduler subscribed to {ORDERS_RETRY_TOPIC}")
+        try:
+            while not self.stop_event.is_set():
+                self.resume_due(int(time.time() * 1000))
+                msg = self.consumer.poll(self.poll_timeout)
+                if msg is None:
+                    continue
+                if msg.error():
+                    if msg.error().code() != KafkaError._PARTITION_EOF:
+                        print(f"❌ Retry scheduler Kafka Error: {msg.error()}")
+                    continue
+
+                retry_at = int(header(msg, HEADER_RETRY_AT) or 0)
+                if retry_at > int(time.time() * 1000):
+                    # Not due yet: park this partition on this message
+                    tp = TopicPartition(msg.topic(), msg.partition(), msg.offset())
+                    self.consumer.pause([tp])
+                    self.consumer.seek(tp)
+                    self.paused[(msg.topic(), msg.partition())] = retry_at
+                    continue
+
+                headers = [(k, v) for k, v in msg.headers() or () if k != HEADER_RETRY_AT]
+                self.producer.produce(ORDERS_TOPIC, msg.value(), key=msg.key(), headers=headers)
+                if self.producer.flush(10) > 0:
+                    # Not acknowledged: read it again rather than lose it
+                    self.consumer.seek(TopicPartition(msg.topic(), msg.partition(), msg.offset()))
+                    continue
+                try:
+                    self.consumer.commit(message=msg, asynchronous=False)
+                except KafkaException as e:
+                    print(f"❌ Retry scheduler offset commit failed: {e}")
+                orders_replayed.inc()
+        finally:
+            self.consumer.close()
+            self.producer.flush(5)
+            print("🔴 Retry scheduler stopped")
@@ -0,0 +1,590 @@
+"""
+Local stand-in for the parts of confluent_kafka's Producer, Consumer and
+AdminClient that streamStore uses, so the pipeline can run, be tested and
+be benchmarked without a broker (KAFKA_BACKEND=local, see kafka_clients.py).
+
+A FakeBroker is a directory. Every partition of a topic is an append-only,
+memory-mapped log file: producers append whole batches under a file lock
+and consumers decode messages straight out of the mapping, so processes
+sharing the directory see the same topics and offsets.
+
+    LOCAL_KAFKA_DIR/topics/orders/3.log                   partition 3 of orders
+    LOCAL_KAFKA_DIR/groups/order-tracker/orders.offsets   committed offsets (checkpoint.OffsetCheckpoint)
+    LOCAL_KAFKA_DIR/groups/order-tracker/members/0.lock   locked by each live consumer
+    LOCAL_KAFKA_DIR/groups/order-tracker/orders-3.lease   locked by the partition's owner
+
+Group membership and partition ownership are flock()s, which the OS drops
+when a process dies; consumers rebalance every REBALANCE_SECONDS, handing
+over partitions beyond their fair share and claiming free ones. Logs are
+never truncated or compacted.
+"""
+import fcntl
+import itertools
+import mmap
+import os
+import struct
+import tempfile
+import threading
+import time
+from array import array
+from concurrent.futures import Future
+from contextlib import contextmanager
+from types import SimpleNamespace
+from checkpoint import OffsetCheckpoint
+from partitioning import partition_for
+
+LOG_MAGIC = b"SSKL"
+LOG_VERSION = 1
+LOG_HEADER = struct.Struct("<4sH2xqq")  # magic, version, end of the last record, records
+LOG_END = struct.Struct("<q")           # the two header fields are also written separately
+END_AT, COUNT_AT = 8, 16
+RECORD = struct.Struct("<Iqiii")        # record size, timestamp ms, key size, value size, headers (-1 = None)
+HEADER_FIELD = struct.Struct("<Hi")     # name size, value size (-1 = None)
+INITIAL_LOG_SIZE = 1 << 20
+
+OFFSET_INVALID = -1001
+
+# How often a consumer re-checks the group for members joining or leaving
+REBALANCE_SECONDS = float(os.getenv("LOCAL_KAFKA_REBALANCE_SECONDS", "1.0"))
+# Readers in other processes are not notified of new data; they poll this often
+POLL_SECONDS = 0.005
+
+class FakeMessage:
+    def __init__(self, topic, partition, offset, key, value, headers, timestamp=None):
+        self._topic = topic
+        self._partition = partition
+        self._offset = offset
+        self._key = key
+        self._value = value
+        self._headers = headers
+        self._timestamp = timestamp if timestamp is not None else int(time.time() * 1000)
+
+    def topic(self):
+        return self._topic
+
+    def partition(self):
+        return self._partition
+
+    def offset(self):
+        return self._offset
+
+    def key(self):
+        return self._key
+
+    def value(self):
+        return self._value
+
+    def headers(self):
+        return self._headers
+
+    def timestamp(self):
+        return (1, self._timestamp)  # TIMESTAMP_CREATE_TIME
+
+    def error(self):
+        return None
+
+def encode_record(key, value, headers, timestamp):
+    parts = [b"", key or b"", value or b""]
+    for name, header_value in headers or ():
+        name = name.encode("utf-8")
+        if isinstance(header_value, str):
+            header_value = header_value.encode("utf-8")
+        parts.append(HEADER_FIELD.pack(len(name), -1 if header_value is None else len(header_value)))
+        parts.append(name)
+        parts.append(header_value or b"")
+    size = RECORD.size + sum(len(part) for part in parts)
+    parts[0] = RECORD.pack(
+        size, timestamp,
+        -1 if key is None else len(key),
+        -1 if value is None else len(value),
+        -1 if headers is None else len(headers),
+    )
+    return b"".join(parts)
+
+@contextmanager
+def file_lock(fd):
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+def try_lock(path):
+    """An fd holding an exclusive flock on `path`, or None if someone else holds it."""
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+class PartitionLog:
+    """
+    One partition: records appended back to back after a header holding the
+    end of the last complete record and the record count. Appenders write
+    the records first and the count last, so readers never see a partial one.
+    """
+
+    def __init__(self, path, topic, partition):
+        self.path = path
+        self.topic = topic
+        self.partition = partition
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        self._map = None
+        self._lock = threading.Lock()  # flock() does not exclude threads sharing the fd
+        self._positions = array("q")   # byte position of each offset indexed so far
+        self._next_position = LOG_HEADER.size
+
+        with file_lock(self._fd):
+            if os.fstat(self._fd).st_size < LOG_HEADER.size:
+                os.ftruncate(self._fd, INITIAL_LOG_SIZE)
+                self._remap()
+                LOG_HEADER.pack_into(self._map, 0, LOG_MAGIC, LOG_VERSION, LOG_HEADER.size, 0)
+            else:
+                self._remap()
+            magic, version, _, _ = LOG_HEADER.unpack_from(self._map, 0)
+        if (magic, version) != (LOG_MAGIC, LOG_VERSION):
+            raise ValueError(f"{path} is not a partition log")
+
+    def _remap(self):
+        size = os.fstat(self._fd).st_size
+        if self._map is None or len(self._map) < size:
+            if self._map is not None:
+                self._map.close()
+            self._map = mmap.mmap(self._fd, size)
+
+    def end_offset(self):
+        return LOG_END.unpack_from(self._map, COUNT_AT)[0]
+
+    def append(self, records):
+        """Append encoded records; returns the offset of the first one."""
+        data = b"".join(records)
+        with self._lock, file_lock(self._fd):
+            first = LOG_END.unpack_from(self._map, COUNT_AT)[0]
+            end = LOG_END.unpack_from(self._map, END_AT)[0]
+            if end + len(data) > len(self._map):
+                self._remap()  # another process may have grown the file already
+                if end + len(data) > len(self._map):
+                    os.ftruncate(self._fd, max(2 * len(self._map), end + len(data)))
+                    self._remap()
+            self._map[end:end + len(data)] = data
+            LOG_END.pack_into(self._map, END_AT, end + len(data))
+            LOG_END.pack_into(self._map, COUNT_AT, first + len(records))
+        return first
+
+    def read(self, offset, max_messages):
+        with self._lock:
+            count = LOG_END.unpack_from(self._map, COUNT_AT)[0]
+            last = min(count, offset + max_messages)
+            if offset >= last:
+                return []
+            if LOG_END.unpack_from(self._map, END_AT)[0] > len(self._map):
+                self._remap()
+            while len(self._positions) < last:
+                self._positions.append(self._next_position)
+                self._next_position += RECORD.unpack_from(self._map, self._next_position)[0]
+            return [self._decode(o, self._positions[o]) for o in range(offset, last)]
+
+    def _decode(self, offset, position):
+        _, timestamp, key_size, value_size, header_count = RECORD.unpack_from(self._map, position)
+        position += RECORD.size
+        key = None
+        if key_size >= 0:
+            key = self._map[position:position + key_size]
+            position += key_size
+        value = None
+        if value_size >= 0:
+            value = self._map[position:position + value_size]
+            position += value_size
+        headers = None
+        if header_count >= 0:
+            headers = []
+            for _ in range(header_count):
+                name_size, header_size = HEADER_FIELD.unpack_from(self._map, position)
+                position += HEADER_FIELD.size
+                name = self._map[position:position + name_size].decode("utf-8")
+                position += name_size
+                header_value = None
+                if header_size >= 0:
+                    header_value = self._map[position:position + header_size]
+                    position += header_size
+                headers.append((name, header_value))
+        return FakeMessage(self.topic, self.partition, offset, key, value, headers, timestamp)
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+class FakeBroker:
+    def __init__(self, directory=None, num_partitions=6):
+        self.directory = directory or tempfile.mkdtemp(prefix="streamstore-kafka-")
+        self.num_partitions = num_partitions  # of topics created implicitly
+        self._logs = {}     # topic -> [PartitionLog per partition]
+        self._offsets = {}  # (group, topic) -> OffsetCheckpoint of committed offsets
+        self._lock = threading.Lock()
+        self._new_data = threading.Condition()
+        os.makedirs(os.path.join(self.directory, "topics"), exist_ok=True)
+        os.makedirs(os.path.join(self.directory, "groups"), exist_ok=True)
+
+    def _topic(self, topic, num_partitions=None):
+        logs = self._logs.get(topic)
+        if logs is not None:
+            return logs
+        with self._lock:
+            if topic not in self._logs:
+                self._logs[topic] = self._open_topic(topic, num_partitions or self.num_partitions)
+            return self._logs[topic]
+
+    def _open_topic(self, topic, num_partitions):
+        directory = os.path.join(self.directory, "topics", topic)
+        meta = os.path.join(directory, "partitions")
+        lock_fd = os.open(os.path.join(self.directory, "topics", ".lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # The first process to use a topic fixes its partition count
+            with file_lock(lock_fd):
+                if os.path.exists(meta):
+                    with open(meta) as f:
+                        num_partitions = int(f.read())
+                else:
+                    os.makedirs(directory, exist_ok=True)
+                    with open(meta, "w") as f:
+                        f.write(str(num_partitions))
+        finally:
+            os.close(lock_fd)
+        return [PartitionLog(os.path.join(directory, f"{p}.log"), topic, p) for p in range(num_partitions)]
+
+    def create_topic(self, topic, num_partitions=None):
+        return len(self._topic(topic, num_partitions))
+
+    def partitions(self, topic):
+        return len(self._topic(topic))
+
+    def append(self, topic, partition, key, value, headers):
+        return self.append_batch(topic, partition, [(key, value, headers)])[0]
+
+    def append_batch(self, topic, partition, messages):
+        """Append (key, value, headers) tuples to one partition; returns their FakeMessages."""
+        timestamp = int(time.time() * 1000)
+        records = [encode_record(key, value, headers, timestamp) for key, value, headers in messages]
+        first = self._topic(topic)[partition].append(records)
+        with self._new_data:
+            self._new_data.notify_all()
+        return [
+            FakeMessage(topic, partition, first + i, key, value, headers, timestamp)
+            for i, (key, value, headers) in enumerate(messages)
+        ]
+
+    def read(self, topic, partition, offset, max_messages):
+        return self._topic(topic)[partition].read(offset, max_messages)
+
+    def end_offset(self, topic, partition):
+        return self._topic(topic)[partition].end_offset()
+
+    def wait_for_data(self, timeout):
+        with self._new_data:
+            self._new_data.wait(min(timeout, POLL_SECONDS))
+
+    def offset_for_time(self, topic, partition, timestamp):
+        """First offset whose timestamp (ms) is at or after `timestamp`, or -1 if there is none."""
+        log = self._topic(topic)[partition]
+        low, high = 0, log.end_offset()
+        end = high
+        while low < high:
+            middle = (low + high) // 2
+            if log.read(middle, 1)[0].timestamp()[1] < timestamp:
+                low = middle + 1
+            else:
+                high = middle
+        return low if low < end else -1
+
+    def _group_offsets(self, group, topic, create):
+        checkpoint = self._offsets.get((group, topic))
+        if checkpoint is None:
+            path = os.path.join(self.directory, "groups", group, f"{topic}.offsets")
+            if not create and not os.path.exists(path):
+                return None
+            with self._lock:
+                checkpoint = self._offsets.get((group, topic))
+                if checkpoint is None:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                    checkpoint = self._offsets[(group, topic)] = OffsetCheckpoint(path, f"{group}/{topic}")
+        return checkpoint
+
+    def commit(self, group, topic, partition, offset):
+        self._group_offsets(group, topic, create=True).store(partition, offset)
+
+    def committed(self, group, topic, partition):
+        checkpoint = self._group_offsets(group, topic, create=False)
+        return checkpoint.get(partition) if checkpoint is not None else None
+
+    def lag(self, group, topic):
+        """Total messages in `topic` not yet committed by `group`."""
+        return sum(
+            self.end_offset(topic, p) - (self.committed(group, topic, p) or 0)
+            for p in range(self.partitions(topic))
+        )
+
+    def _group_dir(self, group, *parts):
+        path = os.path.join(self.directory, "groups", group, *parts)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def join(self, group):
+        """Take a member slot in `group`; returns the fd that holds it until closed."""
+        members = self._group_dir(group, "members")
+        for slot in itertools.count():
+            fd = try_lock(os.path.join(members, f"{slot}.lock"))
+            if fd is not None:
+                return fd
+
+    def members(self, group):
+        """Number of live members of `group`, in any process."""
+        members = self._group_dir(group, "members")
+        live = 0
+        for name in os.listdir(members):
+            fd = try_lock(os.path.join(members, name))
+            if fd is None:
+                live += 1
+            else:
+                os.close(fd)
+        return live
+
+    def claim(self, group, topic, partition):
+        """An fd owning `partition` for one member of `group`, or None if another member owns it."""
+        return try_lock(os.path.join(self._group_dir(group), f"{topic}-{partition}.lease"))
+
+    def close(self):
+        for logs in self._logs.values():
+            for log in logs:
+                log.close()
+        for checkpoint in self._offsets.values():
+            checkpoint.close()
+        self._logs.clear()
+        self._offsets.clear()
+
+def topic_metadata(broker, topic):
+    if not topic:
+        return SimpleNamespace(topics={})
+    partitions = {p: SimpleNamespace(id=p) for p in range(broker.partitions(topic))}
+    return SimpleNamespace(topics={topic: SimpleNamespace(partitions=partitions, error=None)})
+
+class FakeProducer:
+    def __init__(self, broker, config=None):
+        self.broker = broker
+        self._pending = []
+        self._lock = threading.Lock()
+        self._round_robin = itertools.count()
+
+    def produce(self, topic, value=None, key=None, headers=None, partition=None, on_delivery=None, callback=None):
+        if isinstance(key, str):
+            key = key.encode("utf-8")
+        if isinstance(value, str):
+            value = value.encode("utf-8")
+        if headers is not None:
+            headers = list(headers.items()) if isinstance(headers, dict) else list(headers)
+        if partition is None or partition < 0:
+            partitions = self.broker.partitions(topic)
+            if key is not None:
+                partition = partition_for(key.decode("utf-8"), partitions)
+            else:
+                partition = next(self._round_robin) % partitions
+        with self._lock:
+            self._pending.append((topic, partition, key, value, headers, on_delivery or callback))
+
+    def poll(self, timeout=0):
+        """'Deliver' everything queued so far, one append per partition, and run the delivery callbacks."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        if not pending and timeout:
+            time.sleep(min(timeout, 0.001))
+        batches = {}
+        for topic, partition, key, value, headers, on_delivery in pending:
+            batches.setdefault((topic, partition), []).append((key, value, headers, on_delivery))
+        for (topic, partition), batch in batches.items():
+            messages = self.broker.append_batch(topic, partition, [m[:3] for m in batch])
+            for msg, (_, _, _, on_delivery) in zip(messages, batch):
+                if on_delivery is not None:
+                    on_delivery(None, msg)
+        return len(pending)
+
+    def flush(self, timeout=None):
+        self.poll(0)
+        return 0
+
+    def __len__(self):
+        return len(self._pending)
+
+    def list_topics(self, topic=None, timeout=None):
+        return topic_metadata(self.broker, topic)
+
+class FakeConsumer:
+    def __init__(self, broker, config):
+        self.broker = broker
+        self.group = config.get("group.id", "fake-group")
+        self.reset_latest = config.get("auto.offset.reset") == "latest"
+        self._topics = []
+        self._positions = {}   # owned (topic, partition) -> next offset to read
+        self._leases = {}      # owned (topic, partition) -> fd of its lease
+        self._paused = set()
+        self._member = None
+        self._on_assign = None
+        self._on_revoke = None
+        self._next_rebalance = 0.0
+
+    def subscribe(self, topics, on_assign=None, on_revoke=None, on_lost=None):
+        self._topics = list(topics)
+        self._on_assign = on_assign
+        self._on_revoke = on_revoke
+        if self._member is None:
+            self._member = self.broker.join(self.group)
+        self._rebalance()
+
+    def _rebalance(self):
+        """
+        Incremental cooperative rebalance: hand over the partitions beyond
+        this member's fair share, then claim free ones up to it.
+        """
+        self._next_rebalance = time.monotonic() + REBALANCE_SECONDS
+        members = max(self.broker.members(self.group), 1)
+        revoked = []
+        wanted = {}
+        for topic in self._topics:
+            partitions = self.broker.partitions(topic)
+            share = -(-partitions // members)
+            owned = sorted(p for t, p in self._leases if t == topic)
+            revoked += [(topic, p) for p in owned[share:]]
+            wanted[topic] = (partitions, share - min(len(owned), share))
+        if revoked:
+            self._revoke(revoked)
+
+        assigned = []
+        for topic, (partitions, free) in wanted.items():
+            for partition in range(partitions):
+                if free == 0:
+                    break
+                if (topic, partition) in self._leases:
+                    continue
+                lease = self.broker.claim(self.group, topic, partition)
+                if lease is None:
+                    continue
+                self._leases[(topic, partition)] = lease
+                committed = self.broker.committed(self.group, topic, partition)
+                if committed is None:
+                    committed = self.broker.end_offset(topic, partition) if self.reset_latest else 0
+                self._positions[(topic, partition)] = committed
+                assigned.append(SimpleNamespace(topic=topic, partition=partition, offset=OFFSET_INVALID))
+                free -= 1
+        if assigned and self._on_assign is not None:
+            self._on_assign(self, assigned)
+
+    def _revoke(self, keys):
+        if keys and self._on_revoke is not None:
+            self._on_revoke(self, [SimpleNamespace(topic=t, partition=p) for t, p in keys])
+        for key in keys:
+            self._positions.pop(key, None)
+            self._paused.discard(key)
+            os.close(self._leases.pop(key))
+
+    def incremental_assign(self, partitions):
+        for tp in partitions:
+            if tp.offset >= 0:
+                self._positions[(tp.topic, tp.partition)] = tp.offset
+
+    def committed(self, partitions, timeout=None):
+        result = []
+        for tp in partitions:
+            offset = self.broker.committed(self.group, tp.topic, tp.partition)
+            result.append(SimpleNamespace(topic=tp.topic, partition=tp.partition,
+                                          offset=OFFSET_INVALID if offset is None else offset))
+        return result
+
+    def get_watermark_offsets(self, partition, timeout=None, cached=False):
+        return 0, self.broker.end_offset(partition.topic, partition.partition)
+
+    def offsets_for_times(self, partitions, timeout=None):
+        """Partitions with `offset` holding a timestamp (ms), mapped to the first offset at or after it."""
+        return [
+            SimpleNamespace(topic=tp.topic, partition=tp.partition,
+                            offset=self.broker.offset_for_time(tp.topic, tp.partition, tp.offset))
+            for tp in partitions
+        ]
+
+    def list_topics(self, topic=None, timeout=None):
+        return topic_metadata(self.broker, topic)
+
+    def consume(self, num_messages=1, timeout=-1):
+        deadline = time.monotonic() + (timeout if timeout >= 0 else 3600)
+        while True:
+            if self._topics and time.monotonic() >= self._next_rebalance:
+                self._rebalance()
+            batch = []
+            for (topic, partition), offset in self._positions.items():
+                if (topic, partition) in self._paused:
+                    continue
+                messages = self.broker.read(topic, partition, offset, num_messages - len(batch))
+                if messages:
+                    self._positions[(topic, partition)] = offset + len(messages)
+                    batch.extend(messages)
+                if len(batch) >= num_messages:
+                    return batch
+            remaining = deadline - time.monotonic()
+            if batch or remaining <= 0:
+                return batch
+            self.broker.wait_for_data(remaining)
+
+    def poll(self, timeout=-1):
+        batch = self.consume(1, timeout)
+        return batch[0] if batch else None
+
+    def commit(self, message=None, offsets=None, asynchronous=True):
+        if message is not None:
+            self.broker.commit(self.group, message.topic(), message.partition(), message.offset() + 1)
+        elif offsets is not None:
+            for tp in offsets:
+                self.broker.commit(self.group, tp.topic, tp.partition, tp.offset)
+        else:
+            for (topic, partition), offset in self._positions.items():
+                self.broker.commit(self.group, topic, partition, offset)
+
+    def seek(self, tp):
+        self._positions[(tp.topic, tp.partition)] = tp.offset
+
+    def pause(self, partitions):
+        self._paused.update((tp.topic, tp.partition) for tp in partitions)
+
+    def resume(self, partitions):
+        self._paused.difference_update((tp.topic, tp.partition) for tp in partitions)
+
+    def close(self):
+        self._revoke(list(self._leases))
+        self._topics = []
+        if self._member is not None:
+            os.close(self._member)
+            self._member = None
+
+class FakeAdminClient:
+    def __init__(self, broker, config=None):
+        self.broker = broker
+
+    def create_topics(self, new_topics, **kwargs):
+        """Create topics that do not exist yet; existing ones keep their partition count."""
+        futures = {}
+        for new_topic in new_topics:
+            self.broker.create_topic(new_topic.topic, new_topic.num_partitions)
+            futures[new_topic.topic] = future = Future()
+            future.set_result(None)
+        return futures
+
+    def list_consumer_group_offsets(self, requests, **kwargs):
+        """Committed offsets of each requested group, as a future per group id."""
+        futures = {}
+        for request in requests:
+            partitions = []
+            for tp in request.topic_partitions:
+                offset = self.broker.committed(request.group_id, tp.topic, tp.partition)
+                partitions.append(SimpleNamespace(topic=tp.topic, partition=tp.partition,
+                                                  offset=OFFSET_INVALID if offset is None else offset))
+            futures[request.group_id] = future = Future()
+            future.set_result(SimpleNamespace(group_id=request.group_id, topic_partitions=partitions))
+        return futures
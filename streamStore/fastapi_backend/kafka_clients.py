@@ -0,0 +1,52 @@
+import os
+import threading
+from confluent_kafka import Consumer, Producer
+from confluent_kafka.admin import AdminClient
+from fake_kafka import FakeAdminClient, FakeBroker, FakeConsumer, FakeProducer
+from settings import KAFKA_BACKEND, KAFKA_BROKER, LOCAL_KAFKA_DIR, ORDERS_PARTITIONS
+
+_broker = None
+_broker_pid = None
+_broker_lock = threading.Lock()
+
+def local_broker():
+    """
+    This process's FakeBroker on LOCAL_KAFKA_DIR. A forked worker opens its
+    own: group membership is held with file locks, which belong to a process.
+    """
+    global _broker, _broker_pid
+    with _broker_lock:
+        if _broker is None or _broker_pid != os.getpid():
+            _broker = FakeBroker(LOCAL_KAFKA_DIR, ORDERS_PARTITIONS)
+            _broker_pid = os.getpid()
+        return _broker
+
+# Available backends, selected by KAFKA_BACKEND: (producer, consumer, admin client) factories
+BACKENDS = {
+    "kafka": (
+        lambda config: Producer({"bootstrap.servers": KAFKA_BROKER, **config}),
+        lambda config: Consumer({"bootstrap.servers": KAFKA_BROKER, **config}),
+        lambda config: AdminClient({"bootstrap.servers": KAFKA_BROKER, **config}),
+    ),
+    "local": (
+        lambda config: FakeProducer(local_broker(), config),
+        lambda config: FakeConsumer(local_broker(), config),
+        lambda config: FakeAdminClient(local_broker(), config),
+    ),
+}
+
+def _backend():
+    backend = BACKENDS.get(KAFKA_BACKEND)
+    if backend is None:
+        raise ValueError(f"Unknown KAFKA_BACKEND '{KAFKA_BACKEND}' (available: {', '.join(BACKENDS)})")
+    return backend
+
+def make_producer(config=None):
+    """A producer for the configured backend; `config` is librdkafka settings without bootstrap.servers."""
+    return _backend()[0](config or {})
+
+def make_consumer(config):
+    return _backend()[1](config)
+
+def make_admin(config=None):
+    return _backend()[2](config or {})
@@ -0,0 +1,277 @@
+"""
+Load generator and benchmark for the streamStore checkout pipeline.
+
+Offline mode (the default) runs the whole pipeline in-process with no broker:
+concurrent calls into the /checkout handler, the outbox relay, the orders topic held by
+fake_kafka's memory-mapped logs (KAFKA_BACKEND=local), and an order consumer
+worker applying batches to a scratch SQLite database.
+
+    python loadgen.py --orders 5000 --concurrency 32 --cart-sizes 1:0.5,3:0.3,8:0.2
+
+HTTP mode drives a running backend instead. Only checkout latency is
+measured there; the consumer reports its side on its own /metrics. All
+requests come from one client, so start the backend with
+CHECKOUT_RATE_PER_CLIENT=0 to measure capacity rather than the rate limit
+(429s are reported under "errors").
+
+    python loadgen.py --target http://localhost:8000 --orders 2000 --concurrency 16
+
+Results are printed as JSON (or written to --output) so runs can be compared
+for regressions.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+def parse_distribution(spec):
+    """'1:0.5,3:0.3,8:0.2' -> ([1, 3, 8], [0.5, 0.3, 0.2])"""
+    sizes, weights = [], []
+    for part in spec.split(","):
+        size, _, weight = part.partition(":")
+        sizes.append(int(size))
+        weights.append(float(weight or 1))
+    return sizes, weights
+
+def make_carts(n, sizes, weights, product_ids, skew, seed):
+    """
+    Build `n` carts of (product_id, quantity) lines. With skew > 0, product
+    popularity follows a Zipf-like 1/rank^skew curve (hot products).
+    """
+    rng = random.Random(seed)
+    popularity = [1.0 / (rank + 1) ** skew for rank in range(len(product_ids))]
+    carts = []
+    for size in rng.choices(sizes, weights, k=n):
+        size = min(size, len(product_ids))
+        chosen = set()
+        while len(chosen) < size:
+            chosen.add(rng.choices(product_ids, popularity)[0])
+        carts.append([(product_id, rng.randint(1, 3)) for product_id in chosen])
+    return carts
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(q / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(latencies):
+    values = sorted(latencies)
+    if not values:
+        return {"count": 0}
+    ms = lambda seconds: round(seconds * 1000, 3)
+    return {
+        "count": len(values),
+        "mean_ms": ms(sum(values) / len(values)),
+        "p50_ms": ms(percentile(values, 50)),
+        "p90_ms": ms(percentile(values, 90)),
+        "p99_ms": ms(percentile(values, 99)),
+        "max_ms": ms(values[-1]),
+    }
+
+def histogram_quantile(histogram, q):
+    """Estimate a quantile from a metrics.Histogram the way Prometheus does (linear within a bucket)."""
+    series = next(iter(histogram._series.values()), None)
+    if not series:
+        return None
+    counts = series[:-1]
+    total = sum(counts)
+    rank = q * total
+    cumulative = 0
+    lower = 0.0
+    for bound, count in zip(histogram.buckets + (float("inf"),), counts):
+        if cumulative + count >= rank and count:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - cumulative) / count
+        cumulative += count
+        lower = bound
+    return lower
+
+def seed_database(storage, products, stock):
+    storage.create()
+    return storage.add_products(
+        [(f"Product {i}", f"Category {i % 10}", 5.0 + i % 100, stock, "Loadgen") for i in range(products)]
+    )
+
+def run_offline(args, carts_for):
+    tmp = tempfile.mkdtemp(prefix="streamstore-loadgen-")
+    os.environ["DB_NAME"] = os.path.join(tmp, "loadgen.db")
+    os.environ["STORAGE_SHARDS"] = str(args.shards)
+    os.environ["KAFKA_BACKEND"] = "local"
+    os.environ["LOCAL_KAFKA_DIR"] = os.path.join(tmp, "kafka")
+    os.environ["ORDERS_PARTITIONS"] = str(args.partitions)
+    # Every cart comes from this one process, so the per-client rate limit is off
+    os.environ.setdefault("CHECKOUT_RATE_PER_CLIENT", "0")
+
+    # Imported only now so they pick up the scratch DB_NAME, shard count and Kafka directory
+    import main
+    import consumer
+    from kafka_clients import local_broker
+    from fastapi import HTTPException
+    from starlette.requests import Request
+    from settings import ORDERS_TOPIC
+
+    product_ids = seed_database(main.storage, args.products, args.stock)
+    carts = carts_for(product_ids)
+
+    broker = local_broker()
+    main.orders_partitions = args.partitions
+    main.catalog.refresh()
+
+    stop = threading.Event()
+    worker = consumer.OrderWorker(0, stop)
+    worker_thread = threading.Thread(target=worker.run, name="loadgen-consumer", daemon=True)
+
+    latencies = []
+    errors = {}
+
+    # The handler is called directly, skipping HTTP; admission sees one client
+    http_request = Request({
+        "type": "http", "method": "POST", "path": "/checkout", "headers": [], "client": ("loadgen", 0),
+    })
+
+    async def drive():
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def place(cart):
+            order = main.CheckoutRequest(items=[{"product_id": p, "quantity": q} for p, q in cart])
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    await main.checkout(order, http_request)
+                except HTTPException as e:
+                    errors[str(e.status_code)] = errors.get(str(e.status_code), 0) + 1
+                latencies.append(time.perf_counter() - start)
+
+        await asyncio.gather(*(place(cart) for cart in carts))
+
+    started = time.perf_counter()
+    worker_thread.start()
+    main.outbox_relay.start()
+    asyncio.run(drive())
+    checkout_done = time.perf_counter()
+
+    # Wait for the relay to publish the outbox and the consumer to commit it
+    group = consumer.consumer_config["group.id"]
+    while (main.storage.outbox_batch(1) or broker.lag(group, ORDERS_TOPIC) > 0) and worker_thread.is_alive():
+        time.sleep(0.005)
+    pipeline_done = time.perf_counter()
+    main.outbox_relay.stop()
+    stop.set()
+    worker_thread.join()
+
+    lines = sum(len(cart) for cart in carts)
+    e2e = consumer.end_to_end_seconds
+    return {
+        "checkout": {
+            **summarize(latencies),
+            "errors": errors,
+            "orders_per_second": round(len(carts) / (checkout_done - started), 1),
+        },
+        "consumer": {
+            "order_lines": lines,
+            "processed": consumer.order_lines_processed.value(),
+            "rejected": consumer.order_lines_rejected.value(),
+            "batches": consumer.batch_seconds.count(),
+            "orders_per_second": round(len(carts) / (pipeline_done - started), 1),
+            "lines_per_second": round(lines / (pipeline_done - started), 1),
+            "end_to_end_p50_ms": round(histogram_quantile(e2e, 0.50) * 1000, 3),
+            "end_to_end_p99_ms": round(histogram_quantile(e2e, 0.99) * 1000, 3),
+        },
+        "wall_seconds": round(pipeline_done - started, 3),
+    }
+
+def run_http(args, carts_for):
+    import requests
+
+    local = threading.local()
+
+    def session():
+        if not hasattr(local, "session"):
+            local.session = requests.Session()
+        return local.session
+
+    products = session().get(f"{args.target}/products", timeout=10).json()
+    carts = carts_for([p["product_id"] for p in products])
+
+    latencies = []
+    errors = {}
+    lock = threading.Lock()
+
+    def place(cart):
+        payload = {"items": [{"product_id": p, "quantity": q} for p, q in cart]}
+        start = time.perf_counter()
+        try:
+            response = session().post(f"{args.target}/checkout", json=payload, timeout=30)
+            status = response.status_code
+        except requests.RequestException as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - start
+        with lock:
+            latencies.append(elapsed)
+            if status != 200:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(place, carts))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "checkout": {
+            **summarize(latencies),
+            "errors": errors,
+            "orders_per_second": round(len(carts) / elapsed, 1),
+        },
+        "wall_seconds": round(elapsed, 3),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="Base URL of a running backend (default: offline, in-process)")
+    parser.add_argument("--orders", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--cart-sizes", default="1:0.5,2:0.25,4:0.15,8:0.1", help="size:weight,... distribution")
+    parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent for product popularity (0 = uniform)")
+    parser.add_argument("--products", type=int, default=1000, help="Catalog size (offline)")
+    parser.add_argument("--stock", type=int, default=10**9, help="Initial stock per product (offline)")
+    parser.add_argument("--partitions", type=int, default=6, help="Partitions of the fake orders topic (offline)")
+    parser.add_argument("--shards", type=int, default=1, help="SQLite shards of the storage backend (offline)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the JSON report here instead of stdout")
+    args = parser.parse_args()
+
+    sizes, weights = parse_distribution(args.cart_sizes)
+    carts_for = lambda product_ids: make_carts(args.orders, sizes, weights, product_ids, args.skew, args.seed)
+
+    # The pipeline logs to stdout; keep stdout for the report
+    with contextlib.redirect_stdout(sys.stderr):
+        results = run_http(args, carts_for) if args.target else run_offline(args, carts_for)
+    report = {
+        "mode": "http" if args.target else "offline",
+        "config": {k: v for k, v in vars(args).items() if k != "output"},
+        "python": platform.python_version(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        **results,
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+        print(f"Wrote {args.output}", file=sys.stderr)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
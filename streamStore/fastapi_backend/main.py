@@ -1,36 +1,156 @@
 from typing import Optional
-from fastapi import FastAPI, Body
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Body, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
-from db_config import query_table, add_sale, query_individual_item_price, update_inventory_quantity
+from storage import get_storage, InsufficientStock, ProductNotFound, StorageError
+from reservation import ReservationLedger
+from catalog_cache import ProductCatalogCache
+from outbox import OutboxRelay
+from order_status import OrderStatusView, status_event, PLACED, FINAL
+from admission import AdmissionController, BacklogMonitor, Overloaded
+from order_codec import encode_order
+from partitioning import group_by_partition, partition_count
+from metrics import histogram, producer_queue, render, CONTENT_TYPE
+from kafka_clients import make_producer
+from settings import ORDERS_TOPIC, ORDER_STATUS_TOPIC, ORDERS_CONSUMER_GROUP, ORDERS_PARTITIONS, CATALOG_TTL_SECONDS, RESERVATION_TTL_SECONDS
+import asyncio
 import uuid
+import time
 from fastapi import FastAPI, HTTPException
 from typing import List
 import sqlite3
-from confluent_kafka import Producer
 import json
 
 # - `localhost` (127.0.0.1) refers to the **container itself**, NOT the host machine
 # - Inside the consumer/backend container, there's NO Kafka running on port 9092
 # - So the connection is refused
 
+# Tuned for throughput: batch messages for up to 5 ms, compress whole batches,
+# and let idempotence (acks=all) make broker-side retries safe.
 producer_config = {
-    'bootstrap.servers': 'kafka:9092'
+    'enable.idempotence': True,
+    'acks': 'all',
+    'linger.ms': 5,
+    'batch.num.messages': 10000,
+    'batch.size': 1048576,
+    'compression.type': 'lz4',
+    'queue.buffering.max.messages': 100000,
+    'partitioner': 'consistent_random',  # CRC32 of the key, see partitioning.partition_for
 }
 
-producer = Producer(producer_config)
+producer = make_producer(producer_config)
+producer_queue.set_function(lambda: len(producer))
 
-def delivery_report(err, msg):
-    if err:
-        print(f"❌ Order Failed: {err}")
-    else:
-        print(f"✅ Order Delivered to topic: {msg.topic()} partition: {msg.partition()} offset: {msg.offset()} message value: {msg.value()}")
+request_seconds = histogram(
+    "http_request_duration_seconds", "Latency of API requests (including POST /checkout)", ["method", "path", "status"]
+)
+
+storage = get_storage()
+
+# Checkout only writes orders and their messages to the outbox table; this
+# thread publishes them to Kafka in batches
+outbox_relay = OutboxRelay(storage, producer)
+
+# Refuses checkouts with 429 when a client is over its rate, the pipeline is
+# backed up (outbox, producer queue, consumer lag) or too many are in flight
+backlog_monitor = BacklogMonitor(storage, ORDERS_TOPIC, ORDERS_CONSUMER_GROUP)
+admission = AdmissionController(producer, backlog_monitor)
+
+# Served from memory; kept fresh by a TTL reload plus per-row inventory-change events
+catalog = ProductCatalogCache(storage, ttl=CATALOG_TTL_SECONDS)
+
+# Stock promised to checkouts the consumer has not applied yet
+reservations = ReservationLedger(catalog.get_stock, ttl=RESERVATION_TTL_SECONDS)
+catalog.add_listener(reservations.apply_change)
+
+# Status of recent orders from the order-status topic, for GET /orders/{order_id}
+order_statuses = OrderStatusView(storage)
+order_statuses.add_listener(reservations.apply_status)
+
+# Largest page GET /products will return when paginating
+MAX_PAGE_SIZE = 1000
+
+# Longest a status request may wait for a change, and the SSE keep-alive interval
+MAX_STATUS_WAIT_SECONDS = 30.0
+SSE_KEEPALIVE_SECONDS = 15.0
+
+# Partition count of the orders topic, refreshed from broker metadata at startup
+orders_partitions = ORDERS_PARTITIONS
+
+@asynccontextmanager
+async def lifespan(app):
+    global orders_partitions
+    orders_partitions = await run_in_threadpool(partition_count, producer, ORDERS_TOPIC, ORDERS_PARTITIONS)
+    await run_in_threadpool(storage.create)
+    catalog.start()
+    order_statuses.start(asyncio.get_running_loop())
+    outbox_relay.start()
+    backlog_monitor.start()
+    yield
+    backlog_monitor.stop()
+    order_statuses.stop()
+    outbox_relay.stop()
+    producer.flush(10)
+    catalog.stop()
+    storage.close()
+
+app = FastAPI(lifespan=lifespan)
+
+@app.middleware("http")
+async def time_requests(request, call_next):
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not raw URL, to keep the series count bounded
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        request_seconds.observe(time.perf_counter() - start, method=request.method, path=path, status=status)
+
+@app.get("/metrics")
+async def read_metrics():
+    return PlainTextResponse(render(), media_type=CONTENT_TYPE)
 
-app = FastAPI()
+def _matches(if_none_match, etag):
+    """Whether an If-None-Match header value matches our (strong) ETag."""
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+def _stream_json(rows, chunk_rows=500):
+    """Encode a list of dicts as a JSON array a chunk of rows at a time."""
+    yield b"["
+    for start in range(0, len(rows), chunk_rows):
+        chunk = ",".join(json.dumps(row) for row in rows[start:start + chunk_rows])
+        yield (chunk if start == 0 else "," + chunk).encode("utf-8")
+    yield b"]"
 
 @app.get("/products")
-async def read_all_products():
-    results = query_table('ecommerce.db', 'inventory')
-    return results 
+async def read_products(
+    request: Request,
+    category: Optional[str] = None,
+    after: Optional[int] = Query(None, description="Return products with a product_id greater than this"),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+):
+    # Pages come from the in-memory catalog, keyed by product_id (keyset pagination)
+    etag, rows = catalog.page(category, after, limit)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and _matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+
+    if limit is not None and len(rows) == limit:
+        next_url = request.url.include_query_params(after=rows[-1]['product_id'])
+        headers["Link"] = f'<{next_url}>; rel="next"'
+    return StreamingResponse(_stream_json(rows), media_type="application/json", headers=headers)
 
 class CheckoutItem(BaseModel):
     product_id: int
@@ -38,45 +158,119 @@ class CheckoutItem(BaseModel):
 
 class CheckoutRequest(BaseModel):
     items: List[CheckoutItem]
+    customer_name: str = "guest"
+    customer_email: Optional[str] = None
+    shipping_address: Optional[str] = None
 
 @app.post("/checkout")
-async def checkout(order_data: CheckoutRequest):
+async def checkout(order_data: CheckoutRequest, request: Request):
+    client = request.client.host if request.client else "local"
+    try:
+        async with admission.admit(client):
+            return await place_checkout(order_data)
+    except Overloaded as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+async def place_checkout(order_data):
     order_id = str(uuid.uuid4())  # Generate order ID 
   
     try:
+        # Validate the whole cart before producing anything
+        if not order_data.items:
+            raise HTTPException(status_code=400, detail="Cart is empty")
+        for item in order_data.items:
+            if item.quantity <= 0:
+                raise HTTPException(status_code=400, detail=f"Invalid quantity for product {item.product_id}")
+        
+        # Cache misses fall back to storage, so look prices up off the event loop
+        prices = await run_in_threadpool(catalog.get_prices, [item.product_id for item in order_data.items])
+        
+        lines = []
         for item in order_data.items:
-            product_id = item.product_id
-            quantity = item.quantity
-            
-            # Validate quantity
-            if quantity <= 0:
-                raise HTTPException(status_code=400, detail=f"Invalid quantity for product {product_id}")
-            
-            unit_price = query_individual_item_price('ecommerce.db', product_id)
+            unit_price = prices[item.product_id]
             if unit_price is None:
-                raise HTTPException(status_code=404, detail=f"Product {product_id} not found")
-            
-            # dict for kafka
-            order = {
-                "order_id": order_id,
-                'product_id': product_id,
-                'quantity': quantity,
-                'unit_price': unit_price
-            }
-            
-            value = json.dumps(order).encode('utf-8')
-            producer.produce(
-                topic='orders', 
-                value=value,
-                callback=delivery_report 
+                raise HTTPException(status_code=404, detail=f"Product {item.product_id} not found")
+            lines.append((item.product_id, item.quantity, unit_price))
+        
+        # Hold the stock for the whole cart now, so an order the consumer
+        # would reject for insufficient inventory is never produced. Stock is
+        # looked up off the event loop too; the ledger only takes its lock to reserve.
+        stock = await run_in_threadpool(catalog.get_stocks, [product_id for product_id, _, _ in lines])
+        try:
+            reservations.reserve(order_id, [(product_id, quantity) for product_id, quantity, _ in lines], stock)
+        except InsufficientStock as e:
+            raise HTTPException(status_code=409, detail=f"Insufficient stock for product {e.product_id}: {e.available} available")
+        except ProductNotFound as e:
+            raise HTTPException(status_code=404, detail=f"Product {e.product_id} not found")
+        
+        # One binary record (see order_codec) per partition the cart touches,
+        # keyed by product_id so every order for a product is consumed in order,
+        # after the "placed" status event that lists every line of the cart
+        total_amount = sum(quantity * price for _, quantity, price in lines)
+        placed = status_event(order_id, PLACED, [product_id for product_id, _, _ in lines], total_amount=total_amount)
+        messages = [(ORDER_STATUS_TOPIC, order_id, placed)] + [
+            (ORDERS_TOPIC, str(group[0][0]), encode_order(order_id, group))
+            for group in group_by_partition(lines, orders_partitions).values()
+        ]
+        
+        # The order and its messages are stored in one local transaction and
+        # published by the outbox relay, so a cart is never half on the topic
+        try:
+            await run_in_threadpool(
+                storage.place_order, order_id, total_amount, messages,
+                customer_name=order_data.customer_name, customer_email=order_data.customer_email,
+                shipping_address=order_data.shipping_address,
             )
-            
-            producer.flush()
+        except BaseException:
+            reservations.release(order_id)
+            raise
+        outbox_relay.wake()
+        # Trackable right away, before the event makes the round trip through Kafka
+        order_statuses.apply(json.loads(placed))
         
         return {"order_id": order_id, "status": "success", "message": "Checkout completed successfully"}
     
-    except sqlite3.Error as e:
+    except HTTPException:
+        raise
+    except (StorageError, sqlite3.Error) as e:
         raise HTTPException(status_code=500, detail=f"Database error: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error: {str(e)}")
 
+@app.get("/orders/{order_id}")
+async def read_order_status(
+    order_id: str,
+    wait: float = Query(0, ge=0, description="Seconds to wait for the status to change past `version`"),
+    version: int = Query(0, ge=0, description="Last version the client has seen"),
+):
+    """
+    Status of an order from the in-memory view. With `wait`, this is a long
+    poll: it returns as soon as the order's version exceeds `version`.
+    """
+    if wait:
+        status = await order_statuses.wait(order_id, version, min(wait, MAX_STATUS_WAIT_SECONDS))
+    else:
+        status = order_statuses.get(order_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail=f"Order {order_id} not found")
+    return status
+
+@app.get("/orders/{order_id}/events")
+async def stream_order_status(order_id: str, request: Request):
+    """Server-sent events: the order's status on every change, until it is completed or failed."""
+    if order_statuses.get(order_id) is None:
+        raise HTTPException(status_code=404, detail=f"Order {order_id} not found")
+
+    async def events():
+        version = -1
+        while not await request.is_disconnected():
+            status = await order_statuses.wait(order_id, version, SSE_KEEPALIVE_SECONDS)
+            if status is None or status["version"] <= version:
+                yield b": keep-alive\n\n"
+                continue
+            version = status["version"]
+            yield f"event: status\ndata: {json.dumps(status)}\n\n".encode("utf-8")
+            if status["status"] in FINAL:
+                return
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
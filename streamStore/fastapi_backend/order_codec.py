@@ -0,0 +1,92 @@
+"""
+Wire format for messages on the orders topic.
+
+Schema 1 carries a whole cart in one record:
+
+    header  magic (B, always 0x00) | schema_id (H) | order_id (16s, UUID bytes)
+            | created_us (q, checkout time in microseconds since the epoch)
+            | item_count (H)
+    items   item_count x  product_id (q) | quantity (I) | unit_price (d)
+
+All fields are little-endian. Legacy messages are one JSON object per cart
+line; they always start with '{', so the leading 0x00 magic byte tells the
+two formats apart.
+"""
+import json
+import struct
+import time
+import uuid
+
+MAGIC = 0x00
+SCHEMA_V1 = 1
+
+HEADER = struct.Struct("<BH16sqH")
+ITEM = struct.Struct("<qId")
+
+MAX_ITEMS = 0xFFFF
+
+class OrderDecodeError(ValueError):
+    """The message is not a valid order in any known format."""
+
+def encode_order(order_id, items, created_us=None):
+    """
+    Encode a whole cart as one schema-1 record.
+    `items` is a list of (product_id, quantity, unit_price) tuples.
+    """
+    if len(items) > MAX_ITEMS:
+        raise ValueError(f"Too many items in one order: {len(items)}")
+    if created_us is None:
+        created_us = time.time_ns() // 1000
+
+    buf = bytearray(HEADER.size + ITEM.size * len(items))
+    HEADER.pack_into(buf, 0, MAGIC, SCHEMA_V1, uuid.UUID(order_id).bytes, created_us, len(items))
+    offset = HEADER.size
+    for product_id, quantity, unit_price in items:
+        ITEM.pack_into(buf, offset, product_id, quantity, unit_price)
+        offset += ITEM.size
+    return bytes(buf)
+
+def decode_order(value):
+    """
+    Decode an orders-topic message into a list of order-line dicts
+    ({"order_id", "product_id", "quantity", "unit_price"}, plus "created_us"
+    for binary records). Accepts both schema-1 records and legacy JSON lines.
+    """
+    view = memoryview(value)
+    if len(view) == 0:
+        raise OrderDecodeError("Empty message")
+
+    if view[0] != MAGIC:
+        return [_decode_json(value)]
+
+    if len(view) < HEADER.size:
+        raise OrderDecodeError(f"Truncated header ({len(view)} bytes)")
+    _, schema_id, order_bytes, created_us, item_count = HEADER.unpack_from(view, 0)
+    if schema_id != SCHEMA_V1:
+        raise OrderDecodeError(f"Unknown order schema id {schema_id}")
+
+    end = HEADER.size + item_count * ITEM.size
+    if len(view) != end:
+        raise OrderDecodeError(f"Expected {end} bytes for {item_count} items, got {len(view)}")
+
+    order_id = str(uuid.UUID(bytes=order_bytes))
+    # iter_unpack over a memoryview slice reads the items in place, without copying
+    return [
+        {
+            "order_id": order_id,
+            "product_id": product_id,
+            "quantity": quantity,
+            "unit_price": unit_price,
+            "created_us": created_us,
+        }
+        for product_id, quantity, unit_price in ITEM.iter_unpack(view[HEADER.size:end])
+    ]
+
+def _decode_json(value):
+    try:
+        order = json.loads(bytes(value))
+    except ValueError as e:  # JSONDecodeError or UnicodeDecodeError
+        raise OrderDecodeError(f"Failed to parse JSON message: {e}")
+    if not isinstance(order, dict):
+        raise OrderDecodeError(f"Expected a JSON object, got {type(order).__name__}")
+    return order
@@ -0,0 +1,233 @@
+import asyncio
+import json
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from confluent_kafka import KafkaError, KafkaException, TopicPartition
+from kafka_clients import make_consumer
+from metrics import counter, gauge
+from settings import ORDER_STATUS_TOPIC
+
+# Orders kept in the view; the least recently updated or read is evicted first
+ORDER_STATUS_CAPACITY = int(os.getenv("ORDER_STATUS_CAPACITY", "100000"))
+# How far back a backend starts reading the status topic, so orders placed
+# shortly before a restart stay trackable; 0 only tracks new orders
+ORDER_STATUS_REPLAY_SECONDS = float(os.getenv("ORDER_STATUS_REPLAY_SECONDS", "900"))
+
+# Events on ORDER_STATUS_TOPIC, all keyed by order_id:
+#   placed     every product_id of the cart (checkout, through the outbox)
+#   sold       product_ids whose lines were applied (order consumer)
+#   retrying   product_ids whose lines went to the retry topic
+#   failed     product_ids whose lines went to the dead letter topic
+PLACED, SOLD, RETRYING, FAILED = "placed", "sold", "retrying", "failed"
+# An order is final once completed or failed
+FINAL = {"completed", "failed"}
+
+status_events = counter("order_status_events_total", "Order status events applied to the view", ["event"])
+status_orders = gauge("order_status_view_orders", "Orders held in the order status view")
+
+def status_event(order_id, event, product_ids, reason=None, **fields):
+    """Encode one order status event as JSON bytes."""
+    payload = {"order_id": order_id, "event": event, "product_ids": list(product_ids), "at": time.time(), **fields}
+    if reason is not None:
+        payload["reason"] = reason
+    return json.dumps(payload).encode("utf-8")
+
+def order_status(entry):
+    """
+    pending     nothing applied yet
+    processing  some lines sold, others not yet
+    retrying    a line is waiting on the retry topic
+    completed   every line sold
+    failed      a line was dead-lettered
+    """
+    states = set(entry["lines"].values())
+    if FAILED in states:
+        return "failed"
+    if entry["placed"] and states == {SOLD}:
+        return "completed"
+    if RETRYING in states:
+        return "retrying"
+    if SOLD in states:
+        return "processing"
+    return "pending"
+
+class OrderStatusView:
+    """
+    Materialized view of the order status topic: the status and line
+    states of recent orders, kept in memory and bounded to `capacity`
+    orders with LRU eviction. Lookups never touch storage.
+
+    A background thread applies events; each change bumps the order's
+    `version` and wakes the requests waiting on it (long-poll and SSE),
+    which run on the event loop passed to start(). Final statuses are also
+    written to orders.status, one batch per poll.
+    """
+
+    def __init__(self, storage=None, capacity=ORDER_STATUS_CAPACITY):
+        self.storage = storage
+        self.capacity = capacity
+        self._orders = OrderedDict()  # order_id -> {"lines", "placed", "status", "version", ...}
+        self._lock = threading.Lock()
+        self._waiters = {}            # order_id -> futures on the event loop
+        self._listeners = []          # called with every event read from the topic after it is applied
+        self._loop = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def apply(self, event):
+        """Fold one decoded event into the view; returns the order's new status dict."""
+        order_id = event["order_id"]
+        kind = event["event"]
+        with self._lock:
+            entry = self._orders.get(order_id)
+            if entry is not None and kind == PLACED and entry["placed"]:
+                # Checkout applies its own event before it comes back from the topic
+                self._orders.move_to_end(order_id)
+                return self._public(order_id, entry)
+            if entry is None:
+                entry = self._orders[order_id] = {"lines": {}, "placed": False, "version": 0, "reasons": {}}
+                if len(self._orders) > self.capacity:
+                    self._orders.popitem(last=False)
+            else:
+                self._orders.move_to_end(order_id)
+
+            for product_id in event["product_ids"]:
+                if kind == PLACED:
+                    entry["lines"].setdefault(product_id, PLACED)
+                elif entry["lines"].get(product_id) not in (SOLD, FAILED):
+                    # Line outcomes only move forward; a late retry event cannot undo a sale
+                    entry["lines"][product_id] = kind
+                if event.get("reason"):
+                    entry["reasons"][product_id] = event["reason"]
+            if kind == PLACED:
+                entry["placed"] = True
+                entry["placed_at"] = event.get("at")
+                entry["total_amount"] = event.get("total_amount")
+            entry["status"] = order_status(entry)
+            entry["updated_at"] = event.get("at", time.time())
+            entry["version"] += 1
+            status = self._public(order_id, entry)
+            status_orders.set(len(self._orders))
+        status_events.inc(event=kind)
+
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._wake, order_id)
+        return status
+
+    def _public(self, order_id, entry):
+        # Caller holds self._lock
+        return {
+            "order_id": order_id,
+            "status": entry["status"],
+            "version": entry["version"],
+            "lines": [
+                {"product_id": product_id, "state": state, **({"reason": entry["reasons"][product_id]}
+                                                             if product_id in entry["reasons"] else {})}
+                for product_id, state in entry["lines"].items()
+            ],
+            "total_amount": entry.get("total_amount"),
+            "placed_at": entry.get("placed_at"),
+            "updated_at": entry["updated_at"],
+        }
+
+    def get(self, order_id):
+        """Current status dict of an order, or None if the view does not know it."""
+        with self._lock:
+            entry = self._orders.get(order_id)
+            if entry is None:
+                return None
+            self._orders.move_to_end(order_id)
+            return self._public(order_id, entry)
+
+    def _wake(self, order_id):
+        for future in self._waiters.pop(order_id, ()):
+            if not future.done():
+                future.set_result(None)
+
+    async def wait(self, order_id, version, timeout):
+        """
+        The order's status once its version is past `version`, or after
+        `timeout` seconds whatever it is then (None if still unknown).
+        """
+        status = self.get(order_id)
+        if status is not None and status["version"] > version:
+            return status
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(order_id, set()).add(future)
+        try:
+            await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            waiters = self._waiters.get(order_id)
+            if waiters is not None:
+                waiters.discard(future)
+                if not waiters:
+                    del self._waiters[order_id]
+        return self.get(order_id)
+
+    def add_listener(self, callback):
+        """Also pass every event read from the topic to `callback` (from the listener thread)."""
+        self._listeners.append(callback)
+
+    def start(self, loop=None):
+        self._loop = loop
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._listen_loop, name="order-status", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def _on_assign(self, consumer, partitions):
+        # Start ORDER_STATUS_REPLAY_SECONDS back rather than at the topic's full retention
+        if ORDER_STATUS_REPLAY_SECONDS > 0:
+            since = int((time.time() - ORDER_STATUS_REPLAY_SECONDS) * 1000)
+            try:
+                partitions = consumer.offsets_for_times(
+                    [TopicPartition(p.topic, p.partition, since) for p in partitions], timeout=10
+                )
+            except KafkaException as e:
+                print(f"⚠️ Could not look up recent order status events, tracking new ones only: {e}")
+        consumer.incremental_assign(partitions)
+
+    def _listen_loop(self):
+        # Every backend process needs every event, so each one gets its own group
+        consumer = make_consumer({
+            "group.id": f"order-status-{uuid.uuid4()}",
+            "auto.offset.reset": "latest",
+            "enable.auto.commit": False,
+            "partition.assignment.strategy": "cooperative-sticky",
+        })
+        consumer.subscribe([ORDER_STATUS_TOPIC], on_assign=self._on_assign)
+        try:
+            while not self._stop.is_set():
+                final = {}
+                for msg in consumer.consume(num_messages=500, timeout=1.0):
+                    if msg.error():
+                        if msg.error().code() != KafkaError._PARTITION_EOF:
+                            print(f"❌ Kafka Error: {msg.error()}")
+                        continue
+                    try:
+                        event = json.loads(msg.value())
+                        status = self.apply(event)
+                        for callback in self._listeners:
+                            callback(event)
+                    except Exception as e:
+                        print(f"❌ Failed to apply order status event: {e}")
+                        continue
+                    if status["status"] in FINAL:
+                        final[status["order_id"]] = status["status"]
+                if final and self.storage is not None:
+                    try:
+                        self.storage.set_order_statuses(list(final.items()))
+                    except Exception as e:
+                        print(f"⚠️ Could not record order statuses: {e}")
+        finally:
+            consumer.close()
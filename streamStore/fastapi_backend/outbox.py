@@ -0,0 +1,164 @@
+import os
+import sqlite3
+import threading
+import time
+from confluent_kafka import KafkaException
+from metrics import counter, delivery_errors, histogram, messages_delivered, produce_ack_seconds
+from storage import StorageError
+
+# Messages fetched from the outbox and published per round trip to the broker
+OUTBOX_BATCH_SIZE = int(os.getenv("OUTBOX_BATCH_SIZE", "1000"))
+# How long the relay sleeps when the outbox is empty and nobody wakes it
+OUTBOX_POLL_SECONDS = float(os.getenv("OUTBOX_POLL_SECONDS", "0.5"))
+# How long stop() waits for delivery reports still outstanding
+OUTBOX_FLUSH_TIMEOUT_SECONDS = float(os.getenv("OUTBOX_FLUSH_TIMEOUT_SECONDS", "30"))
+# How often the relay serves delivery reports while messages are in flight
+OUTBOX_DELIVERY_POLL_SECONDS = float(os.getenv("OUTBOX_DELIVERY_POLL_SECONDS", "0.01"))
+# Failed deliveries after which a message moves to outbox_dead_letter
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "10"))
+
+outbox_batch_seconds = histogram("outbox_relay_batch_duration_seconds", "Time to publish and delete one outbox batch")
+outbox_dead_lettered = counter("outbox_dead_lettered_total", "Outbox messages moved to outbox_dead_letter after repeated delivery failures")
+
+class OutboxRelay:
+    """
+    Publishes the messages checkout stored in the outbox table and deletes
+    them once the broker has acknowledged them.
+
+    Checkout only writes to SQLite; the relay is the only producer of
+    order messages (it replaces the old AsyncProducer wrapper). Its produce
+    path never blocks on the broker: it queues whatever has built up,
+    backs off on BufferError by serving delivery reports, and polls for
+    the reports between batches instead of flushing. Messages are published
+    in outbox order, at least once: if the process dies between the
+    acknowledgement and the delete, the batch is published again on restart
+    (the consumer skips lines it has already sold for an order). A message that keeps
+    failing moves to outbox_dead_letter after max_attempts so it cannot hold
+    up the ones behind it. Run one relay per database.
+    """
+
+    def __init__(self, storage, producer, batch_size=OUTBOX_BATCH_SIZE, poll_interval=OUTBOX_POLL_SECONDS,
+                 max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.storage = storage
+        self.producer = producer
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        # Delivery reports arrive after the batch that produced them, so
+        # they are kept here rather than per batch
+        self._results_lock = threading.Lock()
+        self._in_flight = set()
+        self._delivered = []
+        self._failed = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="outbox-relay", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10.0):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=timeout)
+            self._thread = None
+        # Settle what is still in flight so it is not published again on restart
+        self.producer.flush(OUTBOX_FLUSH_TIMEOUT_SECONDS)
+        try:
+            self.record_results()
+        except (StorageError, sqlite3.Error) as e:
+            print(f"❌ Outbox relay database error: {e}")
+
+    def in_flight(self):
+        """Messages produced whose delivery report has not arrived yet."""
+        with self._results_lock:
+            return len(self._in_flight)
+
+    def wake(self):
+        """Publish now instead of at the next poll (called after a checkout commits)."""
+        self._wake.set()
+
+    def _acknowledge(self, seq, topic, enqueued):
+        def on_delivery(err, msg):
+            if err:
+                delivery_errors.inc(topic=topic)
+            else:
+                produce_ack_seconds.observe(time.perf_counter() - enqueued, topic=topic)
+                messages_delivered.inc(topic=topic)
+            with self._results_lock:
+                self._in_flight.discard(seq)
+                if err:
+                    self._failed.append((seq, err))
+                else:
+                    self._delivered.append(seq)
+        return on_delivery
+
+    def record_results(self):
+        """
+        Delete the delivered messages and count a failed attempt for the
+        others, for every delivery report received so far. Returns how many
+        messages were delivered.
+        """
+        with self._results_lock:
+            delivered, self._delivered = self._delivered, []
+            failed, self._failed = self._failed, []
+        if delivered:
+            self.storage.outbox_delete(delivered)
+        if failed:
+            print(f"❌ Outbox relay: {len(failed)} messages not delivered, first error: {failed[0][1]}")
+            dead = self.storage.outbox_failed(failed, self.max_attempts)
+            if dead:
+                outbox_dead_lettered.inc(dead)
+                print(f"❌ Outbox relay: {dead} messages moved to outbox_dead_letter after {self.max_attempts} attempts")
+        return len(delivered)
+
+    def relay_once(self):
+        """Publish one batch from the outbox. Returns how many messages were delivered."""
+        rows = self.storage.outbox_batch(self.batch_size)
+        with self._results_lock:
+            # Still waiting for their delivery report from an earlier batch
+            rows = [row for row in rows if row[0] not in self._in_flight]
+            self._in_flight.update(row[0] for row in rows)
+        if not rows:
+            self.producer.poll(0)
+            return self.record_results()
+
+        start = time.perf_counter()
+        for seq, topic, key, payload in rows:
+            while True:
+                try:
+                    self.producer.produce(
+                        topic, payload, key=key, on_delivery=self._acknowledge(seq, topic, time.perf_counter())
+                    )
+                    break
+                except BufferError:
+                    # Local queue full: serve delivery reports to make room
+                    self.producer.poll(OUTBOX_DELIVERY_POLL_SECONDS)
+                except KafkaException as e:
+                    # Rejected before queueing (e.g. message too large): no report will come
+                    self._acknowledge(seq, topic, time.perf_counter())(e, None)
+                    break
+        self.producer.poll(0)
+
+        sent = self.record_results()
+        outbox_batch_seconds.observe(time.perf_counter() - start)
+        return sent
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                sent = self.relay_once()
+            except (StorageError, sqlite3.Error) as e:
+                print(f"❌ Outbox relay database error: {e}")
+                self._stop.wait(1.0)
+                continue
+            if self.in_flight():
+                # Serve delivery reports; the next pass deletes what they acknowledge
+                self.producer.poll(OUTBOX_DELIVERY_POLL_SECONDS)
+            elif sent < self.batch_size:
+                # Caught up (or the broker is failing): wait for the next checkout
+                self._wake.wait(self.poll_interval)
@@ -0,0 +1,30 @@
+import zlib
+
+def partition_for(product_id, num_partitions):
+    """
+    Partition that a product_id key lands on.
+    Same CRC32-modulo rule as librdkafka's default 'consistent_random'
+    partitioner, so messages keyed with str(product_id) agree with it.
+    """
+    return zlib.crc32(str(product_id).encode("utf-8")) % num_partitions
+
+def group_by_partition(lines, num_partitions):
+    """
+    Split order lines (product_id, quantity, unit_price) into {partition: [lines]}.
+    Every line for a given product ends up in the same group.
+    """
+    groups = {}
+    for line in lines:
+        groups.setdefault(partition_for(line[0], num_partitions), []).append(line)
+    return groups
+
+def partition_count(client, topic, default, timeout=5.0):
+    """Number of partitions of `topic` from broker metadata, or `default` if unavailable."""
+    try:
+        metadata = client.list_topics(topic, timeout=timeout).topics.get(topic)
+    except Exception as e:
+        print(f"⚠️ Could not fetch metadata for topic {topic}: {e}")
+        return default
+    if metadata is None or metadata.error is not None or not metadata.partitions:
+        return default
+    return len(metadata.partitions)
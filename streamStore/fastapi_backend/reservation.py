@@ -0,0 +1,122 @@
+import heapq
+import threading
+import time
+from order_status import FAILED, SOLD
+from storage import InsufficientStock, ProductNotFound
+
+class ReservationLedger:
+    """
+    In-memory stock holds taken at checkout, before an order is produced.
+
+    Available stock is the catalog's committed quantity (kept current by the
+    inventory changelog) minus the quantities held for orders the consumer
+    has not applied yet. A hold is released when the order status topic
+    reports its line sold or failed, or when the inventory-change event for
+    its product lists the order. `ttl` is only a fallback for events that
+    were missed, so it must be longer than the consumer may lag behind.
+
+    Holds are per process: with several backend processes each one only
+    sees its own checkouts, while the committed stock is shared.
+    """
+
+    def __init__(self, stock_of, ttl=600.0):
+        self.stock_of = stock_of  # product_id -> committed stock, or None if unknown
+        self.ttl = ttl
+        self._held = {}     # product_id -> total quantity held
+        self._holds = {}    # order_id -> (expires_at, {product_id: quantity})
+        self._expiry = []   # heap of (expires_at, order_id)
+        self._lock = threading.Lock()
+
+    def available(self, product_id):
+        """Stock that can still be promised for a product (0 if unknown)."""
+        stock = self.stock_of(product_id)
+        if stock is None:
+            return 0
+        return stock - self._held.get(product_id, 0)
+
+    def reserve(self, order_id, lines, stock=None):
+        """
+        Hold (product_id, quantity) lines for a whole cart, or nothing at all.
+        `stock` is {product_id: committed stock or None} if the caller already
+        looked it up; otherwise it is looked up here, before taking the lock,
+        so a slow lookup never holds up other reservations.
+        Raises InsufficientStock or ProductNotFound for the first line that
+        cannot be covered.
+        """
+        wanted = {}
+        for product_id, quantity in lines:
+            wanted[product_id] = wanted.get(product_id, 0) + quantity
+        if stock is None:
+            stock = {product_id: self.stock_of(product_id) for product_id in wanted}
+
+        now = time.monotonic()
+        with self._lock:
+            self._expire(now)
+            for product_id, quantity in wanted.items():
+                committed = stock.get(product_id)
+                if committed is None:
+                    raise ProductNotFound(product_id)
+                available = committed - self._held.get(product_id, 0)
+                if available < quantity:
+                    raise InsufficientStock(product_id, max(available, 0), quantity)
+
+            for product_id, quantity in wanted.items():
+                self._held[product_id] = self._held.get(product_id, 0) + quantity
+            expires_at = now + self.ttl
+            self._holds[order_id] = (expires_at, wanted)
+            heapq.heappush(self._expiry, (expires_at, order_id))
+
+    def release(self, order_id, product_id=None):
+        """Drop the hold for one product of an order, or the whole order."""
+        with self._lock:
+            self._release(order_id, product_id)
+
+    def apply_change(self, event):
+        """Release the holds an inventory-change event says were applied."""
+        product_id = event['product_id']
+        order_ids = event.get('order_ids')
+        if not order_ids:
+            return
+        with self._lock:
+            for order_id in order_ids:
+                self._release(order_id, product_id)
+
+    def apply_status(self, event):
+        """Release the lines an order-status event reports sold or failed."""
+        if event.get('event') not in (SOLD, FAILED):
+            return
+        with self._lock:
+            for product_id in event['product_ids']:
+                self._release(event['order_id'], product_id)
+
+    def expire(self):
+        with self._lock:
+            self._expire(time.monotonic())
+
+    def held(self, product_id):
+        return self._held.get(product_id, 0)
+
+    def _release(self, order_id, product_id=None):
+        hold = self._holds.get(order_id)
+        if hold is None:
+            return
+        lines = hold[1]
+        for pid in ([product_id] if product_id is not None else list(lines)):
+            quantity = lines.pop(pid, None)
+            if quantity is None:
+                continue
+            remaining = self._held[pid] - quantity
+            if remaining:
+                self._held[pid] = remaining
+            else:
+                del self._held[pid]
+        if not lines:
+            del self._holds[order_id]
+
+    def _expire(self, now):
+        # Heap entries of released orders are skipped when they surface
+        while self._expiry and self._expiry[0][0] <= now:
+            expires_at, order_id = heapq.heappop(self._expiry)
+            hold = self._holds.get(order_id)
+            if hold is not None and hold[0] == expires_at:
+                self._release(order_id)
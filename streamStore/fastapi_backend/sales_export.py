@@ -0,0 +1,166 @@
+"""
+Incremental columnar export of the sales table, plus a summary computed
+from the exported files alone.
+
+    python sales_export.py export              # only rows added since the last run
+    python sales_export.py summary --top 10    # revenue per day and top products
+
+Sales are read per shard in sale_id ranges and written as zstd-compressed
+Parquet files partitioned by day:
+
+    SALES_EXPORT_DIR/day=2026-10-17/part-s0-000000012345.parquet
+
+The last exported sale_id of every shard is kept in _export_state.json next
+to the files and only advanced after a file is written. File names are
+derived from the first sale_id they hold, so a run interrupted before the
+state update rewrites the same files instead of duplicating rows.
+"""
+import argparse
+import json
+import os
+import time
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from storage import get_storage
+
+EXPORT_DIR = os.getenv("SALES_EXPORT_DIR", "sales-export")
+CHUNK_SIZE = int(os.getenv("SALES_EXPORT_CHUNK_SIZE", "100000"))
+
+STATE_FILE = "_export_state.json"
+
+SCHEMA = pa.schema([
+    ("sale_id", pa.int64()),
+    ("order_id", pa.string()),
+    ("product_id", pa.int64()),
+    ("quantity", pa.int64()),
+    ("unit_price", pa.float64()),
+    ("subtotal", pa.float64()),
+    ("sale_date", pa.string()),
+])
+
+def load_state(export_dir):
+    """{shard: last exported sale_id}."""
+    path = os.path.join(export_dir, STATE_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return {int(shard): sale_id for shard, sale_id in json.load(f)["high_water"].items()}
+
+def save_state(export_dir, high_water):
+    path = os.path.join(export_dir, STATE_FILE)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump({"high_water": high_water, "updated_at": time.time()}, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def to_table(rows):
+    columns = list(zip(*rows))
+    # order_id is TEXT, but sample-data rows may still hold integers
+    columns[1] = [str(order_id) if order_id is not None else None for order_id in columns[1]]
+    return pa.Table.from_arrays([pa.array(values, type=field.type) for values, field in zip(columns, SCHEMA)],
+                                schema=SCHEMA)
+
+def write_chunk(export_dir, shard, rows):
+    """Write one chunk of sales, one file per day it spans. Returns the number of files."""
+    table = to_table(rows)
+    days = pc.utf8_slice_codeunits(table["sale_date"], 0, 10)
+    files = 0
+    for day in pc.unique(days).to_pylist():
+        part = table.filter(pc.equal(days, day)) if day is not None else table.filter(pc.is_null(days))
+        directory = os.path.join(export_dir, f"day={day or 'unknown'}")
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"part-s{shard}-{part['sale_id'][0].as_py():012d}.parquet")
+        tmp = path + ".tmp"
+        pq.write_table(part, tmp, compression="zstd")
+        os.replace(tmp, path)
+        files += 1
+    return files
+
+def export(storage, export_dir=EXPORT_DIR, chunk_size=CHUNK_SIZE):
+    """Export sales added since the last run; returns (rows, files)."""
+    os.makedirs(export_dir, exist_ok=True)
+    high_water = load_state(export_dir)
+    start = time.perf_counter()
+    exported = 0
+    files = 0
+    for shard, rows in storage.iter_sales(high_water, chunk_size):
+        files += write_chunk(export_dir, shard, rows)
+        high_water[shard] = rows[-1][0]
+        save_state(export_dir, high_water)
+        exported += len(rows)
+        print(f"📦 {exported} sales exported, {exported / (time.perf_counter() - start):,.0f} rows/s")
+    return exported, files
+
+def summarize(export_dir=EXPORT_DIR, top=10):
+    """
+    Revenue and units per day and the top products by revenue, computed with
+    NumPy over the Parquet files one record batch at a time.
+    """
+    dataset = ds.dataset(export_dir, format="parquet", ignore_prefixes=["_", "."],
+                         partitioning=ds.partitioning(pa.schema([("day", pa.string())]), flavor="hive"))
+    by_day = {}
+    product_ids = np.empty(0, dtype=np.int64)
+    product_revenue = np.empty(0, dtype=np.float64)
+    product_units = np.empty(0, dtype=np.int64)
+    rows = 0
+
+    for batch in dataset.to_batches(columns=["day", "product_id", "quantity", "subtotal"]):
+        if batch.num_rows == 0:
+            continue
+        rows += batch.num_rows
+        day = batch.column("day").to_numpy(zero_copy_only=False)
+        pids = batch.column("product_id").to_numpy()
+        units = batch.column("quantity").to_numpy()
+        revenue = batch.column("subtotal").to_numpy()
+
+        days, day_index = np.unique(day, return_inverse=True)
+        day_revenue = np.bincount(day_index, weights=revenue)
+        day_units = np.bincount(day_index, weights=units)
+        for d, r, u in zip(days, day_revenue, day_units):
+            totals = by_day.setdefault(str(d), [0.0, 0])
+            totals[0] += r
+            totals[1] += int(u)
+
+        # Merge this batch's per-product sums into the running ones
+        pids = np.concatenate([product_ids, pids])
+        product_ids, index = np.unique(pids, return_inverse=True)
+        product_revenue = np.bincount(index, weights=np.concatenate([product_revenue, revenue]))
+        product_units = np.bincount(index, weights=np.concatenate([product_units, units])).astype(np.int64)
+
+    order = np.argsort(product_revenue)[::-1][:top]
+    return {
+        "rows": rows,
+        "revenue": round(float(product_revenue.sum()), 2),
+        "units": int(product_units.sum()),
+        "by_day": {day: {"revenue": round(r, 2), "units": u} for day, (r, u) in sorted(by_day.items())},
+        "top_products": [
+            {"product_id": int(product_ids[i]), "revenue": round(float(product_revenue[i]), 2), "units": int(product_units[i])}
+            for i in order
+        ],
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Export sales to Parquet and summarize the export")
+    parser.add_argument("command", choices=("export", "summary"))
+    parser.add_argument("--dir", default=EXPORT_DIR)
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="sales read per range query")
+    parser.add_argument("--top", type=int, default=10, help="products in the summary")
+    args = parser.parse_args()
+
+    if args.command == "export":
+        storage = get_storage()
+        try:
+            rows, files = export(storage, args.dir, args.chunk_size)
+        finally:
+            storage.close()
+        print(f"✅ Exported {rows} sales into {files} files under {args.dir}")
+    else:
+        print(json.dumps(summarize(args.dir, args.top), indent=2))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,45 @@
+import os
+
+# Shared by the FastAPI backend and the order consumer
+DB_NAME = os.getenv("DB_NAME", "ecommerce.db")
+KAFKA_BROKER = os.getenv("KAFKA_BROKER", "kafka:9092")
+
+# Kafka clients (see kafka_clients.py): "kafka" connects to KAFKA_BROKER,
+# "local" uses fake_kafka's file-backed stand-in in LOCAL_KAFKA_DIR, shared
+# by every process on the machine that points at the same directory.
+KAFKA_BACKEND = os.getenv("KAFKA_BACKEND", "kafka")
+LOCAL_KAFKA_DIR = os.getenv("LOCAL_KAFKA_DIR", "local-kafka")
+
+# Storage backend (see storage.py). Inventory and sales are sharded across
+# STORAGE_SHARDS SQLite files by product_id; keep it a divisor of the orders
+# partition count so every partition writes to exactly one shard.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+STORAGE_SHARDS = int(os.getenv("STORAGE_SHARDS", "1"))
+
+# Topics
+ORDERS_TOPIC = "orders"
+ORDERS_CONSUMER_GROUP = "order-tracker"  # the consumer group applying orders to storage
+ORDERS_PARTITIONS = int(os.getenv("ORDERS_PARTITIONS", "6"))  # fallback when broker metadata is unavailable
+INVENTORY_CHANGES_TOPIC = "inventory-changes"  # one event per product whose stock changed
+ORDERS_RETRY_TOPIC = "orders.retry"  # failed orders waiting for their next attempt
+ORDERS_DLQ_TOPIC = "orders.dlq"      # orders that will not be retried again
+ANALYTICS_TOPIC = "sales-analytics"  # compacted: latest revenue/units per window and key
+ORDER_STATUS_TOPIC = "order-status"  # outcome events per order, keyed by order_id (see order_status.py)
+INVENTORY_CDC_TOPIC = "ecommerce.inventory"  # compacted: latest row per product_id (cdc.py)
+SALES_CDC_TOPIC = "ecommerce.sales"          # compacted: one row per sale_id (cdc.py)
+
+# Failed orders are retried with exponential backoff, then dead-lettered
+RETRY_MAX_ATTEMPTS = int(os.getenv("RETRY_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY_MS = int(os.getenv("RETRY_BASE_DELAY_MS", "1000"))
+RETRY_MAX_DELAY_MS = int(os.getenv("RETRY_MAX_DELAY_MS", "300000"))
+
+# Prometheus scrape port of the consumer process
+CONSUMER_METRICS_PORT = int(os.getenv("CONSUMER_METRICS_PORT", "9100"))
+
+# Product catalog cache in the backend
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "30"))
+
+# Stock held at checkout is released when the consumer sells or rejects the
+# line, or after this long if that event is missed. Keep it well above the
+# time the consumer needs to work off ADMISSION_MAX_CONSUMER_LAG orders.
+RESERVATION_TTL_SECONDS = float(os.getenv("RESERVATION_TTL_SECONDS", "600"))
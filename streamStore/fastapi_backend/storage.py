@@ -0,0 +1,630 @@
+import heapq
+import os
+import sqlite3
+from contextlib import ExitStack, contextmanager
+from db_config import _create_tables, timed_query, DEFERRABLE_INDEXES
+from db_pool import get_pool
+from partitioning import partition_for
+from settings import DB_NAME, STORAGE_BACKEND, STORAGE_SHARDS
+
+# Shard holding customer orders and the outbox
+ORDERS_SHARD = 0
+
+# Bound parameters per IN (...) lookup, well under SQLite's limit
+SQL_VARIABLES = 500
+
+class StorageError(Exception):
+    """The storage backend failed; the surrounding transaction is rolled back."""
+
+class ProductNotFound(Exception):
+    def __init__(self, product_id):
+        super().__init__(f"Product {product_id} not found")
+        self.product_id = product_id
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id, available, requested):
+        super().__init__(f"Insufficient stock for product {product_id}: {available} available, {requested} requested")
+        self.product_id = product_id
+        self.available = available
+        self.requested = requested
+
+class Storage:
+    """
+    What the FastAPI backend and the order consumer need from a database.
+    Implementations are registered in BACKENDS and selected with STORAGE_BACKEND.
+    """
+
+    def create(self):
+        """Create the schema if it does not exist yet."""
+        raise NotImplementedError
+
+    def list_products(self, category=None, after=None, limit=None):
+        """
+        Inventory rows as dicts, ordered by product_id. Keyset pagination:
+        only ids greater than `after`, optionally only `category`, at most `limit` rows.
+        """
+        raise NotImplementedError
+
+    def get_product(self, product_id):
+        """One inventory row as a dict, or None."""
+        raise NotImplementedError
+
+    def add_products(self, rows):
+        """Insert (product_name, category, price, quantity, supplier) rows; returns their product_ids."""
+        raise NotImplementedError
+
+    def add_product(self, product_name, category, price, quantity, supplier):
+        return self.add_products([(product_name, category, price, quantity, supplier)])[0]
+
+    def upsert_products(self, rows):
+        """
+        Insert or update (sku, product_name, category, price, quantity, supplier)
+        rows keyed by SKU, in one transaction. Returns (inserted, updated) counts.
+        """
+        raise NotImplementedError
+
+    @contextmanager
+    def bulk_load(self):
+        """Context manager for large imports: secondary indexes are rebuilt once at the end."""
+        yield
+
+    def place_order(self, order_id, total_amount, messages, customer_name="guest",
+                    customer_email=None, shipping_address=None):
+        """
+        Record a checkout: the orders row and the messages announcing it,
+        (topic, key, payload) tuples, are written to the outbox in a single
+        transaction. Either both are stored or neither is.
+        """
+        raise NotImplementedError
+
+    def set_order_statuses(self, statuses):
+        """Record (order_id, status) pairs in orders.status; order_id is the checkout UUID."""
+        raise NotImplementedError
+
+    def outbox_batch(self, limit):
+        """The oldest unpublished outbox messages as (seq, topic, key, payload) tuples."""
+        raise NotImplementedError
+
+    def outbox_delete(self, seqs):
+        """Drop outbox messages once they have been published."""
+        raise NotImplementedError
+
+    def outbox_failed(self, failures, max_attempts):
+        """
+        Count one failed delivery for each (seq, error) pair. Messages that
+        have failed `max_attempts` times move to the outbox dead letter table.
+        Returns how many moved.
+        """
+        raise NotImplementedError
+
+    def outbox_size(self):
+        """Number of outbox messages not published yet."""
+        raise NotImplementedError
+
+    def iter_sales(self, after, chunk_size):
+        """
+        Sales recorded since the last export, in sale_id order, as lists of
+        (sale_id, order_id, product_id, quantity, unit_price, subtotal, sale_date)
+        tuples of at most `chunk_size` rows. `after` maps each shard to the last
+        sale_id already exported; yields (shard, rows).
+        """
+        raise NotImplementedError
+
+    def inventory_changes(self, limit):
+        """
+        Products inserted, updated or deleted since their last acknowledged
+        change, oldest change first and at most `limit` per shard. Returns
+        (shard, changes) pairs, each change a (product_id, seq, row) tuple
+        whose row is the current inventory dict, or None if it was deleted.
+        """
+        raise NotImplementedError
+
+    def ack_inventory_changes(self, shard, changes):
+        """
+        Forget published changes, given as (product_id, seq) pairs. A product
+        that changed again since keeps its newer change.
+        """
+        raise NotImplementedError
+
+    def transaction(self, product_ids=None):
+        """
+        Context manager yielding a write transaction with claim(), has_sale(),
+        has_retry(), record_retry() and sell() methods. Committed when the block exits, rolled back if it raises.
+        """
+        raise NotImplementedError
+
+    def stored_offsets(self, topic, partitions, num_partitions):
+        """
+        {partition: next_offset} that the given partitions of `topic` can resume
+        from, according to the offsets claimed in committed transactions.
+        Partitions storage cannot vouch for are left out.
+        """
+        raise NotImplementedError
+
+    def reset_offsets(self, topic, partitions):
+        """
+        Forget the offsets and retries recorded for the given partitions of
+        `topic`, e.g. because the topic was recreated and starts at 0 again.
+        """
+        raise NotImplementedError
+
+    def identity(self):
+        """A string that changes when the underlying database is replaced (e.g. recreated)."""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+class SQLiteTransaction:
+    """
+    A batch of writes spanning one or more shards. Each shard's write lock
+    is taken (BEGIN IMMEDIATE) the first time the shard is used.
+    """
+
+    def __init__(self, storage, stack):
+        self.storage = storage
+        self._stack = stack
+        self._conns = {}    # shard -> connection with an open transaction
+        self._offsets = {}  # (shard, topic, partition) -> [stored next_offset, claimed next_offset]
+        self._stock = {}    # product_id -> stock level as of this transaction
+        self._sold = set()  # product_ids whose stock must be written back at commit
+
+    def connection(self, shard):
+        conn = self._conns.get(shard)
+        if conn is None:
+            conn = self._stack.enter_context(self.storage.pool(shard).connection())
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+            except sqlite3.Error as e:
+                raise StorageError(f"Could not lock shard {shard}: {e}") from e
+            self._conns[shard] = conn
+        return conn
+
+    def claim(self, topic, partition, offset, product_id):
+        """
+        Record that the message at `offset` is applied to the shard holding
+        `product_id` in this transaction. Returns False if that shard already
+        applied it, i.e. the message is a redelivery and must be skipped.
+        """
+        shard = self.storage.shard_for(product_id)
+        entry = self._offsets.get((shard, topic, partition))
+        if entry is None:
+            row = self.connection(shard).execute(
+                "SELECT next_offset FROM processed_offsets WHERE topic = ? AND partition = ?", (topic, partition)
+            ).fetchone()
+            entry = self._offsets[(shard, topic, partition)] = [row[0] if row else 0, None]
+        if offset < entry[0]:
+            return False
+        entry[1] = max(entry[1] or 0, offset + 1)
+        return True
+
+    def has_sale(self, order_id, product_id):
+        """Whether a sale of `product_id` is already recorded for `order_id`."""
+        return self.connection(self.storage.shard_for(product_id)).execute(
+            "SELECT 1 FROM sales WHERE order_id = ? AND product_id = ? LIMIT 1", (order_id, product_id)
+        ).fetchone() is not None
+
+    def has_retry(self, topic, partition, offset, product_id):
+        """Whether the line for `product_id` of the order first seen at `offset` was sold by a retry."""
+        return self.connection(self.storage.shard_for(product_id)).execute(
+            "SELECT 1 FROM processed_retries WHERE topic = ? AND partition = ? AND offset = ? AND product_id = ?",
+            (topic, partition, offset, product_id),
+        ).fetchone() is not None
+
+    def record_retry(self, topic, partition, offset, product_id):
+        """Record that a retry sold the line for `product_id` of the order first seen at `offset`."""
+        try:
+            self.connection(self.storage.shard_for(product_id)).execute(
+                "INSERT OR IGNORE INTO processed_retries (topic, partition, offset, product_id) VALUES (?, ?, ?, ?)",
+                (topic, partition, offset, product_id),
+            )
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+
+    def sell(self, order_id, product_id, quantity, unit_price):
+        """
+        Take `quantity` of a product out of stock and record the sale.
+        Stock is read once per product per transaction and then tracked in
+        memory; the net change is written with one UPDATE per product at
+        commit, so a run of orders for a hot product does not rewrite its
+        row every time. A rejected sale leaves nothing behind and the rest
+        of the transaction carries on.
+        Returns the new stock level.
+        """
+        conn = self.connection(self.storage.shard_for(product_id))
+        try:
+            stock = self._stock.get(product_id)
+            if stock is None:
+                row = conn.execute(
+                    "SELECT quantity_in_stock FROM inventory WHERE product_id = ?", (product_id,)
+                ).fetchone()
+                if row is None:
+                    raise ProductNotFound(product_id)
+                stock = self._stock[product_id] = row[0]
+            if stock < quantity:
+                raise InsufficientStock(product_id, stock, quantity)
+
+            # A single statement: if it fails, SQLite undoes just this insert
+            conn.execute(
+                """INSERT INTO sales (order_id, product_id, quantity, unit_price, subtotal)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (order_id, product_id, quantity, unit_price, quantity * unit_price),
+            )
+        except sqlite3.Error as e:
+            raise StorageError(str(e)) from e
+        self._stock[product_id] = stock - quantity
+        self._sold.add(product_id)
+        return stock - quantity
+
+    def commit(self):
+        # Shards commit one after another. If a later one fails the earlier ones
+        # stay committed, so callers must be able to replay the transaction.
+        for shard in sorted(self._conns):
+            conn = self._conns[shard]
+            try:
+                # Net stock changes: one UPDATE per product, however many sales it had
+                conn.executemany(
+                    "UPDATE inventory SET quantity_in_stock = ? WHERE product_id = ?",
+                    [(self._stock[product_id], product_id) for product_id in self._sold
+                     if self.storage.shard_for(product_id) == shard],
+                )
+                # Claimed offsets commit atomically with the writes they cover
+                conn.executemany(
+                    """INSERT INTO processed_offsets (topic, partition, next_offset) VALUES (?, ?, ?)
+                       ON CONFLICT (topic, partition) DO UPDATE SET next_offset = excluded.next_offset""",
+                    [(topic, partition, claimed) for (s, topic, partition), (_, claimed) in self._offsets.items()
+                     if s == shard and claimed is not None],
+                )
+                conn.commit()
+            except sqlite3.Error as e:
+                raise StorageError(f"Commit failed on shard {shard}: {e}") from e
+
+    def rollback(self):
+        for conn in self._conns.values():
+            if conn.in_transaction:
+                conn.rollback()
+
+class SQLiteStorage(Storage):
+    """
+    SQLite storage with inventory and sales split across `shards` database files.
+
+    A product and every sale of it live in shard partition_for(product_id, shards),
+    the same CRC32 rule that assigns products to partitions of the orders topic.
+    When the shard count divides the partition count each partition maps onto
+    exactly one shard, so consumer workers that own different partitions write
+    to different files instead of queueing on a single write lock.
+
+    Customer orders and the outbox are not product data and live on shard 0.
+
+    With one shard the store is simply `db_name`. With more, the shards are
+    named e.g. ecommerce.shard0.db and are seeded from `db_name` the first time
+    they are created. product_ids stay globally unique because a given id can
+    only ever be inserted into its own shard.
+    """
+
+    def __init__(self, db_name, shards=1):
+        self.db_name = db_name
+        self.shards = shards
+        if shards == 1:
+            self.paths = [db_name]
+        else:
+            base, ext = os.path.splitext(db_name)
+            self.paths = [f"{base}.shard{i}{ext or '.db'}" for i in range(shards)]
+
+    def shard_for(self, product_id):
+        return partition_for(product_id, self.shards)
+
+    def pool(self, shard):
+        return get_pool(self.paths[shard])
+
+    def create(self):
+        for shard in range(self.shards):
+            with self.pool(shard).connection() as conn:
+                _create_tables(conn)
+        if self.shards > 1 and os.path.exists(self.db_name) and not self._max_product_id():
+            self.import_database(self.db_name)
+
+    def import_database(self, source):
+        """Copy products, sales and orders from a single-file database into the shards."""
+        src = sqlite3.connect(f"file:{source}?mode=ro", uri=True)
+        try:
+            products = src.execute(
+                "SELECT product_id, product_name, category, price, quantity_in_stock, supplier, last_updated FROM inventory"
+            ).fetchall()
+            sales = src.execute(
+                "SELECT order_id, product_id, quantity, unit_price, subtotal, sale_date FROM sales"
+            ).fetchall()
+            orders = src.execute(
+                """SELECT order_id, customer_name, customer_email, order_date, total_amount, status, shipping_address
+                   FROM orders"""
+            ).fetchall()
+        finally:
+            src.close()
+
+        with self.transaction() as tx:
+            # Services sharing the files all create() at startup; only the first one imports
+            for shard in range(self.shards):
+                if tx.connection(shard).execute("SELECT 1 FROM inventory LIMIT 1").fetchone():
+                    return
+            for row in products:
+                tx.connection(self.shard_for(row[0])).execute(
+                    """INSERT OR IGNORE INTO inventory
+                       (product_id, product_name, category, price, quantity_in_stock, supplier, last_updated)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)""", row)
+            for row in sales:
+                tx.connection(self.shard_for(row[1])).execute(
+                    """INSERT INTO sales (order_id, product_id, quantity, unit_price, subtotal, sale_date)
+                       VALUES (?, ?, ?, ?, ?, ?)""", row)
+            tx.connection(ORDERS_SHARD).executemany(
+                """INSERT OR IGNORE INTO orders
+                   (order_id, customer_name, customer_email, order_date, total_amount, status, shipping_address)
+                   VALUES (?, ?, ?, ?, ?, ?, ?)""", orders)
+        print(f"Imported {len(products)} products and {len(sales)} sales from '{source}' into {self.shards} shards")
+
+    def _max_product_id(self):
+        highest = 0
+        for shard in range(self.shards):
+            with self.pool(shard).connection() as conn:
+                highest = max(highest, conn.execute("SELECT MAX(product_id) FROM inventory").fetchone()[0] or 0)
+        return highest
+
+    @timed_query
+    def list_products(self, category=None, after=None, limit=None):
+        # Fixed SQL per filter combination, so each one has a cached statement and
+        # the category filter can use idx_inventory_category (category, product_id)
+        sql = "SELECT * FROM inventory WHERE product_id > ?"
+        params = [after if after is not None else -1]
+        if category is not None:
+            sql += " AND category = ?"
+            params.append(category)
+        sql += " ORDER BY product_id"
+        if limit is not None:
+            sql += " LIMIT ?"
+            params.append(limit)
+
+        per_shard = []
+        for shard in range(self.shards):
+            with self.pool(shard).connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                cursor.execute(sql, params)
+                per_shard.append([dict(row) for row in cursor.fetchall()])
+        rows = list(heapq.merge(*per_shard, key=lambda row: row['product_id']))
+        return rows[:limit] if limit is not None else rows
+
+    @timed_query
+    def get_product(self, product_id):
+        with self.pool(self.shard_for(product_id)).connection() as conn:
+            cursor = conn.cursor()
+            cursor.row_factory = sqlite3.Row
+            cursor.execute("SELECT * FROM inventory WHERE product_id = ?", (product_id,))
+            row = cursor.fetchone()
+        return dict(row) if row else None
+
+    @timed_query
+    def add_products(self, rows):
+        # Lock every shard before reading the highest id so concurrent inserts cannot pick the same ids
+        with self.transaction() as tx:
+            conns = [tx.connection(shard) for shard in range(self.shards)]
+            next_id = 1 + max(conn.execute("SELECT MAX(product_id) FROM inventory").fetchone()[0] or 0 for conn in conns)
+            ids = list(range(next_id, next_id + len(rows)))
+            by_shard = {}
+            for product_id, row in zip(ids, rows):
+                by_shard.setdefault(self.shard_for(product_id), []).append((product_id, *row))
+            for shard, shard_rows in by_shard.items():
+                conns[shard].executemany(
+                    """INSERT INTO inventory (product_id, product_name, category, price, quantity_in_stock, supplier)
+                       VALUES (?, ?, ?, ?, ?, ?)""", shard_rows)
+        return ids
+
+    @timed_query
+    def upsert_products(self, rows):
+        # Every shard is locked: new SKUs get ids above the global maximum, and
+        # an existing SKU may live on any shard
+        with self.transaction() as tx:
+            conns = [tx.connection(shard) for shard in range(self.shards)]
+            skus = list({row[0] for row in rows})
+            ids = {}
+            for conn in conns:
+                for start in range(0, len(skus), SQL_VARIABLES):
+                    chunk = skus[start:start + SQL_VARIABLES]
+                    ids.update(conn.execute(
+                        f"SELECT sku, product_id FROM inventory WHERE sku IN ({','.join('?' * len(chunk))})", chunk
+                    ).fetchall())
+            updated = len(ids)
+
+            next_id = 1 + max(conn.execute("SELECT MAX(product_id) FROM inventory").fetchone()[0] or 0 for conn in conns)
+            by_shard = {}
+            for row in rows:
+                product_id = ids.get(row[0])
+                if product_id is None:
+                    product_id = ids[row[0]] = next_id
+                    next_id += 1
+                by_shard.setdefault(self.shard_for(product_id), []).append((product_id, *row))
+            for shard, shard_rows in by_shard.items():
+                conns[shard].executemany(
+                    """INSERT INTO inventory (product_id, sku, product_name, category, price, quantity_in_stock, supplier)
+                       VALUES (?, ?, ?, ?, ?, ?, ?)
+                       ON CONFLICT (product_id) DO UPDATE SET
+                           product_name = excluded.product_name, category = excluded.category,
+                           price = excluded.price, quantity_in_stock = excluded.quantity_in_stock,
+                           supplier = excluded.supplier, last_updated = CURRENT_TIMESTAMP""",
+                    shard_rows)
+        return len(ids) - updated, updated
+
+    @contextmanager
+    def bulk_load(self):
+        for shard in range(self.shards):
+            with self.pool(shard).connection() as conn:
+                for index in DEFERRABLE_INDEXES:
+                    conn.execute(f"DROP INDEX IF EXISTS {index}")
+                conn.commit()
+        try:
+            yield
+        finally:
+            # Recreates the dropped indexes in one pass over the table each
+            self.create()
+
+    def iter_sales(self, after, chunk_size):
+        # Keyset ranges with a short read per chunk, so the export never holds
+        # a snapshot open long enough to stall WAL checkpoints
+        for shard in range(self.shards):
+            last = after.get(shard, 0)
+            while True:
+                with self.pool(shard).connection() as conn:
+                    rows = conn.execute(
+                        """SELECT sale_id, order_id, product_id, quantity, unit_price, subtotal, sale_date
+                           FROM sales WHERE sale_id > ? ORDER BY sale_id LIMIT ?""", (last, chunk_size)
+                    ).fetchall()
+                if not rows:
+                    break
+                yield shard, rows
+                last = rows[-1][0]
+                if len(rows) < chunk_size:
+                    break
+
+    @timed_query
+    def place_order(self, order_id, total_amount, messages, customer_name="guest",
+                    customer_email=None, shipping_address=None):
+        with self.transaction() as tx:
+            conn = tx.connection(ORDERS_SHARD)
+            conn.execute(
+                """INSERT INTO orders (checkout_id, customer_name, customer_email, total_amount, shipping_address)
+                   VALUES (?, ?, ?, ?, ?)""",
+                (order_id, customer_name, customer_email, total_amount, shipping_address),
+            )
+            conn.executemany("INSERT INTO outbox (topic, message_key, payload) VALUES (?, ?, ?)", messages)
+
+    def set_order_statuses(self, statuses):
+        with self.transaction() as tx:
+            tx.connection(ORDERS_SHARD).executemany(
+                # Replayed events must not rewrite rows that already have their status
+                "UPDATE orders SET status = ? WHERE checkout_id = ? AND status IS NOT ?",
+                [(status, order_id, status) for order_id, status in statuses],
+            )
+
+    def outbox_batch(self, limit):
+        with self.pool(ORDERS_SHARD).connection() as conn:
+            return conn.execute(
+                "SELECT seq, topic, message_key, payload FROM outbox ORDER BY seq LIMIT ?", (limit,)
+            ).fetchall()
+
+    def outbox_size(self):
+        with self.pool(ORDERS_SHARD).connection() as conn:
+            return conn.execute("SELECT COUNT(*) FROM outbox").fetchone()[0]
+
+    def outbox_delete(self, seqs):
+        with self.transaction() as tx:
+            tx.connection(ORDERS_SHARD).executemany("DELETE FROM outbox WHERE seq = ?", [(seq,) for seq in seqs])
+
+    def outbox_failed(self, failures, max_attempts):
+        with self.transaction() as tx:
+            conn = tx.connection(ORDERS_SHARD)
+            conn.executemany(
+                "UPDATE outbox SET attempts = attempts + 1, last_error = ? WHERE seq = ?",
+                [(str(error), seq) for seq, error in failures],
+            )
+            params = [(seq, max_attempts) for seq, _ in failures]
+            conn.executemany(
+                """INSERT OR REPLACE INTO outbox_dead_letter (seq, topic, message_key, payload, created_at, attempts, last_error)
+                   SELECT seq, topic, message_key, payload, created_at, attempts, last_error
+                   FROM outbox WHERE seq = ? AND attempts >= ?""", params,
+            )
+            before = conn.total_changes
+            conn.executemany("DELETE FROM outbox WHERE seq = ? AND attempts >= ?", params)
+            return conn.total_changes - before
+
+    def inventory_changes(self, limit):
+        found = []
+        for shard in range(self.shards):
+            with self.pool(shard).connection() as conn:
+                cursor = conn.cursor()
+                cursor.row_factory = sqlite3.Row
+                cursor.execute(
+                    """SELECT c.product_id AS changed_id, c.seq AS changed_seq, i.*
+                       FROM inventory_changelog c LEFT JOIN inventory i ON i.product_id = c.product_id
+                       ORDER BY c.seq LIMIT ?""", (limit,))
+                changes = []
+                for row in cursor.fetchall():
+                    row = dict(row)
+                    product_id, seq = row.pop("changed_id"), row.pop("changed_seq")
+                    changes.append((product_id, seq, row if row["product_id"] is not None else None))
+            if changes:
+                found.append((shard, changes))
+        return found
+
+    def ack_inventory_changes(self, shard, changes):
+        with self.transaction() as tx:
+            tx.connection(shard).executemany(
+                "DELETE FROM inventory_changelog WHERE product_id = ? AND seq = ?", changes
+            )
+
+    def stored_offsets(self, topic, partitions, num_partitions):
+        # When the shard count divides the partition count, partition p only
+        # ever writes to shard p % shards. Otherwise any shard may hold its
+        # messages, and each one must have a record for the partition.
+        aligned = num_partitions % self.shards == 0
+        records = []
+        for shard in range(self.shards):
+            with self.pool(shard).connection() as conn:
+                records.append(dict(conn.execute(
+                    "SELECT partition, next_offset FROM processed_offsets WHERE topic = ?", (topic,)
+                ).fetchall()))
+        offsets = {}
+        for partition in partitions:
+            shards = [partition % self.shards] if aligned else range(self.shards)
+            stored = [records[shard].get(partition) for shard in shards]
+            if None not in stored:
+                offsets[partition] = min(stored)
+        return offsets
+
+    def reset_offsets(self, topic, partitions):
+        params = [(topic, partition) for partition in partitions]
+        with self.transaction() as tx:
+            for shard in range(self.shards):
+                conn = tx.connection(shard)
+                conn.executemany("DELETE FROM processed_offsets WHERE topic = ? AND partition = ?", params)
+                conn.executemany("DELETE FROM processed_retries WHERE topic = ? AND partition = ?", params)
+
+    @contextmanager
+    def transaction(self, product_ids=None):
+        """
+        Write transaction over the shards that hold `product_ids`. Those shards
+        are locked up front in shard order, so two transactions that need the
+        same shards cannot deadlock; other shards are locked on first use.
+        """
+        with ExitStack() as stack:
+            tx = SQLiteTransaction(self, stack)
+            try:
+                for shard in sorted({self.shard_for(product_id) for product_id in product_ids or ()}):
+                    tx.connection(shard)
+                yield tx
+                tx.commit()
+            except BaseException:
+                tx.rollback()
+                raise
+
+    def identity(self):
+        # A recreated or restored file gets a new inode
+        return ",".join(f"{stat.st_dev}:{stat.st_ino}" for stat in map(os.stat, self.paths))
+
+    def close(self):
+        for shard in range(self.shards):
+            self.pool(shard).close()
+
+# Available backends, selected by STORAGE_BACKEND
+BACKENDS = {
+    "sqlite": lambda: SQLiteStorage(DB_NAME, STORAGE_SHARDS),
+}
+
+_storage = None
+
+def get_storage():
+    """The process-wide storage backend configured in settings."""
+    global _storage
+    if _storage is None:
+        factory = BACKENDS.get(STORAGE_BACKEND)
+        if factory is None:
+            raise ValueError(f"Unknown STORAGE_BACKEND '{STORAGE_BACKEND}' (available: {', '.join(BACKENDS)})")
+        _storage = factory()
+    return _storage
@@ -0,0 +1,53 @@
+"""
+Shared fixtures. The services import their modules flat (python consumer.py),
+so the backend directory goes on sys.path, and settings.py reads the
+environment at import time, so it is pointed at scratch files and the
+file-backed Kafka stand-in before any test module imports it.
+
+    cd streamStore/fastapi_backend && python -m pytest tests
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+_scratch = tempfile.mkdtemp(prefix="streamstore-tests-")
+os.environ["DB_NAME"] = os.path.join(_scratch, "ecommerce.db")
+os.environ["KAFKA_BACKEND"] = "local"
+os.environ["LOCAL_KAFKA_DIR"] = os.path.join(_scratch, "local-kafka")
+os.environ["STORAGE_SHARDS"] = "1"
+os.environ["QUERY_PLAN_CHECK"] = "0"
+
+from fake_kafka import FakeBroker, FakeMessage  # noqa: E402
+from storage import SQLiteStorage  # noqa: E402
+
+def make_storage(path, shards=1, products=20, stock=100):
+    """A created SQLiteStorage at `path` holding `products` products with `stock` each."""
+    storage = SQLiteStorage(str(path), shards)
+    storage.create()
+    storage.add_products([(f"Product {i}", "Test", 10.0, stock, "Supplier") for i in range(products)])
+    return storage
+
+@pytest.fixture
+def storage(tmp_path):
+    storage = make_storage(tmp_path / "test.db")
+    yield storage
+    storage.close()
+
+@pytest.fixture
+def broker(tmp_path):
+    return FakeBroker(str(tmp_path / "kafka"), num_partitions=6)
+
+def message(value, topic="orders", partition=0, offset=0, headers=None, key=b"1"):
+    return FakeMessage(topic, partition, offset, key, value, headers)
+
+def sales_count(storage, order_id):
+    total = 0
+    for shard in range(storage.shards):
+        with storage.pool(shard).connection() as conn:
+            total += conn.execute("SELECT COUNT(*) FROM sales WHERE order_id = ?", (order_id,)).fetchone()[0]
+    return total
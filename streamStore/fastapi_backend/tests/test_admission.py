@@ -0,0 +1,82 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+from starlette.requests import Request
+
+import admission
+from admission import AdmissionController, BacklogMonitor, Overloaded
+from fake_kafka import FakeProducer
+from kafka_clients import local_broker
+
+def backlog(outbox=0, consumer_lag=0, drain_rate=0.0):
+    return SimpleNamespace(outbox=outbox, consumer_lag=consumer_lag, drain_rate=drain_rate, interval=2)
+
+def refusal(controller, client="c"):
+    async def attempt():
+        async with controller.admit(client):
+            pass
+    try:
+        asyncio.run(attempt())
+    except Overloaded as e:
+        return e.reason, e.retry_after
+    return None
+
+def test_backlog_over_its_limit_is_refused(monkeypatch):
+    monkeypatch.setattr(admission, "ADMISSION_MAX_OUTBOX", 10)
+    monkeypatch.setattr(admission, "ADMISSION_MAX_CONSUMER_LAG", 100)
+
+    assert refusal(AdmissionController(monitor=backlog(outbox=10, consumer_lag=100))) is None
+    assert refusal(AdmissionController(monitor=backlog(outbox=11))) == ("outbox_backlog", 2)
+    # 50 messages over the limit at 10 committed per second
+    assert refusal(AdmissionController(monitor=backlog(consumer_lag=150, drain_rate=10.0))) == ("consumer_lag", 5)
+    assert refusal(AdmissionController(monitor=backlog(consumer_lag=10**6, drain_rate=1.0))) == ("consumer_lag", 60)
+    assert refusal(AdmissionController(monitor=backlog(consumer_lag=101))) == ("consumer_lag", 2)
+
+def test_producer_queue_over_its_limit_is_refused(monkeypatch, broker):
+    monkeypatch.setattr(admission, "ADMISSION_MAX_PRODUCER_QUEUE", 1)
+    producer = FakeProducer(broker)
+    producer.produce("orders", b"a")
+    assert refusal(AdmissionController(producer)) is None
+    producer.produce("orders", b"b")
+    assert refusal(AdmissionController(producer)) == ("producer_queue", 1)
+
+def test_clients_are_rate_limited_separately(monkeypatch):
+    monkeypatch.setattr(admission, "CHECKOUT_RATE_PER_CLIENT", 0.5)
+    monkeypatch.setattr(admission, "CHECKOUT_BURST_PER_CLIENT", 2)
+    controller = AdmissionController()
+
+    assert [refusal(controller, "a") for _ in range(3)] == [None, None, ("rate_limited", 2)]
+    assert refusal(controller, "b") is None
+
+def test_refusals_are_429_with_retry_after(monkeypatch):
+    import main
+    monkeypatch.setattr(main, "admission", AdmissionController(monitor=backlog(outbox=10**9)))
+    request = Request({"type": "http", "method": "POST", "path": "/checkout", "headers": [], "client": ("c", 0)})
+
+    with pytest.raises(HTTPException) as refused:
+        asyncio.run(main.checkout(main.CheckoutRequest(items=[{"product_id": 1, "quantity": 1}]), request))
+    assert refused.value.status_code == 429
+    assert refused.value.headers == {"Retry-After": "2"}
+
+def test_monitor_reads_the_group_lag_without_joining_it():
+    broker = local_broker()
+    topic, group = "admission-orders", "admission-workers"
+    broker.create_topic(topic, 2)
+    producer = FakeProducer(broker)
+    for i in range(10):
+        producer.produce(topic, b"x", partition=i % 2)
+    producer.flush()
+    broker.commit(group, topic, 0, 3)
+
+    monitor = BacklogMonitor(SimpleNamespace(outbox_size=lambda: 7), topic, group)
+    assert monitor.consumer.group == f"{group}-lag-monitor"
+    monitor.sample()
+    assert (monitor.outbox, monitor.consumer_lag) == (7, 2 + 5)
+
+    broker.commit(group, topic, 1, 5)
+    monitor.sample()
+    assert monitor.consumer_lag == 2
+    assert monitor.drain_rate > 0
+    monitor.stop()
@@ -0,0 +1,80 @@
+import json
+import threading
+
+import pytest
+
+import analytics
+from analytics import SalesAnalytics, WindowAggregator
+from conftest import message
+
+@pytest.fixture
+def aggregator():
+    return WindowAggregator(bucket_seconds=60, sliding_buckets=5, lateness=30)
+
+def test_sliding_window_sums_the_last_buckets(aggregator):
+    aggregator.add(1000, 1, "c", 2, 20.0)
+    aggregator.add(1070, 1, "c", 1, 10.0)
+    assert aggregator.sliding_window(("product", 1))["units"] == 3
+    assert aggregator.sliding_window(("category", "c"))["revenue"] == 30.0
+
+    # Five buckets later the first one has slid out
+    aggregator.add(1000 + 5 * 60, 2, "c", 1, 5.0)
+    assert aggregator.sliding_window(("product", 1))["units"] == 1
+
+def test_tumbling_windows_close_at_the_watermark(aggregator):
+    aggregator.add(1000, 1, "c", 2, 20.0)
+    aggregator.tick(1000, idle=False)
+    assert aggregator.take_updates()[0]["window"] == "sliding"
+
+    aggregator.add(1100, 1, "c", 1, 10.0)  # watermark 1070 passes the 960-1020 bucket
+    aggregator.tick(1100, idle=False)
+    closed = [w for w in aggregator.take_updates() if w["window"] == "tumbling"]
+    assert {(w["dimension"], w["start"], w["units"]) for w in closed} == {("product", 960, 2), ("category", 960, 2)}
+
+    assert not aggregator.add(1000, 1, "c", 1, 10.0)  # its window has closed
+
+def test_a_sliding_key_emptied_and_published_can_slide_out(aggregator):
+    aggregator.add(1000, 1, "c", 0, 0.0)
+    aggregator.take_updates()
+    aggregator.add(1360, 2, "c", 1, 1.0)
+    assert aggregator.sliding_window(("product", 1))["units"] == 0
+
+@pytest.fixture
+def sales(tmp_path, monkeypatch):
+    monkeypatch.setattr(analytics, "STATE_DIR", str(tmp_path))
+    service = SalesAnalytics(threading.Event())
+    service.categories = {1: "c", 2: "c"}
+    yield service
+    service.consumer.close()
+
+def sale(sale_id, product_id=1, quantity=1, unit_price=10.0, shard=0):
+    return message(json.dumps({
+        "shard": shard, "sale_id": sale_id, "order_id": "o", "product_id": product_id,
+        "quantity": quantity, "unit_price": unit_price,
+        "sale_date": "2026-01-01 00:00:00",
+    }).encode(), topic="ecommerce.sales")
+
+def test_republished_sales_are_counted_once(sales):
+    sales.apply(sale(1))
+    sales.apply(sale(2, quantity=2))
+    sales.apply(sale(1))              # the CDC batch was sent again
+    sales.apply(sale(1, shard=1))     # same sale_id, another shard
+    assert sales.aggregator.sliding_window(("product", 1))["units"] == 4
+
+def test_invalid_sales_are_skipped(sales):
+    sales.apply(sale(1, quantity=0))
+    sales.apply(sale(2, quantity="3"))
+    sales.apply(sale(3, product_id="1"))
+    sales.apply(message(b"not json", topic="ecommerce.sales"))
+    assert sales.aggregator.sliding == {}
+
+def test_counted_sales_survive_a_checkpoint(sales):
+    sales.apply(sale(5))
+    sales.checkpoint()
+
+    restored = SalesAnalytics(threading.Event())
+    restored.restore()
+    restored.categories = {1: "c"}
+    restored.apply(sale(5))
+    assert restored.aggregator.sliding_window(("product", 1))["units"] == 1
+    restored.consumer.close()
@@ -0,0 +1,82 @@
+import os
+import random
+import shutil
+import threading
+import time
+import uuid
+
+import consumer
+from checkpoint import OffsetCheckpoint
+from conftest import make_storage
+from consumer import OrderWorker
+from fake_kafka import FakeBroker, FakeConsumer, FakeProducer
+from order_codec import encode_order
+from settings import ORDERS_CONSUMER_GROUP, ORDERS_TOPIC
+
+def test_offsets_survive_reopening(tmp_path):
+    path = str(tmp_path / "checkpoint")
+    checkpoint = OffsetCheckpoint(path, "db-1")
+    checkpoint.advance(0, 10)
+    checkpoint.advance(0, 5)   # never moves backwards
+    checkpoint.advance(3, 7)
+    checkpoint.advance(9999, 1)  # beyond the slots: ignored
+    checkpoint.close()
+
+    checkpoint = OffsetCheckpoint(path, "db-1")
+    assert checkpoint.offsets([0, 1, 3, 9999]) == {0: 10, 3: 7}
+    checkpoint.store(0, 4)
+    assert checkpoint.get(0) == 4
+    checkpoint.close()
+
+def test_checkpoint_of_another_database_starts_empty(tmp_path):
+    path = str(tmp_path / "checkpoint")
+    checkpoint = OffsetCheckpoint(path, "db-1")
+    checkpoint.advance(0, 10)
+    checkpoint.close()
+
+    checkpoint = OffsetCheckpoint(path, "db-2")
+    assert checkpoint.offsets([0]) == {}
+    checkpoint.close()
+
+def run_until_committed(worker, broker, timeout=30):
+    """Run an order worker until its group has committed the whole orders topic."""
+    thread = threading.Thread(target=worker.run, daemon=True)
+    thread.start()
+    deadline = time.monotonic() + timeout
+    while broker.lag(ORDERS_CONSUMER_GROUP, ORDERS_TOPIC) > 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    worker.stop_event.set()
+    thread.join(timeout)
+    assert broker.lag(ORDERS_CONSUMER_GROUP, ORDERS_TOPIC) == 0
+
+def test_lost_group_offsets_resume_from_the_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(consumer, "CHECKPOINT_PATH", str(tmp_path / "checkpoint"))
+    # 4 shards do not divide 6 partitions, so storage alone cannot vouch for every partition
+    storage = make_storage(tmp_path / "test.db", shards=4, products=40, stock=10_000)
+    kafka_dir = str(tmp_path / "kafka")
+    broker = FakeBroker(kafka_dir, num_partitions=6)
+    producer = FakeProducer(broker)
+    rng = random.Random(1)
+    for _ in range(600):
+        product_id = rng.randint(1, 40)
+        producer.produce(ORDERS_TOPIC, encode_order(str(uuid.uuid4()), [(product_id, 1, 1.0)]), key=str(product_id))
+    producer.flush()
+
+    def worker(broker):
+        return OrderWorker(0, threading.Event(), consumer=FakeConsumer(broker, consumer.consumer_config),
+                           producer=FakeProducer(broker), storage=storage)
+
+    processed = consumer.order_lines_processed.value()
+    run_until_committed(worker(broker), broker)
+    assert consumer.order_lines_processed.value() - processed == 600
+
+    # The group's committed offsets are lost
+    shutil.rmtree(os.path.join(kafka_dir, "groups", ORDERS_CONSUMER_GROUP))
+    broker = FakeBroker(kafka_dir, num_partitions=6)
+
+    processed = consumer.order_lines_processed.value()
+    duplicates = consumer.order_lines_duplicate.value()
+    run_until_committed(worker(broker), broker)
+    assert consumer.order_lines_processed.value() == processed
+    assert consumer.order_lines_duplicate.value() == duplicates  # nothing was even re-read
+    storage.close()
@@ -0,0 +1,72 @@
+import time
+import uuid
+
+import pytest
+
+import dead_letter
+from conftest import message
+from dead_letter import FailureRouter, original_position, retry_delay_ms
+from order_codec import decode_order, encode_order
+from settings import ORDERS_DLQ_TOPIC, ORDERS_RETRY_TOPIC
+
+class RecordingProducer:
+    def __init__(self):
+        self.sent = []
+
+    def produce(self, topic, value, key=None, headers=None):
+        self.sent.append((topic, value, key, dict(headers)))
+
+    def poll(self, timeout=0):
+        return 0
+
+@pytest.fixture
+def router():
+    return FailureRouter(RecordingProducer())
+
+def routed(router, msg, orders=None, reason="insufficient_stock"):
+    topic = router.route(msg, orders, reason)
+    assert router.producer.sent[-1][0] == topic
+    return router.producer.sent[-1]
+
+def test_a_fresh_failure_is_scheduled_for_retry(router):
+    before = int(time.time() * 1000)
+    topic, _, key, headers = routed(router, message(b"order", partition=2, offset=7, key=b"5"))
+
+    assert (topic, key) == (ORDERS_RETRY_TOPIC, b"5")
+    assert headers["x-attempt"] == "2"
+    assert headers["x-failure-reason"] == "insufficient_stock"
+    assert int(headers["x-retry-at"]) - before >= retry_delay_ms(1)
+    assert (headers["x-original-topic"], headers["x-original-partition"], headers["x-original-offset"]) == ("orders", "2", "7")
+
+def test_a_retried_order_keeps_its_original_position(router):
+    _, _, _, first = routed(router, message(b"order", partition=2, offset=7))
+    retried = message(b"order", topic=ORDERS_RETRY_TOPIC, partition=0, offset=40,
+                      headers=[(k, v.encode()) for k, v in first.items()])
+
+    _, _, _, headers = routed(router, retried)
+    assert headers["x-attempt"] == "3"
+    assert original_position(retried) == ("orders", 2, 7)
+    assert (headers["x-original-topic"], headers["x-original-offset"]) == ("orders", "7")
+
+def test_the_last_attempt_goes_to_the_dlq(router, monkeypatch):
+    monkeypatch.setattr(dead_letter, "RETRY_MAX_ATTEMPTS", 3)
+    topic, _, _, headers = routed(router, message(b"order", headers=[("x-attempt", b"3")]))
+    assert topic == ORDERS_DLQ_TOPIC
+    assert headers["x-attempt"] == "3"
+    assert "x-retry-at" not in headers
+
+def test_permanent_failures_skip_the_retries(router):
+    topic, value, _, headers = routed(router, message(b"garbage"), reason="decode_error")
+    assert (topic, value) == (ORDERS_DLQ_TOPIC, b"garbage")
+    assert headers["x-attempt"] == "1"
+
+def test_only_the_failed_lines_of_a_cart_are_forwarded(router):
+    order_id = str(uuid.uuid4())
+    lines = decode_order(encode_order(order_id, [(1, 1, 2.0), (2, 3, 4.0)]))
+    _, value, _, _ = routed(router, message(b"cart"), orders=lines[1:])
+    assert [(l["order_id"], l["product_id"], l["quantity"]) for l in decode_order(value)] == [(order_id, 2, 3)]
+
+def test_backoff_doubles_up_to_the_cap(monkeypatch):
+    monkeypatch.setattr(dead_letter, "RETRY_BASE_DELAY_MS", 100)
+    monkeypatch.setattr(dead_letter, "RETRY_MAX_DELAY_MS", 500)
+    assert [retry_delay_ms(attempt) for attempt in range(1, 6)] == [100, 200, 400, 500, 500]
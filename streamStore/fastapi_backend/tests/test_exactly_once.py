@@ -0,0 +1,133 @@
+import uuid
+
+from confluent_kafka import TopicPartition
+
+import consumer
+from conftest import message, sales_count
+from consumer import OrderWorker, process_batch
+from dead_letter import HEADER_ATTEMPT, HEADER_ORIGINAL_OFFSET, HEADER_ORIGINAL_PARTITION, HEADER_ORIGINAL_TOPIC
+from fake_kafka import FakeConsumer, FakeProducer
+from order_codec import encode_order
+from settings import ORDERS_RETRY_TOPIC
+
+def retry_headers(offset, attempt=2):
+    return [
+        (HEADER_ATTEMPT, str(attempt).encode()),
+        (HEADER_ORIGINAL_TOPIC, b"orders"),
+        (HEADER_ORIGINAL_PARTITION, b"0"),
+        (HEADER_ORIGINAL_OFFSET, str(offset).encode()),
+    ]
+
+def stock_of(storage, product_id):
+    return storage.get_product(product_id)["quantity_in_stock"]
+
+def test_redelivered_batch_is_skipped(storage):
+    order_id = str(uuid.uuid4())
+    batch = [message(encode_order(order_id, [(1, 2, 10.0), (2, 1, 10.0)]), offset=0)]
+
+    assert process_batch(storage, batch) == (2, 0)
+    assert process_batch(storage, batch) == (0, 0)
+    assert sales_count(storage, order_id) == 2
+    assert stock_of(storage, 1) == 98
+
+def test_order_published_twice_by_the_outbox_is_sold_once(storage):
+    order_id = str(uuid.uuid4())
+    value = encode_order(order_id, [(1, 1, 10.0)])
+
+    process_batch(storage, [message(value, offset=0)])
+    process_batch(storage, [message(value, offset=1)])
+    assert sales_count(storage, order_id) == 1
+
+def test_retry_replayed_twice_is_sold_once(storage):
+    order_id = str(uuid.uuid4())
+    value = encode_order(order_id, [(1, 1, 10.0)])
+
+    process_batch(storage, [message(value, offset=10, headers=retry_headers(3))])
+    process_batch(storage, [message(value, offset=11, headers=retry_headers(3))])
+    assert sales_count(storage, order_id) == 1
+    assert stock_of(storage, 1) == 99
+
+def test_retries_of_different_orders_are_all_sold(storage):
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    process_batch(storage, [
+        message(encode_order(first, [(1, 1, 10.0)]), offset=10, headers=retry_headers(3)),
+        message(encode_order(second, [(1, 1, 10.0)]), offset=11, headers=retry_headers(4)),
+    ])
+    assert sales_count(storage, first) == 1
+    assert sales_count(storage, second) == 1
+
+def test_failed_retry_can_succeed_on_a_later_attempt(storage):
+    order_id = str(uuid.uuid4())
+    value = encode_order(order_id, [(1, 500, 10.0)])
+    failures = []
+
+    assert process_batch(storage, [message(value, offset=10, headers=retry_headers(3))], failures=failures) == (0, 1)
+    assert failures[0][2] == "insufficient_stock"
+
+    # Restocked before the next attempt
+    with storage.pool(0).connection() as conn:
+        conn.execute("UPDATE inventory SET quantity_in_stock = 1000 WHERE product_id = 1")
+        conn.commit()
+    assert process_batch(storage, [message(value, offset=11, headers=retry_headers(3, attempt=3))]) == (1, 0)
+    assert sales_count(storage, order_id) == 1
+
+def test_offsets_past_the_end_of_a_recreated_topic_are_dropped(storage, broker, tmp_path, monkeypatch):
+    monkeypatch.setattr(consumer, "CHECKPOINT_PATH", str(tmp_path / "checkpoint"))
+    # Offsets from the previous incarnation of the topic
+    with storage.transaction([1]) as tx:
+        tx.claim("orders", 0, 999, 1)
+    FakeProducer(broker).produce("orders", b"x", partition=0)
+    worker = OrderWorker(0, None, consumer=FakeConsumer(broker, {}), producer=FakeProducer(broker), storage=storage)
+    worker.checkpoint.advance(0, 1000)
+
+    stored = storage.stored_offsets("orders", [0], 6)
+    assert stored == {0: 1000}
+    worker.drop_stale_offsets(worker.consumer, stored)
+    assert stored == {}
+    assert storage.stored_offsets("orders", [0], 6) == {}
+    assert worker.checkpoint.offsets([0]) == {}
+
+    # The new topic's first order is applied, not skipped as a redelivery
+    order_id = str(uuid.uuid4())
+    assert process_batch(storage, [message(encode_order(order_id, [(1, 1, 10.0)]), offset=0)]) == (1, 0)
+    worker.checkpoint.close()
+
+def retry_message(order_id, offset, original_offset):
+    return message(encode_order(order_id, [(1, 1, 10.0)]), topic=ORDERS_RETRY_TOPIC, offset=offset,
+                   headers=retry_headers(original_offset))
+
+def assign(worker, *partitions):
+    worker.on_assign(worker.consumer, [TopicPartition(topic, partition) for topic, partition in partitions])
+
+def test_retry_redelivered_after_a_rebalance_is_sold_once(storage, broker, tmp_path, monkeypatch):
+    monkeypatch.setattr(consumer, "CHECKPOINT_PATH", str(tmp_path / "checkpoint"))
+    order_id = str(uuid.uuid4())
+    # The previous owner applied the retry but died before committing the
+    # retry topic offset, and the scheduler, which died too, replays it again
+    assert process_batch(storage, [retry_message(order_id, 10, 7)]) == (1, 0)
+
+    worker = OrderWorker(0, None, consumer=FakeConsumer(broker, consumer.consumer_config),
+                         producer=FakeProducer(broker), storage=storage)
+    assign(worker, ("orders", 0), (ORDERS_RETRY_TOPIC, 0))
+    assert process_batch(storage, [retry_message(order_id, 10, 7), retry_message(order_id, 11, 7)]) == (0, 0)
+    assert sales_count(storage, order_id) == 1
+    worker.checkpoint.close()
+
+def test_retries_of_a_recreated_topic_are_not_mistaken_for_old_ones(storage, broker, tmp_path, monkeypatch):
+    monkeypatch.setattr(consumer, "CHECKPOINT_PATH", str(tmp_path / "checkpoint"))
+    # A retry of orders[0]@0 was sold, then the orders topic was recreated
+    process_batch(storage, [retry_message(str(uuid.uuid4()), 10, 0)])
+    with storage.transaction([1]) as tx:
+        tx.claim("orders", 0, 999, 1)
+    FakeProducer(broker).produce("orders", b"x", partition=0)
+
+    worker = OrderWorker(0, None, consumer=FakeConsumer(broker, consumer.consumer_config),
+                         producer=FakeProducer(broker), storage=storage)
+    assign(worker, ("orders", 0))
+    assert storage.stored_offsets("orders", [0], 6) == {}
+
+    # The new orders[0]@0 is another order: its retry is sold
+    order_id = str(uuid.uuid4())
+    assert process_batch(storage, [retry_message(order_id, 11, 0)]) == (1, 0)
+    assert sales_count(storage, order_id) == 1
+    worker.checkpoint.close()
@@ -0,0 +1,96 @@
+import sqlite3
+
+import pytest
+
+from db_config import MIGRATIONS, _create_tables
+
+LATEST = MIGRATIONS[-1][0]
+
+# Schema and sample rows of a database created before migrations existed
+LEGACY_SCHEMA = """
+    CREATE TABLE inventory (
+        product_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        product_name TEXT NOT NULL,
+        category TEXT,
+        price REAL NOT NULL,
+        quantity_in_stock INTEGER NOT NULL,
+        supplier TEXT,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE TABLE orders (
+        order_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        customer_name TEXT NOT NULL,
+        customer_email TEXT,
+        order_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        total_amount REAL NOT NULL,
+        status TEXT DEFAULT 'pending',
+        shipping_address TEXT
+    );
+    CREATE TABLE sales (
+        sale_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        order_id INTEGER NOT NULL,
+        product_id INTEGER NOT NULL,
+        quantity INTEGER NOT NULL,
+        unit_price REAL NOT NULL,
+        subtotal REAL NOT NULL,
+        sale_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (order_id) REFERENCES orders(order_id),
+        FOREIGN KEY (product_id) REFERENCES inventory(product_id)
+    );
+    INSERT INTO inventory (product_name, category, price, quantity_in_stock, supplier)
+        VALUES ('Wireless Mouse', 'Electronics', 29.99, 150, 'TechSupply Co'),
+               ('USB-C Cable', 'Accessories', 12.99, 200, 'Cable World');
+    INSERT INTO orders (customer_name, total_amount) VALUES ('John Smith', 42.98);
+    INSERT INTO sales (order_id, product_id, quantity, unit_price, subtotal) VALUES (1, 1, 1, 29.99, 29.99);
+"""
+
+@pytest.fixture
+def legacy_db(tmp_path):
+    conn = sqlite3.connect(tmp_path / "legacy.db", isolation_level=None)
+    conn.executescript(LEGACY_SCHEMA)
+    yield conn
+    conn.close()
+
+def tables(conn):
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+
+def test_legacy_database_is_migrated_to_the_latest_version(legacy_db):
+    _create_tables(legacy_db)
+
+    assert legacy_db.execute("PRAGMA user_version").fetchone()[0] == LATEST
+    assert {"processed_offsets", "outbox", "inventory_changelog", "processed_retries", "outbox_dead_letter"} <= tables(legacy_db)
+    # Existing rows are kept; sales.order_id now holds text
+    assert legacy_db.execute("SELECT COUNT(*) FROM inventory").fetchone()[0] == 2
+    assert legacy_db.execute("SELECT order_id, typeof(order_id) FROM sales").fetchall() == [("1", "text")]
+    # Existing products are queued for change data capture once
+    assert legacy_db.execute("SELECT product_id, seq FROM inventory_changelog ORDER BY product_id").fetchall() == [(1, 1), (2, 2)]
+
+def test_migrating_again_is_a_no_op(legacy_db, capsys):
+    _create_tables(legacy_db)
+    capsys.readouterr()
+    schema = legacy_db.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall()
+
+    _create_tables(legacy_db)
+    assert "Schema migration" not in capsys.readouterr().out
+    assert legacy_db.execute("SELECT sql FROM sqlite_master ORDER BY name").fetchall() == schema
+
+def test_migrations_resume_from_an_intermediate_version(legacy_db, capsys):
+    cursor = legacy_db.cursor()
+    for number, _, migrate in MIGRATIONS[:3]:
+        migrate(cursor)
+        cursor.execute(f"PRAGMA user_version = {number}")
+
+    _create_tables(legacy_db)
+    applied = [line for line in capsys.readouterr().out.splitlines() if "Schema migration" in line]
+    assert len(applied) == LATEST - 3
+    assert legacy_db.execute("PRAGMA user_version").fetchone()[0] == LATEST
+
+def test_inventory_changes_are_captured_by_triggers(legacy_db):
+    _create_tables(legacy_db)
+    legacy_db.execute("DELETE FROM inventory_changelog")
+
+    legacy_db.execute("UPDATE inventory SET quantity_in_stock = 1 WHERE product_id = 2")
+    legacy_db.execute("UPDATE inventory SET quantity_in_stock = 0 WHERE product_id = 2")
+    legacy_db.execute("DELETE FROM inventory WHERE product_id = 1")
+    # One row per product, carrying its latest change
+    assert legacy_db.execute("SELECT product_id, seq FROM inventory_changelog ORDER BY seq").fetchall() == [(2, 2), (1, 3)]
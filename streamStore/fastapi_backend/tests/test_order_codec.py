@@ -0,0 +1,37 @@
+import json
+import struct
+import uuid
+
+import pytest
+
+from order_codec import HEADER, MAX_ITEMS, OrderDecodeError, decode_order, encode_order
+
+def test_round_trip():
+    order_id = str(uuid.uuid4())
+    items = [(1, 2, 9.99), (2**40, 1, 0.5)]
+    lines = decode_order(encode_order(order_id, items, created_us=123))
+
+    assert [(l["product_id"], l["quantity"], l["unit_price"]) for l in lines] == items
+    assert {l["order_id"] for l in lines} == {order_id}
+    assert {l["created_us"] for l in lines} == {123}
+
+def test_legacy_json_line():
+    line = {"order_id": 7, "product_id": 3, "quantity": 1, "unit_price": 12.5}
+    assert decode_order(json.dumps(line).encode()) == [line]
+
+@pytest.mark.parametrize("value", [
+    b"",
+    b"not json",
+    b"[1, 2]",
+    b"\x00\x01",                                                                # truncated header
+    HEADER.pack(0, 99, uuid.uuid4().bytes, 0, 0),                                # unknown schema
+    encode_order(str(uuid.uuid4()), [(1, 1, 1.0)])[:-1],                          # truncated item
+    HEADER.pack(0, 1, uuid.uuid4().bytes, 0, 2) + struct.pack("<qId", 1, 1, 1.0),  # missing item
+])
+def test_invalid_messages_are_rejected(value):
+    with pytest.raises(OrderDecodeError):
+        decode_order(value)
+
+def test_too_many_items():
+    with pytest.raises(ValueError):
+        encode_order(str(uuid.uuid4()), [(1, 1, 1.0)] * (MAX_ITEMS + 1))
@@ -0,0 +1,75 @@
+from confluent_kafka import KafkaError
+
+from fake_kafka import FakeProducer
+from outbox import OutboxRelay
+
+class FlakyProducer(FakeProducer):
+    """Fails every message for the topics in `failing`; holds back delivery reports while `stalled`."""
+
+    def __init__(self, broker, failing=()):
+        super().__init__(broker)
+        self.failing = set(failing)
+        self.stalled = False
+        self.produced = []
+
+    def produce(self, topic, value=None, key=None, on_delivery=None, **kwargs):
+        self.produced.append(value)
+        if topic in self.failing:
+            on_delivery(KafkaError(KafkaError._MSG_TIMED_OUT), None)
+            return
+        super().produce(topic, value, key=key, on_delivery=on_delivery, **kwargs)
+
+    def poll(self, timeout=0):
+        return 0 if self.stalled else super().poll(timeout)
+
+    def flush(self, timeout=None):
+        return len(self) if self.stalled else super().flush(timeout)
+
+def place(storage, *messages):
+    storage.place_order("o", 1.0, [(topic, "1", payload) for topic, payload in messages])
+
+def dead_letters(storage):
+    with storage.pool(0).connection() as conn:
+        return conn.execute("SELECT payload, attempts FROM outbox_dead_letter").fetchall()
+
+def test_a_failing_message_is_dead_lettered_and_does_not_block_the_rest(storage, broker):
+    place(storage, ("broken", b"a"), ("orders", b"b"))
+    producer = FlakyProducer(broker, failing={"broken"})
+    relay = OutboxRelay(storage, producer, batch_size=1, max_attempts=3)
+
+    for _ in range(3):
+        assert relay.relay_once() == 0
+    assert dead_letters(storage) == [(b"a", 3)]
+
+    assert relay.relay_once() == 1
+    assert storage.outbox_size() == 0
+    assert producer.produced == [b"a", b"a", b"a", b"b"]
+
+def test_late_delivery_reports_are_not_lost(storage, broker):
+    place(storage, ("orders", b"a"))
+    producer = FlakyProducer(broker)
+    relay = OutboxRelay(storage, producer)
+
+    producer.stalled = True   # the flush times out before the broker answers
+    assert relay.relay_once() == 0
+    assert relay.relay_once() == 0   # still in flight: not produced again
+    assert producer.produced == [b"a"]
+
+    producer.stalled = False
+    assert relay.relay_once() == 1
+    assert storage.outbox_size() == 0
+    assert producer.produced == [b"a"]
+
+def test_stop_settles_messages_still_in_flight(storage, broker):
+    place(storage, ("orders", b"a"))
+    producer = FlakyProducer(broker)
+    relay = OutboxRelay(storage, producer)
+
+    producer.stalled = True
+    relay.relay_once()
+    assert relay.in_flight() == 1
+
+    producer.stalled = False
+    relay.stop()
+    assert relay.in_flight() == 0
+    assert storage.outbox_size() == 0
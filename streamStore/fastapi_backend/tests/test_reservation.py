@@ -0,0 +1,74 @@
+import pytest
+
+import reservation
+from reservation import ReservationLedger
+from storage import InsufficientStock, ProductNotFound
+
+STOCK = {1: 10, 2: 5}
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(reservation.time, "monotonic", lambda: now[0])
+    return now
+
+@pytest.fixture
+def ledger(clock):
+    return ReservationLedger(STOCK.get, ttl=30)
+
+def test_a_cart_is_held_whole_or_not_at_all(ledger):
+    ledger.reserve("a", [(1, 4), (2, 5)])
+    assert (ledger.available(1), ledger.available(2)) == (6, 0)
+
+    with pytest.raises(InsufficientStock):
+        ledger.reserve("b", [(1, 1), (2, 1)])
+    assert ledger.available(1) == 6
+
+    with pytest.raises(ProductNotFound):
+        ledger.reserve("c", [(1, 1), (3, 1)])
+    assert ledger.available(1) == 6
+
+def test_repeated_lines_of_a_product_are_added_up(ledger):
+    with pytest.raises(InsufficientStock):
+        ledger.reserve("a", [(2, 3), (2, 3)])
+
+def test_holds_expire_after_the_ttl(ledger, clock):
+    ledger.reserve("a", [(2, 5)])
+    clock[0] += 29
+    ledger.expire()
+    assert ledger.available(2) == 0
+
+    clock[0] += 1
+    ledger.expire()
+    assert ledger.available(2) == 5
+    ledger.reserve("b", [(2, 5)])
+
+def test_applied_orders_release_their_holds(ledger, clock):
+    ledger.reserve("a", [(1, 4), (2, 1)])
+    ledger.apply_change({"product_id": 1, "quantity_in_stock": 6, "order_ids": ["a"]})
+    assert ledger.held(1) == 0
+    assert ledger.held(2) == 1
+
+    # Expiry of a partly released order only drops what is still held
+    clock[0] += 30
+    ledger.expire()
+    assert (ledger.held(1), ledger.held(2)) == (0, 0)
+
+def test_stock_looked_up_by_the_caller_is_used(clock):
+    def unavailable(product_id):
+        raise AssertionError("stock_of called although stock was passed")
+
+    ledger = ReservationLedger(unavailable, ttl=30)
+    ledger.reserve("a", [(1, 3)], stock={1: 3})
+    with pytest.raises(InsufficientStock):
+        ledger.reserve("b", [(1, 1)], stock={1: 3})
+
+def test_sold_and_failed_lines_release_their_holds(ledger):
+    ledger.reserve("a", [(1, 4), (2, 1)])
+    ledger.apply_status({"order_id": "a", "event": "placed", "product_ids": [1, 2]})
+    ledger.apply_status({"order_id": "a", "event": "retrying", "product_ids": [2]})
+    assert (ledger.held(1), ledger.held(2)) == (4, 1)
+
+    ledger.apply_status({"order_id": "a", "event": "sold", "product_ids": [1]})
+    ledger.apply_status({"order_id": "a", "event": "failed", "product_ids": [2]})
+    assert (ledger.held(1), ledger.held(2)) == (0, 0)
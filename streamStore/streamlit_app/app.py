@@ -1,9 +1,17 @@
 import streamlit as st 
 import os
 import requests 
+from backend_client import BackendClient
 
 BACKEND_URL = os.getenv("BACKEND_URL", "http://localhost:8000")
 
+@st.cache_resource
+def get_client():
+    # One pooled client (and catalog cache) for every session and rerun
+    return BackendClient(BACKEND_URL)
+
+client = get_client()
+
 st.set_page_config(page_title="streamStore 🛒", layout="wide")
 st.title("🛒 Stream Store")
 
@@ -11,6 +19,14 @@ st.title("🛒 Stream Store")
 if 'cart' not in st.session_state:
     st.session_state.cart = []
 
+# Number of catalog pages shown; "Load more" adds one
+if 'pages' not in st.session_state:
+    st.session_state.pages = 1
+
+# Status of the last order placed in this session, from GET /orders/{order_id}
+if 'last_order' not in st.session_state:
+    st.session_state.last_order = None
+
 
 # Sidebar: Shopping Cart Display
 with st.sidebar: 
@@ -26,31 +42,56 @@ with st.sidebar:
         
         if st.button("Checkout", use_container_width=True):
             # Prepare order payload
-            order_data = {
-                "items": [
-                    {
-                        "product_id": item["product_id"],
-                        "quantity": item["quantity"]
-                    }
-                    for item in st.session_state.cart
-                ]
-            }
+            items = [
+                {
+                    "product_id": item["product_id"],
+                    "quantity": item["quantity"]
+                }
+                for item in st.session_state.cart
+            ]
             
             try:
                 # Make POST request to backend
-                response = requests.post(f"{BACKEND_URL}/checkout", json=order_data)
+                response = client.checkout(items)
                 if response.status_code == 200:
                     st.success("✅ Order placed successfully!")
+                    st.session_state.last_order = {"order_id": response.json()["order_id"], "status": "pending", "version": 0}
                     st.session_state.cart = []  # Clear cart
+                    client.invalidate()  # stock levels changed
                     st.rerun()
+                elif response.status_code == 429:
+                    st.warning(f"⏳ The store is busy, please try again in {response.headers.get('Retry-After', 'a few')} seconds.")
                 else:
                     st.error(f"❌ Checkout failed: {response.text}")
             except Exception as e:
                 st.error(f"⚠️ Error connecting to backend: {str(e)}")
 
-response = requests.get(f"{BACKEND_URL}/products")
-if response.status_code == 200:
-    products = response.json()
+    order = st.session_state.last_order
+    if order is not None:
+        st.header('📦 Your Order')
+        try:
+            if order["status"] not in ("completed", "failed"):
+                # The button waits (long poll) until the status changes instead of polling repeatedly
+                wait = 10 if st.button("Wait for update", use_container_width=True) else 0
+                order = client.order_status(order["order_id"], version=order["version"], wait=wait) or order
+                st.session_state.last_order = order
+        except Exception as e:
+            st.error(f"⚠️ Could not fetch order status: {str(e)}")
+        st.markdown(f"Order `{order['order_id'][:8]}`: **{order['status']}**")
+        for line in order.get("lines", []):
+            st.caption(f"Product {line['product_id']}: {line['state']}" + (f" ({line['reason']})" if line.get("reason") else ""))
+
+# Load the catalog a page at a time; pages are cached by the client across reruns
+products = []
+next_after = None
+try:
+    for _ in range(st.session_state.pages):
+        rows, next_after = client.products_page(after=next_after)
+        products.extend(rows)
+        if next_after is None:
+            break
+except requests.RequestException as e:
+    st.error(f"⚠️ Error connecting to backend: {str(e)}")
 
 # Display products in columns
 cols = st.columns(3)
@@ -99,4 +140,8 @@ for idx, product in enumerate(products):
                 })
                 st.success(f"✅ Added {quantity} × {product['product_name']} to cart!")
             
-            st.rerun()  # Refresh UI to show updated cart
\ No newline at end of file
+            st.rerun()  # Refresh UI to show updated cart
+
+if next_after is not None and st.button("Load more products", use_container_width=True):
+    st.session_state.pages += 1
+    st.rerun()
@@ -0,0 +1,100 @@
+import threading
+import time
+from urllib.parse import parse_qs, urlparse
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# (connect, read) seconds
+TIMEOUT = (3.05, 10)
+
+class BackendClient:
+    """
+    Client for the streamStore backend, shared by every Streamlit session.
+
+    Requests go through one keep-alive requests.Session with a bounded
+    connection pool and timeouts; idempotent GETs are retried on connection
+    errors. Catalog pages are cached in memory: for `ttl` seconds they are
+    served without a request, after that they are revalidated with
+    If-None-Match, so an unchanged catalog costs a 304 with no body.
+    """
+
+    def __init__(self, base_url, ttl=5.0, page_size=30, pool_size=10):
+        self.base_url = base_url.rstrip("/")
+        self.ttl = ttl
+        self.page_size = page_size
+        self.session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=2, backoff_factor=0.2, allowed_methods={"GET"}),
+        )
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pages = {}  # (category, after) -> {"fetched_at", "etag", "rows", "next_after"}
+        self._lock = threading.Lock()
+
+    def products_page(self, after=None, category=None):
+        """
+        One page of the catalog in product_id order, starting after `after`.
+        Returns (rows, next_after); next_after is None on the last page.
+        """
+        key = (category, after)
+        with self._lock:
+            cached = self._pages.get(key)
+        if cached is not None and time.monotonic() - cached["fetched_at"] < self.ttl:
+            return cached["rows"], cached["next_after"]
+
+        params = {"limit": self.page_size}
+        if after is not None:
+            params["after"] = after
+        if category is not None:
+            params["category"] = category
+        headers = {"If-None-Match": cached["etag"]} if cached is not None and cached["etag"] else {}
+
+        response = self.session.get(f"{self.base_url}/products", params=params, headers=headers, timeout=TIMEOUT)
+        if response.status_code == 304 and cached is not None:
+            entry = {**cached, "fetched_at": time.monotonic()}
+        else:
+            response.raise_for_status()
+            entry = {
+                "fetched_at": time.monotonic(),
+                "etag": response.headers.get("ETag"),
+                "rows": response.json(),
+                "next_after": self._next_after(response),
+            }
+        with self._lock:
+            self._pages[key] = entry
+        return entry["rows"], entry["next_after"]
+
+    def _next_after(self, response):
+        # The backend advertises the next page in a Link: <...?after=N>; rel="next" header
+        link = response.links.get("next")
+        if link is None:
+            return None
+        after = parse_qs(urlparse(link["url"]).query).get("after")
+        return int(after[0]) if after else None
+
+    def checkout(self, items):
+        """POST /checkout (never retried: a checkout is not idempotent)."""
+        return self.session.post(f"{self.base_url}/checkout", json={"items": items}, timeout=TIMEOUT)
+
+    def order_status(self, order_id, version=0, wait=0):
+        """
+        GET /orders/{order_id}; None if the backend does not know the order.
+        With `wait`, a long poll that returns as soon as the status is past `version`.
+        """
+        response = self.session.get(
+            f"{self.base_url}/orders/{order_id}",
+            params={"version": version, "wait": wait},
+            timeout=(TIMEOUT[0], TIMEOUT[1] + wait),
+        )
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    def invalidate(self):
+        """Drop cached pages, e.g. after a checkout changed stock levels."""
+        with self._lock:
+            self._pages.clear()